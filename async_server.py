@@ -0,0 +1,386 @@
+"""
+    async_server.py
+    dechat server running on asyncio
+
+    Runs the same channels and commands as server.py, but every connection
+    is an asyncio.Protocol and timers are scheduled on the event loop
+"""
+
+import asyncio
+import functools
+import logging
+import socket
+import sys
+from server import (
+    parse_arguments,
+    handle_message,
+    close_connection,
+    check_peers,
+    start_metrics_server,
+    start_authentication,
+    finish_authentications
+)
+from src.authenticator import HAS_CRYPTO
+from src.logger import setup_logging_from_arguments, LOGGING_USAGE
+from src.commons import ServerMembers, ServerConnectionInfo
+from src.message import CLOSE_MESSAGE
+from src.commands.server_commands import server_command_map
+from src.constants import (
+    DEFAULT_HIGH_WATER_MARK,
+    DEFAULT_SLOW_CONSUMER_POLICY,
+    SLOW_CONSUMER_POLICIES,
+    SLOW_CONSUMER_DISCONNECT,
+    RELAY_BATCH_BYTES,
+    PEER_CHECK_INTERVAL
+)
+
+logger = logging.getLogger("dechat.server")
+
+
+class TransportConnection:
+    """
+    Stands in for a socket so channels, commands and message_send can send
+    to an asyncio connection without knowing the difference
+
+    Writes never block. Once more than the high-water mark is waiting in
+    the transport, the slow consumer policy kicks in. The transport's
+    buffer can't be trimmed, so coalesce drops new messages like drop does
+
+    Batched writes (relays to a linked server) are collected for
+    batch_window seconds, or until RELAY_BATCH_BYTES are waiting, then
+    written together
+    """
+
+    __slots__ = ("transport", "high_water_mark", "policy",
+                 "batch_window", "batch", "batch_size")
+
+    def __init__(self, transport: asyncio.Transport, high_water_mark: int,
+                 policy: str, batch_window: float = 0.0) -> None:
+        self.transport = transport
+        self.high_water_mark = high_water_mark
+        self.policy = policy
+
+        self.batch_window = batch_window
+        self.batch = []
+        self.batch_size = 0
+
+    def send_batched(self, data: bytes) -> None:
+        """
+        Adds data to the batch, which is written once the batch window ends
+        """
+        if not self.batch:
+            asyncio.get_running_loop().call_later(self.batch_window,
+                                                  self.flush_batch)
+
+        self.batch.append(data)
+        self.batch_size += len(data)
+
+        if self.batch_size >= RELAY_BATCH_BYTES:
+            self.flush_batch()
+
+    def flush_batch(self) -> None:
+        """
+        Writes everything batched so far in one write
+        """
+        if not self.batch:
+            return
+
+        data = b"".join(self.batch)
+
+        self.batch = []
+        self.batch_size = 0
+
+        self.sendall(data)
+
+    def sendall(self, data: bytes) -> None:
+        """
+        Writes data to the transport, after anything batched so it keeps its
+        order
+        """
+        if self.batch:
+            self.flush_batch()
+
+        transport = self.transport
+
+        if transport.is_closing():
+            return
+
+        if transport.get_write_buffer_size() > self.high_water_mark:
+            if self.policy == SLOW_CONSUMER_DISCONNECT:
+                address = self.getpeername()
+                logger.warning("Connection %s is too slow, closing it",
+                               address, extra={"conn": address})
+                transport.abort()
+
+            return
+
+        transport.write(data)
+
+    def close(self) -> None:
+        """
+        Closes the transport once everything queued has been written
+        """
+        self.transport.close()
+
+    def fileno(self) -> int:
+        """
+        File descriptor of the underlying socket, or -1 once closed
+        """
+        sock = self.transport.get_extra_info("socket")
+
+        if sock is None:
+            return -1
+
+        return sock.fileno()
+
+    def getpeername(self) -> tuple:
+        """
+        Address of the other end of the connection
+        """
+        return self.transport.get_extra_info("peername")
+
+
+class DechatProtocol(asyncio.Protocol):
+    """
+    One client or server connection. Decodes messages as they arrive and
+    hands them to the same handler the selector server uses
+    """
+
+    def __init__(self, s_mems: ServerMembers, is_server: bool = False) -> None:
+        self.s_mems = s_mems
+        self.is_server = is_server
+        self.conn_info = None
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        s_mems = self.s_mems
+
+        connection = TransportConnection(
+            transport, s_mems.high_water_mark, s_mems.slow_consumer_policy,
+            s_mems.relay_batch_window or 0.0
+        )
+
+        self.conn_info = ServerConnectionInfo(
+            connection,
+            is_server=self.is_server,
+            address=connection.getpeername()
+        )
+
+        s_mems.conns[connection] = self.conn_info
+
+        if not self.is_server:
+            if s_mems.authenticator is None:
+                server_command_map["motd"](None, connection, s_mems)
+            else:
+                start_authentication(self.conn_info, s_mems)
+
+            address = self.conn_info.address
+            logger.info("New Connection! %s", address,
+                        extra={"conn": address})
+
+    def data_received(self, data: bytes) -> None:
+        conn_info = self.conn_info
+        metrics = self.s_mems.metrics
+
+        if metrics is None:
+            messages = conn_info.reader.feed(data)
+        else:
+            messages = metrics.feed(conn_info.reader, data)
+
+        # Checked once per read so disabled debug logging costs nothing per
+        # message
+        debug = logger.isEnabledFor(logging.DEBUG)
+
+        for message_obj in messages:
+
+            if message_obj == CLOSE_MESSAGE:
+                close_connection(conn_info, self.s_mems)
+                return
+
+            if debug:
+                logger.debug("Message received from %s", conn_info.address,
+                             extra={"conn": conn_info.address})
+
+            handle_message(message_obj, conn_info, self.s_mems)
+
+            # Closed by the message
+            if conn_info.connection not in self.s_mems.conns:
+                return
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        if self.conn_info.connection in self.s_mems.conns:
+            close_connection(self.conn_info, self.s_mems)
+
+
+class LoopTimers:
+    """
+    Schedules expiries on the event loop with call_later, in place of the
+    timer wheel the selector server sweeps
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        self.pending = 0
+
+    def __len__(self) -> int:
+        return self.pending
+
+    def schedule(self, delay: float, callback: callable, *args) -> None:
+        """
+        Calls callback(*args) once delay seconds have passed
+        """
+        self.pending += 1
+        self.loop.call_later(delay, self.fire, callback, args)
+
+    def fire(self, callback: callable, args: tuple) -> None:
+        """
+        Calls a timer's callback once it is due
+        """
+        self.pending -= 1
+        callback(*args)
+
+    def advance(self, _now: float = None) -> int:
+        """
+        Does nothing, as the event loop fires timers itself
+        """
+        return 0
+
+
+def wake_for_authentications(loop: asyncio.AbstractEventLoop,
+                             s_mems: ServerMembers) -> None:
+    """
+    Has the event loop let in (or close) connections whose signature has
+    been checked. Called from the authenticator's thread pool
+    """
+    try:
+        loop.call_soon_threadsafe(finish_authentications, s_mems)
+    except RuntimeError:  # Loop closed while the server was shutting down
+        pass
+
+
+async def connect_server(s_mems: ServerMembers, hostname: str,
+                         port: int) -> TransportConnection:
+    """
+    Connects to another server, e.g. to link a channel with it
+
+    Raises OSError if the connection can't be made
+    """
+    loop = asyncio.get_running_loop()
+
+    _, protocol = await loop.create_connection(
+        lambda: DechatProtocol(s_mems, is_server=True), hostname, port
+    )
+
+    return protocol.conn_info.connection
+
+
+def main():
+    """
+        main
+        Entrypoint for the asyncio server
+    """
+
+    arguments = parse_arguments(sys.argv)
+
+    if (arguments is None or arguments[2] > 1 or
+            not setup_logging_from_arguments(sys.argv)):
+        print(
+            "Usage: async_server.py [hostname port] "
+            "[--high-water-mark=<bytes>] "
+            f"[--slow-consumer=<{'|'.join(SLOW_CONSUMER_POLICIES)}>] "
+            "[--log-dir=<path>] [--metrics] [--metrics-port=<port>] "
+            f"[--relay-batch-window=<ms>] [--auth] {LOGGING_USAGE}"
+        )
+        return
+
+    host, port, _, options = arguments
+
+    asyncio.run(run_server(host, port, **options))
+
+
+async def run_server(hostname="localhost", port=9996,
+                     high_water_mark=DEFAULT_HIGH_WATER_MARK,
+                     slow_consumer_policy=DEFAULT_SLOW_CONSUMER_POLICY,
+                     log_directory=None, metrics=False, metrics_port=None,
+                     relay_batch_window=None, auth=False):
+    """
+    Runs the server
+    :: hostname : str :: hostname to run on, default "localhost"
+    :: port : int :: port to run on, default 9996
+    :: high_water_mark : int :: Bytes a connection can have queued before
+                                the slow consumer policy kicks in
+    :: slow_consumer_policy : str :: What to do with a connection over the
+                                     high-water mark (see constants.py)
+    :: log_directory : str :: Directory to keep channel history in, default
+                              None which keeps history in memory only
+    :: metrics : bool :: Whether to collect metrics for /stats, default
+                         False
+    :: metrics_port : int :: Port to serve metrics over HTTP on (localhost
+                             only), default None which doesn't serve them
+    :: relay_batch_window : float :: Seconds to hold relays to linked
+                                     servers that batch too, so they are
+                                     sent together. Default None which
+                                     sends each relay on its own
+    :: auth : bool :: Whether clients have to sign in with their key (see
+                      authenticator.py), default False
+    """
+
+    if auth and not HAS_CRYPTO:
+        logger.error("--auth needs pycryptodome, which isn't installed")
+        return
+
+    loop = asyncio.get_running_loop()
+
+    s_mems = ServerMembers(hostname, port, high_water_mark,
+                           slow_consumer_policy, log_directory,
+                           relay_batch_window)
+
+    s_mems.timers = LoopTimers(loop)
+    s_mems.quit_event = asyncio.Event()
+    s_mems.connector = functools.partial(connect_server, s_mems)
+
+    s_mems.timers.schedule(PEER_CHECK_INTERVAL, check_peers, s_mems)
+
+    metrics_server = None
+
+    if auth:
+        s_mems.enable_authentication().on_result = functools.partial(
+            wake_for_authentications, loop, s_mems
+        )
+
+    if metrics or metrics_port is not None:
+        s_mems.enable_metrics()
+
+    if metrics_port is not None:
+        metrics_server = start_metrics_server(s_mems, metrics_port)
+
+    try:
+        server = await loop.create_server(
+            lambda: DechatProtocol(s_mems), hostname, port,
+            backlog=socket.SOMAXCONN
+        )
+    except OSError:
+        logger.error("Server setup not successful, please try again")
+        return
+
+    logger.info("Hosting on %s:%d", hostname, port)
+
+    # Nothing to poll: connections, timers and sign-ins all wake the loop
+    # themselves
+    await s_mems.quit_event.wait()
+
+    server.close()
+
+    if s_mems.authenticator is not None:
+        s_mems.authenticator.close()
+
+    for conn_info in list(s_mems.conns.values()):
+        conn_info.connection.close()
+
+    s_mems.selector.close()
+
+    if metrics_server is not None:
+        metrics_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Micro-benchmark comparing AliasDictionary with the original implementation,
+which scanned every alias when deleting and copied every key when iterating
+
+Usage: python3 benchmarks/alias_dictionary_bench.py [number of entries]
+"""
+
+# pylint: disable=import-error, wrong-import-position
+
+import sys
+import time
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+from src.alias_dictionary import AliasDictionary
+
+DEFAULT_ENTRIES = 100_000
+
+# The original deletes are O(entries) each, so only this many are timed
+DELETIONS = 1_000
+ITERATIONS = 20
+
+
+class LegacyAliasDictionary(AliasDictionary):
+    """
+    The original deletion and iteration, without the reverse index
+    """
+
+    def __delitem__(self, key):
+        recurse = False
+
+        aliased_key = self.aliases.get(key, key)
+
+        if aliased_key == key:
+            del self.dict[aliased_key]
+        else:
+            recurse = True
+            del self.aliases[key]
+
+        marked_for_deletion = set()
+
+        for alias, i_key in self.aliases.items():
+            if aliased_key == i_key:
+                marked_for_deletion.add(alias)
+
+        for alias in marked_for_deletion:
+            del self.aliases[alias]
+
+        if recurse:
+            self.__delitem__(aliased_key)
+
+    def __iter__(self):
+        alias_keys = self.aliases.keys()
+        all_keys = list(self.dict.keys())
+        all_keys.extend(alias_keys)
+
+        return iter(all_keys)
+
+
+def fill(dictionary: AliasDictionary, num_entries: int) -> AliasDictionary:
+    """
+    Adds num_entries channels the way the server does, by id with the name
+    as an alias
+    """
+    for i in range(num_entries):
+        dictionary[i] = i
+        dictionary.add_alias(i, f"channel_{i}")
+
+    return dictionary
+
+
+def bench(label: str, func: callable, num_ops: int) -> float:
+    """
+    Times a function that does num_ops operations and prints the result
+
+    Returns the time taken in seconds
+    """
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{label:<28}{elapsed:>8.3f}s"
+        f"{elapsed / num_ops * 1e6:>12.2f} us/op"
+    )
+
+    return elapsed
+
+
+def main() -> None:
+    """
+    Runs the benchmark
+    """
+    num_entries = DEFAULT_ENTRIES
+
+    if len(sys.argv) >= 2:
+        num_entries = int(sys.argv[1])
+
+    print(f"{num_entries:,} entries, each with an alias\n")
+
+    results = {}
+
+    for label, cls in (("legacy", LegacyAliasDictionary),
+                       ("reverse index", AliasDictionary)):
+        dictionary = fill(cls(), num_entries)
+
+        # Alternates deleting by id and by name, spread across the entries
+        step = max(num_entries // DELETIONS, 1)
+        keys = [
+            i if i % 2 else f"channel_{i}"
+            for i in range(0, num_entries, step)
+        ][:DELETIONS]
+
+        def delete(dictionary=dictionary, keys=keys) -> None:
+            for key in keys:
+                del dictionary[key]
+
+        def iterate(dictionary=dictionary) -> None:
+            for _ in range(ITERATIONS):
+                for _key in dictionary:
+                    pass
+
+        print(label)
+        results[label] = (
+            bench("  delete", delete, len(keys)),
+            bench("  iterate keys and aliases", iterate, ITERATIONS)
+        )
+
+        assert len(dictionary) == num_entries - len(keys)
+        assert len(dictionary.aliases) == num_entries - len(keys)
+
+    legacy, indexed = results["legacy"], results["reverse index"]
+
+    print("\nSpeedup")
+    print(f"  delete  {legacy[0] / indexed[0]:.1f}x")
+    print(f"  iterate {legacy[1] / indexed[1]:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Login storm benchmark for servers started with --auth. Starts run_server
+locally, then bot processes open every connection at once and sign in on
+all of them, each signing its challenges with its own key
+
+Reports handshakes/s and p50/p99/p999 latency for the whole handshake (from
+connecting to being signed in) and for verification alone (from sending the
+signed challenge to being signed in)
+
+Usage: python3 benchmarks/auth_bench.py [--logins=<n>] [--bots=<processes>]
+           [--server=<selector|asyncio>] [--port=<port>]
+"""
+
+# pylint: disable=import-error, wrong-import-position
+
+import multiprocessing
+import os
+import selectors
+import sys
+import time
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+from load_test import serve, connect, percentiles, SERVER_TYPES
+from src import utilities
+from src.message import Message
+from src.protocol import MessageReader, message_send
+from src.constants import CHALLENGE_FLAG, AUTH_FLAG, SEP
+
+DEFAULT_LOGINS = 2_000
+DEFAULT_BOTS = min(os.cpu_count() or 1, 4)
+DEFAULT_PORT = 9990
+
+STORM_TIMEOUT = 120
+
+SIGNED_IN_PREFIX = "Authenticated as"
+
+
+def storm(bot_index: int, port: int, num_logins: int,
+          results: multiprocessing.Queue) -> None:
+    """
+    Opens num_logins connections at once and signs in on every one, as a
+    different nickname each. Puts (handshake latencies, verification
+    latencies, failures, when the first connection was made, when the last
+    sign in finished) on results
+    """
+    # pylint: disable=too-many-locals
+    from Crypto.PublicKey import RSA
+    from src.auth import solve_challenge, export_public_key
+
+    key = RSA.generate(2048)
+    public_key = export_public_key(key)
+
+    selector = selectors.DefaultSelector()
+
+    # Connection -> [nickname, reader, connected at, signed at]
+    pending = {}
+
+    started = time.monotonic()
+
+    for i in range(num_logins):
+        connection = connect(port)
+        selector.register(connection, selectors.EVENT_READ)
+        pending[connection] = [f"b{bot_index}_{i}", MessageReader(),
+                               time.perf_counter(), None]
+
+    handshakes = []
+    verifications = []
+    failures = 0
+
+    deadline = time.monotonic() + STORM_TIMEOUT
+
+    while pending and time.monotonic() < deadline:
+        for key_obj, _ in selector.select(timeout=1):
+            connection = key_obj.fileobj
+            nickname, reader, connected_at, _ = pending[connection]
+
+            messages = reader.recv(connection)
+
+            if messages is None:  # Closed, so failed to sign in
+                failures += 1
+                messages = []
+                signed_in = True
+            else:
+                signed_in = False
+
+            for message_obj in messages:
+                msg = message_obj.message
+
+                if (message_obj.message_type == 0b10 and
+                        msg.startswith(CHALLENGE_FLAG)):
+                    challenge = bytes.fromhex(msg.split(SEP)[1])
+                    signature = solve_challenge(challenge, key).hex()
+
+                    pending[connection][3] = time.perf_counter()
+
+                    message_send(
+                        Message(0, nickname, time.time(), 0b10,
+                                SEP.join((AUTH_FLAG, public_key, signature))),
+                        connection
+                    )
+
+                elif msg.startswith(SIGNED_IN_PREFIX):
+                    now = time.perf_counter()
+
+                    handshakes.append((now - connected_at) * 1000)
+                    verifications.append((now - pending[connection][3]) * 1000)
+                    signed_in = True
+
+            if signed_in:
+                selector.unregister(connection)
+                connection.close()
+                del pending[connection]
+
+    results.put((handshakes, verifications, failures + len(pending),
+                 started, time.monotonic()))
+
+
+def main() -> None:
+    """
+    Runs the benchmark
+    """
+    argv = sys.argv
+
+    def flag(name: str, default, cast: callable = int):
+        return cast(utilities.get_flag_value(argv, name, str(default)))
+
+    num_logins = flag("--logins", DEFAULT_LOGINS)
+    num_bots = flag("--bots", DEFAULT_BOTS)
+    server_type = flag("--server", "selector", str)
+    port = flag("--port", DEFAULT_PORT)
+
+    if server_type not in SERVER_TYPES or num_bots < 1:
+        print(__doc__.split("Usage: ")[1])
+        return
+
+    server_process = multiprocessing.Process(
+        target=serve, args=(server_type, port, 1, {"auth": True})
+    )
+    server_process.start()
+
+    results = multiprocessing.Queue()
+
+    try:
+        # Lets the server start listening before the storm
+        connect(port).close()
+
+        bots = [
+            multiprocessing.Process(
+                target=storm,
+                args=(i, port, num_logins // num_bots, results)
+            )
+            for i in range(num_bots)
+        ]
+
+        for bot in bots:
+            bot.start()
+
+        handshakes, verifications, failures = [], [], 0
+        starts, ends = [], []
+
+        for _ in bots:
+            (bot_handshakes, bot_verifications, bot_failures,
+             started, finished) = results.get()
+
+            handshakes.extend(bot_handshakes)
+            verifications.extend(bot_verifications)
+            failures += bot_failures
+            starts.append(started)
+            ends.append(finished)
+
+        # Key generation in the bots isn't part of the storm
+        elapsed = max(ends) - min(starts)
+
+        for bot in bots:
+            bot.join()
+    finally:
+        server_process.terminate()
+        server_process.join()
+
+    print(f"{len(handshakes):,} sign-ins from {num_bots} bot processes "
+          f"({server_type} server), {failures} failed\n")
+
+    print(f"handshakes/s      {len(handshakes) / elapsed:>10,.0f}")
+
+    for label, samples in (("handshake ms", handshakes),
+                           ("verification ms", verifications)):
+        summary = percentiles(samples)
+
+        print(f"{label:<18}" + "  ".join(
+            f"{name} {value:.2f}" for name, value in summary.items()
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Micro-benchmark comparing the struct based Message codec with the original
+slicing / concatenating codec
+
+Usage: python3 benchmarks/codec_bench.py [number of frames]
+"""
+
+# pylint: disable=import-error, wrong-import-position
+
+import sys
+import time
+import tracemalloc
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+from src.message import Message, HEADER_SIZE
+
+DEFAULT_FRAMES = 1_000_000
+MEMORY_SAMPLE = 100_000
+
+
+class LegacyMessage:
+    """
+    The original Message layout, keeping its attributes in a __dict__
+    """
+    def __init__(self, channel_id: int, nickname: str, timestamp: int,
+                 message_type: int, message: str) -> None:
+        self.channel_id = channel_id
+        self.nickname = nickname
+        self.timestamp = timestamp
+        self.message_type = message_type
+        self.message_length = len(message)
+        self.message = message
+
+
+def legacy_from_bytes(message_bytes: bytes) -> LegacyMessage:
+    """
+    The original decoder, slicing the frame for every field
+    """
+    channel_id = int.from_bytes(message_bytes[:2], "little")
+    nickname = message_bytes[2:34].decode("ascii").strip("\x00")
+    timestamp = int.from_bytes(message_bytes[34:38], "little")
+
+    encoded_int = int.from_bytes(message_bytes[38:40], "little")
+    message_type = 0b11 & encoded_int
+    message_length = ((0xffff << 2) & encoded_int) >> 2
+
+    message = message_bytes[40:40 + message_length].decode("ascii")
+
+    return LegacyMessage(channel_id, nickname, timestamp, message_type,
+                         message)
+
+
+def legacy_to_bytes(message_obj: LegacyMessage) -> bytes:
+    """
+    The original encoder, building the frame with repeated concatenation
+    """
+    type_bits = 0b11 & message_obj.message_type
+    length_bits = ((0xffff >> 2) & message_obj.message_length) << 2
+
+    encoding = b""
+
+    encoding += message_obj.channel_id.to_bytes(2, "little")
+    encoding += message_obj.nickname.rjust(32, "\x00").encode("ascii")
+    encoding += message_obj.timestamp.to_bytes(4, "little")
+    encoding += (type_bits | length_bits).to_bytes(2, "little")
+    encoding += message_obj.message.encode("ascii")
+
+    return encoding
+
+
+def run_each(func: callable, items: list) -> callable:
+    """
+    Returns a function that calls func on every item, discarding the results
+    """
+    def run() -> None:
+        for item in items:
+            func(item)
+
+    return run
+
+
+def bench(label: str, func: callable, num_frames: int) -> float:
+    """
+    Times a function that processes num_frames frames and prints the result
+
+    Returns the time taken in seconds
+    """
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{label:<28}{elapsed:>8.3f}s"
+        f"{num_frames / elapsed:>14,.0f} frames/s"
+        f"{elapsed / num_frames * 1e9:>10.0f} ns/frame"
+    )
+
+    return elapsed
+
+
+def bytes_per_instance(factory: callable) -> float:
+    """
+    Measures the average memory allocated per object made by factory
+    """
+    tracemalloc.start()
+    objects = [factory(i) for i in range(MEMORY_SAMPLE)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    del objects
+
+    return size / MEMORY_SAMPLE
+
+
+def main() -> None:
+    """
+    Runs the benchmark
+    """
+    num_frames = DEFAULT_FRAMES
+
+    if len(sys.argv) >= 2:
+        num_frames = int(sys.argv[1])
+
+    # A spread of realistic chat lines
+    templates = [
+        Message(i % 64, f"user_{i % 997}", 1_700_000_000 + i, i % 2,
+                "hello world " * (i % 12))
+        for i in range(1024)
+    ]
+
+    messages = [templates[i % len(templates)] for i in range(num_frames)]
+    legacy_messages = [
+        LegacyMessage(m.channel_id, m.nickname, m.timestamp, m.message_type,
+                      m.message)
+        for m in messages
+    ]
+
+    frames = [m.to_bytes() for m in messages]
+    stream = b"".join(frames)
+
+    print(f"{num_frames:,} frames, {len(stream):,} bytes\n")
+
+    print("Encoding")
+    legacy_encode = bench(
+        "  legacy concatenation",
+        run_each(legacy_to_bytes, legacy_messages),
+        num_frames
+    )
+    struct_encode = bench(
+        "  struct",
+        run_each(Message.to_bytes, messages),
+        num_frames
+    )
+
+    def decode_stream() -> None:
+        view = memoryview(stream)
+        offset = 0
+        end = len(stream)
+        while offset < end:
+            Message.from_buffer(view, offset)
+            offset += Message.frame_length(view, offset)
+
+    def legacy_decode_stream() -> None:
+        # The original protocol sliced each frame out of the stream first
+        offset = 0
+        end = len(stream)
+        while offset < end:
+            encoded_int = int.from_bytes(
+                stream[offset + 38:offset + 40], "little"
+            )
+            length = HEADER_SIZE + (encoded_int >> 2)
+            legacy_from_bytes(stream[offset:offset + length])
+            offset += length
+
+    print("\nDecoding one frame at a time")
+    legacy_decode = bench(
+        "  legacy slicing",
+        run_each(legacy_from_bytes, frames),
+        num_frames
+    )
+    struct_decode = bench(
+        "  struct",
+        run_each(Message.from_bytes, frames),
+        num_frames
+    )
+
+    print("\nDecoding a contiguous stream")
+    legacy_stream = bench("  legacy slicing", legacy_decode_stream,
+                          num_frames)
+    struct_stream = bench("  struct + memoryview", decode_stream, num_frames)
+
+    print("\nSpeedup")
+    print(f"  encode {legacy_encode / struct_encode:.2f}x")
+    print(f"  decode {legacy_decode / struct_decode:.2f}x")
+    print(f"  stream {legacy_stream / struct_stream:.2f}x")
+
+    legacy_size = bytes_per_instance(
+        lambda _: LegacyMessage(1, "", 1, 0, "")
+    )
+    slots_size = bytes_per_instance(lambda _: Message(1, "", 1, 0, ""))
+
+    print("\nMemory per message (excluding field values)")
+    print(f"  legacy __dict__ {legacy_size:.0f} bytes")
+    print(f"  __slots__       {slots_size:.0f} bytes")
+
+
+if __name__ == "__main__":
+    main()
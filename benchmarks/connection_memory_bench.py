@@ -0,0 +1,150 @@
+"""
+Measures how much memory each idle client connection costs the selector
+server (server.py) and the asyncio server (async_server.py), by opening
+many connections to each and watching the server's resident set size
+
+Linux only, since the server's memory is read from /proc. Needs a file
+descriptor limit above the number of connections (see ulimit -n)
+
+Usage: python3 benchmarks/connection_memory_bench.py [connections] [port]
+"""
+
+# pylint: disable=import-error, wrong-import-position
+
+import selectors
+import socket
+import subprocess
+import sys
+import time
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+PROJECT_PATH = path.dirname(path.dirname(path.abspath(__file__)))
+
+DEFAULT_CONNECTIONS = 10_000
+DEFAULT_PORT = 9990
+
+SERVERS = [
+    ("selector (server.py)", "server.py"),
+    ("asyncio (async_server.py)", "async_server.py")
+]
+
+START_TIMEOUT = 5
+GREET_TIMEOUT = 60
+
+
+def resident_kib(pid: int) -> int:
+    """
+    Returns a process's resident set size in KiB
+    """
+    with open(f"/proc/{pid}/status", "r", encoding="ascii") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+
+    raise RuntimeError(f"No VmRSS for process {pid}")
+
+
+def connect(port: int) -> socket.socket:
+    """
+    Connects to the server, waiting for it to start listening
+    """
+    deadline = time.monotonic() + START_TIMEOUT
+
+    while True:
+        try:
+            return socket.create_connection(("localhost", port))
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def await_greetings(connections: list[socket.socket]) -> None:
+    """
+    Waits until every connection has been sent the MOTD, i.e. until the
+    server has accepted all of them
+    """
+    selector = selectors.DefaultSelector()
+
+    for connection in connections:
+        connection.setblocking(False)
+        selector.register(connection, selectors.EVENT_READ)
+
+    remaining = len(connections)
+    deadline = time.monotonic() + GREET_TIMEOUT
+
+    while remaining:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{remaining} connections never got the MOTD")
+
+        for key, _ in selector.select(timeout=1):
+            if key.fileobj.recv(65536):
+                selector.unregister(key.fileobj)
+                remaining -= 1
+
+    selector.close()
+
+
+def measure(script: str, num_connections: int, port: int) -> float:
+    """
+    Starts a server, opens num_connections connections to it and returns
+    the memory it took on per connection, in bytes
+    """
+    server = subprocess.Popen(
+        [sys.executable, script, "localhost", str(port)],
+        cwd=PROJECT_PATH,
+        stdout=subprocess.DEVNULL
+    )
+
+    connections = []
+
+    try:
+        # One connection first so the baseline includes everything the
+        # server only sets up for its first client
+        connections.append(connect(port))
+        await_greetings(connections)
+
+        time.sleep(0.5)
+        baseline = resident_kib(server.pid)
+
+        for _ in range(num_connections):
+            connections.append(connect(port))
+
+        await_greetings(connections[1:])
+
+        time.sleep(0.5)
+        loaded = resident_kib(server.pid)
+    finally:
+        server.kill()
+        server.wait()
+
+        for connection in connections:
+            connection.close()
+
+    return (loaded - baseline) * 1024 / num_connections
+
+
+def main() -> None:
+    """
+    Runs the benchmark
+    """
+    num_connections = DEFAULT_CONNECTIONS
+    port = DEFAULT_PORT
+
+    if len(sys.argv) >= 2:
+        num_connections = int(sys.argv[1])
+
+    if len(sys.argv) >= 3:
+        port = int(sys.argv[2])
+
+    print(f"{num_connections:,} idle connections\n")
+
+    for i, (label, script) in enumerate(SERVERS):
+        per_connection = measure(script, num_connections, port + i)
+
+        print(f"{label:<28}{per_connection / 1024:>8.1f} KiB/connection")
+
+
+if __name__ == "__main__":
+    main()
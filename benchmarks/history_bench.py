@@ -0,0 +1,180 @@
+"""
+Benchmark for redrawing a connection's history when switching displays
+(m_display) and paging through it (/page_up), with a large history stored.
+Compares printing every stored message, each formatted from scratch and
+logged on its own as the client used to, with drawing the scrollback, which
+formats only what fits on the terminal and writes it at once
+
+Usage: python3 benchmarks/history_bench.py [number of messages]
+"""
+
+# pylint: disable=import-error, wrong-import-position
+
+import sys
+import time
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+from client import Client
+from src import utilities
+from src.commons import ClientConnectionWrapper
+from src.message import Message
+from src.scrollback import terminal_height
+from src.constants import MAX_NICK_LENGTH, NICK_MSG_SEPARATOR
+
+DEFAULT_MESSAGES = 100_000
+SWITCHES = 5
+
+NICKNAMES = [f"user{i}" for i in range(20)]
+
+
+def legacy_format(message: Message) -> str:
+    """
+    The original Message.format, without any caching
+    """
+    time_string = (
+        f"[{time.strftime('%H:%M:%S', time.localtime(message.timestamp))}]"
+    )
+
+    message_separator = NICK_MSG_SEPARATOR
+
+    if "->" in message.nickname:
+        message_separator = ":"
+
+    if message.message_type == 0b01:
+        nickname = "*"
+    else:
+        nickname = message.nickname
+
+    nickname = nickname.rjust(MAX_NICK_LENGTH * 2 + 2)
+
+    lines = message.message.split("\n")
+
+    echo = lines[0]
+
+    for i, line in enumerate(lines):
+        if i != 0:
+            echo += "\n"
+            echo += " " * ((MAX_NICK_LENGTH * 2 + 2) + 10)
+            echo += message_separator
+            echo += f" {line}"
+
+    return f"{time_string}{nickname}{message_separator} {echo}"
+
+
+def make_history(num_messages: int) -> ClientConnectionWrapper:
+    """
+    A wrapper storing num_messages channel posts from a handful of users,
+    a few a second, some over several lines
+    """
+    wrapper = ClientConnectionWrapper(None, messages_to_store=num_messages)
+    start = int(time.time()) - num_messages
+
+    for i in range(num_messages):
+        text = f"message {i}"
+
+        if i % 10 == 0:
+            text += "\nsecond line\nthird line"
+
+        wrapper.store_message(Message(
+            1, NICKNAMES[i % len(NICKNAMES)], start + i // 4, 0b00, text
+        ))
+
+    return wrapper
+
+
+def bench(label: str, func: callable, repeats: int) -> float:
+    """
+    Times repeats calls of a function that redraws the history and prints
+    the result
+
+    Returns the time taken per call in seconds
+    """
+    start = time.perf_counter()
+
+    for _ in range(repeats):
+        func()
+
+    elapsed = (time.perf_counter() - start) / repeats
+
+    print(f"{label:<28}{elapsed * 1000:>10.3f}ms")
+
+    return elapsed
+
+
+def legacy_print_history(client: Client,
+                         wrapper: ClientConnectionWrapper) -> None:
+    """
+    The original Client.print_wrapper_history, printing every stored
+    message on its own
+    """
+    dummy = ClientConnectionWrapper(None, messages_to_store=0)
+    dummy.states.active = True
+
+    for message in wrapper.messages:
+        client.process_received_message(message, dummy, real_message=False)
+
+
+def main() -> None:
+    """
+    Runs the benchmark
+    """
+    num_messages = DEFAULT_MESSAGES
+
+    if len(sys.argv) >= 2:
+        num_messages = int(sys.argv[1])
+
+    height = terminal_height()
+
+    print(f"{num_messages:,} stored messages, {height} rows on the terminal,"
+          " time per redraw\n")
+
+    writes = []
+    client = Client(testing_mode=True, log=writes.append)
+
+    # The scrollback is drawn in one write
+    def switch(wrapper: ClientConnectionWrapper) -> None:
+        writes.clear()
+        client.print_wrapper_history(wrapper)
+        assert len(writes) == 1
+
+    legacy = make_history(num_messages)
+    real_format = Message.format
+
+    # Every switch formats every message again
+    Message.format = legacy_format
+
+    def legacy_switch() -> None:
+        writes.clear()
+        legacy_print_history(client, legacy)
+        assert len(writes) == num_messages
+
+    try:
+        legacy_time = bench("legacy, every message", legacy_switch,
+                            SWITCHES)
+    finally:
+        Message.format = real_format
+
+    history = make_history(num_messages)
+    utilities.unix_to_str.cache_clear()
+
+    first_time = bench("scrollback, first switch",
+                       lambda: switch(history), 1)
+    cached_time = bench("scrollback, later switches",
+                        lambda: switch(history), SWITCHES)
+
+    def page_up() -> None:
+        history.scrollback.page_up(height)
+        switch(history)
+
+    # Pages through history that hasn't been formatted yet
+    page_time = bench("scrollback, /page_up", page_up, SWITCHES)
+
+    print("\nSpeedup")
+    print(f"  first switch  {legacy_time / first_time:.1f}x")
+    print(f"  later         {legacy_time / cached_time:.1f}x")
+    print(f"  /page_up      {legacy_time / page_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,549 @@
+"""
+Load test for the server. Starts run_server locally and drives thousands of
+bots that speak the protocol directly (no Client, no sleeps between steps).
+The bots create channels, join them, chat, whisper with /msg and, with two
+servers, link every channel across them
+
+Reports messages/s and p50/p99/p999 fan-out latency, i.e. the time from a
+bot sending a message to each recipient receiving it. Results are saved as
+JSON so runs on different commits can be compared with --compare
+
+Usage: python3 benchmarks/load_test.py [--bots=<n>] [--channels=<n>]
+           [--rate=<messages/s>] [--duration=<seconds>]
+           [--whisper-ratio=<0-1>] [--servers=<1|2>]
+           [--server=<selector|asyncio>] [--workers=<n>] [--metrics]
+           [--relay-batch-window=<ms>] [--port=<port>] [--output=<path>]
+           [--compare=<path>]
+"""
+
+# pylint: disable=import-error, wrong-import-position
+
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import selectors
+import socket
+import subprocess
+import sys
+import time
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+import server
+import async_server
+from src import utilities
+from src.message import Message
+from src.protocol import MessageReader, message_send
+
+PROJECT_PATH = path.dirname(path.dirname(path.abspath(__file__)))
+
+DEFAULT_BOTS = 1_000
+DEFAULT_CHANNELS = 20
+DEFAULT_RATE = 500
+DEFAULT_DURATION = 10
+DEFAULT_WHISPER_RATIO = 0.1
+DEFAULT_SERVERS = 2
+DEFAULT_PORT = 9980
+
+TICKRATE = 128
+
+START_TIMEOUT = 5
+SETUP_TIMEOUT = 60
+DRAIN_TIMEOUT = 5
+PROBE_INTERVAL = 0.25
+
+# Marks the bots' timed messages, followed by the send time in nanoseconds
+CHAT_PREFIX = "load"
+PROBE_PREFIX = "probe"
+
+SERVER_TYPES = ("selector", "asyncio")
+
+PERCENTILES = {"p50": 0.5, "p99": 0.99, "p999": 0.999}
+
+
+def serve(server_type: str, port: int, num_workers: int,
+          options: dict) -> None:
+    """
+    Runs a server in this (child) process, without its per-message logging
+
+    options are passed on to run_server (metrics, relay_batch_window)
+    """
+    sys.stdout = open(os.devnull, "w", encoding="utf-8")
+
+    if server_type == "asyncio":
+        asyncio.run(async_server.run_server("localhost", port, **options))
+    elif num_workers > 1:
+        server.run_workers("localhost", port, TICKRATE, num_workers,
+                           **options)
+    else:
+        server.run_server("localhost", port, TICKRATE, **options)
+
+
+def connect(port: int) -> socket.socket:
+    """
+    Connects to a server, waiting for it to start listening
+    """
+    deadline = time.monotonic() + START_TIMEOUT
+
+    while True:
+        try:
+            return socket.create_connection(("localhost", port))
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    """
+    Returns the p50 / p99 / p999 and max of samples (in ms)
+    """
+    if not samples:
+        return {}
+
+    samples.sort()
+
+    summary = {
+        name: samples[min(int(fraction * len(samples)), len(samples) - 1)]
+        for name, fraction in PERCENTILES.items()
+    }
+
+    summary["max"] = samples[-1]
+
+    return {name: round(value, 3) for name, value in summary.items()}
+
+
+class Bot:
+    """
+    A connection that sends and receives raw messages
+    """
+
+    __slots__ = ("index", "nickname", "server", "channel_name",
+                 "connection", "reader", "joined")
+
+    def __init__(self, index: int, server_index: int, port: int,
+                 channel_name: str) -> None:
+        self.index = index
+        self.nickname = f"bot{index}"
+        self.server = server_index
+        self.channel_name = channel_name
+
+        self.connection = connect(port)
+        self.reader = MessageReader()
+
+        self.joined = False
+
+    def send(self, text: str) -> None:
+        """
+        Sends a message or command as this bot
+        """
+        message_type = 0b00 if self.joined else 0b01
+
+        message_send(
+            Message(0, self.nickname, time.time(), message_type, text),
+            self.connection
+        )
+
+
+class LoadTest:
+    """
+    Drives every bot from a single selector loop, so receiving never waits
+    behind sending and the bots cost one thread however many there are
+    """
+
+    def __init__(self, ports: list[int], num_bots: int, num_channels: int,
+                 whisper_ratio: float) -> None:
+        self.ports = ports
+        self.whisper_ratio = whisper_ratio
+        self.random = random.Random(0)
+
+        self.selector = selectors.DefaultSelector()
+
+        # (server index, channel name) -> bots in that channel on that server
+        self.groups = {}
+        self.channel_names = [f"load{i}" for i in range(num_channels)]
+
+        self.bots = []
+
+        for i in range(num_bots):
+            server_index = i % len(ports)
+            channel_name = self.channel_names[
+                (i // len(ports)) % num_channels
+            ]
+
+            bot = Bot(i, server_index, ports[server_index], channel_name)
+
+            self.bots.append(bot)
+            group = self.groups.setdefault((server_index, channel_name), [])
+            group.append(bot)
+            self.selector.register(bot.connection, selectors.EVENT_READ, bot)
+
+        self.channel_sizes = {
+            name: sum(
+                len(self.groups.get((s, name), ())) for s in range(len(ports))
+            )
+            for name in self.channel_names
+        }
+
+        # Channels a probe made it across the link for, and the connections
+        # that asked for the links
+        self.linked = set()
+        self.requesters = []
+
+        self.measuring = False
+        self.latencies = {"channel": [], "linked": [], "whisper": []}
+        self.deliveries = 0
+
+    def pump(self, timeout: float) -> None:
+        """
+        Handles everything that arrives within timeout seconds
+        """
+        for key, _ in self.selector.select(timeout):
+            bot = key.data
+
+            messages = bot.reader.recv(bot.connection)
+
+            if messages is None:
+                raise RuntimeError(f"Server closed {bot.nickname}")
+
+            for message_obj in messages:
+                self.handle(bot, message_obj)
+
+    def pump_until(self, condition: callable, timeout: float,
+                   action: callable = None) -> None:
+        """
+        Pumps until condition() holds, calling action() every probe interval
+        """
+        deadline = time.monotonic() + timeout
+        next_action = 0
+
+        while not condition():
+            now = time.monotonic()
+
+            if now > deadline:
+                raise RuntimeError("Load test setup timed out")
+
+            if action is not None and now >= next_action:
+                action()
+                next_action = now + PROBE_INTERVAL
+
+            self.pump(PROBE_INTERVAL)
+
+    def handle(self, bot: Bot, message_obj: Message) -> None:
+        """
+        Records a message a bot received
+        """
+        received_ns = time.time_ns()
+        text = message_obj.message
+        nickname = message_obj.nickname
+
+        if nickname == "*":
+            if text == f"{bot.nickname} joined the channel!":
+                bot.joined = True
+            return
+
+        if text.startswith(PROBE_PREFIX):
+            if bot.server != 0:
+                self.linked.add(bot.channel_name)
+            return
+
+        if not self.measuring or not text.startswith(CHAT_PREFIX):
+            return
+
+        sent_ns = int(text.split(" ", 2)[1])
+        sender = self.bots[int(nickname.split("->")[0][3:])]
+
+        if "->" in nickname:
+            kind = "whisper"
+        elif sender.server != bot.server:
+            kind = "linked"
+        else:
+            kind = "channel"
+
+        self.latencies[kind].append((received_ns - sent_ns) / 1e6)
+        self.deliveries += 1
+
+    def set_up(self) -> None:
+        """
+        Creates every channel, joins every bot to one and links channels
+        across servers
+        """
+        creators = [group[0] for group in self.groups.values()]
+
+        for bot in creators:
+            bot.send(f"/create {bot.channel_name}")
+
+        self.pump_until(lambda: all(bot.joined for bot in creators),
+                        SETUP_TIMEOUT)
+
+        for bot in self.bots:
+            if not bot.joined:
+                bot.send(f"/join {bot.channel_name}")
+
+        self.pump_until(lambda: all(bot.joined for bot in self.bots),
+                        SETUP_TIMEOUT)
+
+        if len(self.ports) < 2:
+            return
+
+        # A connection outside any channel asks the first server to link
+        # every channel with the second
+        requester = connect(self.ports[0])
+        self.requesters.append(requester)
+
+        for name in self.channel_names:
+            message_send(
+                Message(0, "linker", time.time(), 0b01,
+                        f"/link {name} localhost:{self.ports[1]}"),
+                requester
+            )
+
+        def probe() -> None:
+            for name in self.channel_names:
+                if name not in self.linked and (0, name) in self.groups:
+                    self.groups[(0, name)][0].send(PROBE_PREFIX)
+
+        self.pump_until(lambda: len(self.linked) == len(self.channel_names),
+                        SETUP_TIMEOUT, probe)
+
+    def chat(self, rate: float, duration: float) -> dict:
+        """
+        Sends rate messages per second, spread over random bots, for
+        duration seconds then waits for them all to be delivered
+
+        Returns the throughput and latency results
+        """
+        self.measuring = True
+
+        interval = 1 / rate
+        sent = 0
+        expected = 0
+
+        start = time.monotonic()
+        end = start + duration
+        next_send = start
+
+        while (now := time.monotonic()) < end:
+
+            while next_send <= now:
+                bot = self.random.choice(self.bots)
+                expected += self.send_chat(bot, sent)
+
+                sent += 1
+                next_send += interval
+
+            self.pump(max(next_send - time.monotonic(), 0))
+
+        sending_time = time.monotonic() - start
+
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+
+        while self.deliveries < expected and time.monotonic() < deadline:
+            self.pump(0.05)
+
+        elapsed = time.monotonic() - start
+
+        everything = [sample for samples in self.latencies.values()
+                      for sample in samples]
+
+        return {
+            "sent": sent,
+            "sent_per_second": round(sent / sending_time, 1),
+            "deliveries": self.deliveries,
+            "expected_deliveries": expected,
+            "deliveries_per_second": round(self.deliveries / elapsed, 1),
+            "latency_ms": {
+                "all": percentiles(everything),
+                **{kind: percentiles(samples)
+                   for kind, samples in self.latencies.items()}
+            }
+        }
+
+    def send_chat(self, bot: Bot, seq: int) -> int:
+        """
+        Sends a timed channel message, or a whisper to another bot in the
+        same channel on the same server
+
+        Returns how many deliveries it should lead to
+        """
+        text = f"{CHAT_PREFIX} {time.time_ns()} {seq}"
+
+        group = self.groups[(bot.server, bot.channel_name)]
+
+        if len(group) > 1 and self.random.random() < self.whisper_ratio:
+            target = bot
+
+            while target is bot:
+                target = self.random.choice(group)
+
+            bot.send(f"/msg {target.nickname} {text}")
+
+            # The sender is echoed the whisper too
+            return 2
+
+        bot.send(text)
+
+        return self.channel_sizes[bot.channel_name]
+
+    def close(self) -> None:
+        """
+        Disconnects every bot
+        """
+        for bot in self.bots:
+            bot.connection.close()
+
+        for requester in self.requesters:
+            requester.close()
+
+        self.selector.close()
+
+
+def current_commit() -> str | None:
+    """
+    Returns the checked out commit, if the project is a git repository
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_PATH,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: dict, previous: dict = None) -> None:
+    """
+    Prints the results, along with the change from a previous run if given
+    """
+
+    def change(value: float, old_value: float | None) -> str:
+        if old_value is None or old_value == 0:
+            return ""
+        return f" ({(value - old_value) / old_value:+.1%})"
+
+    old = previous or {}
+
+    for key in ("sent_per_second", "deliveries_per_second"):
+        print(f"{key:<24}{results[key]:>12,.1f}"
+              f"{change(results[key], old.get(key))}")
+
+    print(f"{'deliveries':<24}{results['deliveries']:>12,} of "
+          f"{results['expected_deliveries']:,}")
+
+    old_latencies = old.get("latency_ms", {})
+
+    for kind, summary in results["latency_ms"].items():
+        if not summary:
+            continue
+
+        print(f"\n{kind} latency (ms)")
+
+        for name, value in summary.items():
+            old_value = old_latencies.get(kind, {}).get(name)
+            print(f"  {name:<8}{value:>10.3f}{change(value, old_value)}")
+
+
+def main() -> None:
+    """
+    Runs the load test
+    """
+    argv = sys.argv
+
+    def flag(name: str, default, cast: callable = int):
+        return cast(utilities.get_flag_value(argv, name, str(default)))
+
+    config = {
+        "bots": flag("--bots", DEFAULT_BOTS),
+        "channels": flag("--channels", DEFAULT_CHANNELS),
+        "rate": flag("--rate", DEFAULT_RATE, float),
+        "duration": flag("--duration", DEFAULT_DURATION, float),
+        "whisper_ratio": flag("--whisper-ratio", DEFAULT_WHISPER_RATIO,
+                              float),
+        "servers": flag("--servers", DEFAULT_SERVERS),
+        "server": flag("--server", "selector", str),
+        "workers": flag("--workers", 1),
+        "metrics": "--metrics" in argv,
+        "relay_batch_window": flag("--relay-batch-window", 0)
+    }
+
+    if config["servers"] not in (1, 2) or config["server"] not in SERVER_TYPES:
+        print(__doc__.split("Usage: ")[1])
+        return
+
+    port = flag("--port", DEFAULT_PORT)
+    commit = current_commit()
+
+    output = utilities.get_flag_value(
+        argv, "--output",
+        path.join(PROJECT_PATH, "benchmarks", "results",
+                  f"load_test_{commit or 'latest'}.json")
+    )
+
+    ports = [port + i for i in range(config["servers"])]
+
+    servers = [
+        multiprocessing.Process(
+            target=serve,
+            args=(config["server"], p, config["workers"], {
+                "metrics": config["metrics"],
+                "relay_batch_window": (config["relay_batch_window"] / 1000
+                                       or None)
+            })
+        )
+        for p in ports
+    ]
+
+    for process in servers:
+        process.start()
+
+    load_test = None
+
+    try:
+        setup_start = time.monotonic()
+
+        load_test = LoadTest(ports, config["bots"], config["channels"],
+                             config["whisper_ratio"])
+        load_test.set_up()
+
+        setup_seconds = time.monotonic() - setup_start
+
+        results = {
+            "commit": commit,
+            "timestamp": int(time.time()),
+            "config": config,
+            "setup_seconds": round(setup_seconds, 2),
+            **load_test.chat(config["rate"], config["duration"])
+        }
+    finally:
+        if load_test is not None:
+            load_test.close()
+
+        for process in servers:
+            process.terminate()
+            process.join()
+
+    previous = None
+    compare = utilities.get_flag_value(argv, "--compare")
+
+    if compare is not None:
+        with open(compare, "r", encoding="utf-8") as file:
+            previous = json.load(file)
+
+    print(f"{config['bots']:,} bots in {config['channels']} channels on "
+          f"{config['servers']} {config['server']} server(s), "
+          f"{config['rate']:,.0f} messages/s for {config['duration']}s\n")
+
+    print_results(results, previous)
+
+    os.makedirs(path.dirname(path.abspath(output)), exist_ok=True)
+
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=4)
+
+    print(f"\nSaved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
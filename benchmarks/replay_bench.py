@@ -0,0 +1,123 @@
+"""
+Benchmark for replaying a channel's history to a member who just joined.
+Compares the original replay, which encoded and sent every stored message
+on its own, with sending the stored encodings as one write (from memory,
+and from the on-disk log used with --log-dir)
+
+Each replay is timed from starting it to the other end of a local socket
+having read all of it. Reports the best and median of several runs
+
+Usage: python3 benchmarks/replay_bench.py [number of messages]
+"""
+
+# pylint: disable=import-error, wrong-import-position
+
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+from src.commons import ServerMembers
+from src.channel import Channel
+from src.message import Message
+from src.protocol import message_send
+
+DEFAULT_MESSAGES = 10_000
+RUNS = 20
+
+
+def legacy_replay(channel: Channel, connection: socket.socket) -> None:
+    """
+    The original replay, one encode and one write per stored message
+    """
+    for message_obj in channel.get_messages():
+        message_send(message_obj, connection)
+
+
+def create_channel(num_messages: int,
+                   log_directory: str | None) -> Channel:
+    """
+    Creates a channel storing num_messages messages, with no one there to
+    receive them
+    """
+    s_mems = ServerMembers("localhost", 0, log_directory=log_directory)
+
+    channel = Channel(s_mems, None, "general")
+    channel.set_messages_to_store(num_messages)
+
+    if channel.log is not None:
+        channel.log.max_replay = num_messages
+
+    for i in range(num_messages):
+        channel.broadcast_message(
+            Message(0, f"nick_{i % 100}", time.time(), 0b00,
+                    f"message number {i} " * 4)
+        )
+
+    return channel
+
+
+def time_replay(replay: callable) -> float:
+    """
+    Returns how many seconds replay(connection) took to be read in full
+    from the other end of the connection
+    """
+    connection, peer = socket.socketpair()
+
+    def read() -> None:
+        while peer.recv(1 << 20):
+            pass
+
+    reader = threading.Thread(target=read)
+    reader.start()
+
+    start = time.perf_counter()
+
+    replay(connection)
+    connection.shutdown(socket.SHUT_WR)  # Lets the reader finish
+    reader.join()
+
+    elapsed = time.perf_counter() - start
+
+    connection.close()
+    peer.close()
+
+    return elapsed
+
+
+def main() -> None:
+    """
+    Runs the benchmark
+    """
+    num_messages = DEFAULT_MESSAGES
+
+    if len(sys.argv) >= 2:
+        num_messages = int(sys.argv[1])
+
+    print(f"Replaying {num_messages:,} messages, best and median of "
+          f"{RUNS} runs\n")
+
+    with tempfile.TemporaryDirectory() as directory:
+        in_memory = create_channel(num_messages, None)
+        logged = create_channel(num_messages, directory)
+
+        for label, replay in (
+                ("per message (original)",
+                 lambda connection: legacy_replay(in_memory, connection)),
+                ("one write, in memory", in_memory.send_message_history),
+                ("one write, --log-dir", logged.send_message_history)):
+
+            timings = [time_replay(replay) for _ in range(RUNS)]
+
+            print(f"{label:<26}{min(timings) * 1e3:>10.2f} ms"
+                  f"{statistics.median(timings) * 1e3:>10.2f} ms")
+
+        logged.log.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Startup benchmark for server.py and client.py. Imports each entry point in
+a fresh interpreter with -X importtime, which is everything they do before
+binding or reading input, and reports how long that took (the best and
+median of several runs), the slowest modules, and whether any of the
+modules that should only be imported when needed were imported anyway
+
+Usage: python3 benchmarks/startup_bench.py [number of runs]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+from os import path
+
+PROJECT_PATH = path.dirname(path.dirname(path.abspath(__file__)))
+
+DEFAULT_RUNS = 10
+ENTRY_POINTS = ("server", "client")
+SLOWEST = 8
+
+# Bytecode is cached (as it normally is) even if the environment says not to,
+# so compiling isn't timed
+ENVIRONMENT = {
+    name: value for name, value in os.environ.items()
+    if name != "PYTHONDONTWRITEBYTECODE"
+}
+
+# Only imported once they are needed: pycryptodome on the first sign in,
+# asyncio by the asyncio server, http.server and the metrics registry by
+# --metrics, the channel log by --log-dir and workers by --workers
+DEFERRED = ("Crypto", "asyncio", "http.server", "concurrent.futures",
+            "src.metrics", "src.channel_log", "src.workers")
+
+
+def import_times(module: str) -> tuple[float, dict[str, int]]:
+    """
+    Imports a module in a new interpreter
+
+    Returns the wall-clock time it took the interpreter to start and import
+    it (in ms), and each imported module's own import time (in us)
+    """
+    start = time.perf_counter()
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_PATH, env=ENVIRONMENT, capture_output=True, text=True,
+        check=True
+    )
+
+    elapsed = (time.perf_counter() - start) * 1000
+
+    self_times = {}
+
+    # Lines look like:
+    # import time:  self [us] | cumulative | imported package
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        self_us, _, name = line[len("import time:"):].split("|")
+        self_times[name.strip()] = int(self_us)
+
+    return elapsed, self_times
+
+
+def main() -> None:
+    """
+    Runs the benchmark
+    """
+    runs = DEFAULT_RUNS
+
+    if len(sys.argv) >= 2:
+        runs = int(sys.argv[1])
+
+    # Compiles anything that isn't cached yet so it isn't timed
+    for module in ENTRY_POINTS:
+        import_times(module)
+
+    baseline = min(import_times("sys")[0] for _ in range(runs))
+
+    print(f"{runs} runs each. Interpreter alone starts in {baseline:.1f}ms\n")
+
+    for module in ENTRY_POINTS:
+        walls = []
+        totals = []
+        best_self_times = {}
+
+        for _ in range(runs):
+            wall, self_times = import_times(module)
+
+            walls.append(wall)
+            totals.append(sum(self_times.values()) / 1000)
+
+            for name, self_us in self_times.items():
+                best_self_times[name] = min(
+                    self_us, best_self_times.get(name, self_us)
+                )
+
+        print(f"{module}.py")
+        print(f"  start (wall)   best {min(walls):7.1f}ms"
+              f"  median {statistics.median(walls):7.1f}ms")
+        print(f"  imports        best {min(totals):7.1f}ms"
+              f"  median {statistics.median(totals):7.1f}ms"
+              f"  ({len(best_self_times)} modules)")
+
+        print("  slowest modules (own time)")
+
+        for name, self_us in sorted(best_self_times.items(),
+                                    key=lambda item: -item[1])[:SLOWEST]:
+            print(f"    {name:<32}{self_us / 1000:6.2f}ms")
+
+        imported = [
+            deferred for deferred in DEFERRED
+            if any(name == deferred or name.startswith(deferred + ".")
+                   for name in best_self_times)
+        ]
+
+        print(f"  deferred modules imported: {', '.join(imported) or 'none'}"
+              "\n")
+
+
+if __name__ == "__main__":
+    main()
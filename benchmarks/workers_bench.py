@@ -0,0 +1,143 @@
+"""
+Throughput of a server run as several workers (--workers) against the number
+of workers. Runs the load test's bots against one server started with each
+worker count in turn, chatting in channels only (no whispers or links)
+
+Every worker has a replica of every channel and relays each message to every
+other worker, so each message is decoded and fanned out once per worker.
+More workers only help while that is cheaper than the work they share out,
+and need as many cores as workers (this prints how many there are)
+
+Usage: python3 benchmarks/workers_bench.py [--workers=<n,n,...>]
+           [--bots=<n>] [--channels=<n>] [--rate=<messages/s>]
+           [--duration=<seconds>] [--port=<port>]
+"""
+
+# pylint: disable=import-error, wrong-import-position
+
+import multiprocessing
+import os
+import sys
+import time
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+from load_test import serve, LoadTest, SETUP_TIMEOUT
+from src import utilities
+
+DEFAULT_WORKERS = "1,2,4"
+DEFAULT_BOTS = 500
+DEFAULT_CHANNELS = 10
+DEFAULT_RATE = 2_000
+DEFAULT_DURATION = 5
+DEFAULT_PORT = 9970
+
+# Time for a channel created on one worker to be replicated to the others
+# before bots on them join it
+REPLICATION_WAIT = 0.5
+
+
+class WorkersLoadTest(LoadTest):
+    """
+    The load test's bots, on a single server with workers
+    """
+
+    def set_up(self) -> None:
+        """
+        Creates every channel and joins every bot to one once the channels
+        have reached every worker
+        """
+        creators = [group[0] for group in self.groups.values()]
+
+        for bot in creators:
+            bot.send(f"/create {bot.channel_name}")
+
+        self.pump_until(lambda: all(bot.joined for bot in creators),
+                        SETUP_TIMEOUT)
+
+        deadline = time.monotonic() + REPLICATION_WAIT
+
+        while time.monotonic() < deadline:
+            self.pump(0.05)
+
+        for bot in self.bots:
+            if not bot.joined:
+                bot.send(f"/join {bot.channel_name}")
+
+        self.pump_until(lambda: all(bot.joined for bot in self.bots),
+                        SETUP_TIMEOUT)
+
+
+def run(num_workers: int, port: int, config: dict) -> dict:
+    """
+    Chats on a server with num_workers workers and returns the results
+    """
+    process = multiprocessing.Process(
+        target=serve, args=("selector", port, num_workers, {})
+    )
+    process.start()
+
+    load_test = None
+
+    try:
+        load_test = WorkersLoadTest([port], config["bots"],
+                                    config["channels"], 0)
+        load_test.set_up()
+
+        return load_test.chat(config["rate"], config["duration"])
+    finally:
+        if load_test is not None:
+            load_test.close()
+
+        process.terminate()
+        process.join()
+
+
+def main() -> None:
+    """
+    Runs the benchmark for every worker count
+    """
+    argv = sys.argv
+
+    def flag(name: str, default, cast: callable = int):
+        return cast(utilities.get_flag_value(argv, name, str(default)))
+
+    worker_counts = [
+        int(count)
+        for count in flag("--workers", DEFAULT_WORKERS, str).split(",")
+    ]
+
+    config = {
+        "bots": flag("--bots", DEFAULT_BOTS),
+        "channels": flag("--channels", DEFAULT_CHANNELS),
+        "rate": flag("--rate", DEFAULT_RATE, float),
+        "duration": flag("--duration", DEFAULT_DURATION, float)
+    }
+
+    port = flag("--port", DEFAULT_PORT)
+
+    print(f"{config['bots']:,} bots in {config['channels']} channels, "
+          f"{config['rate']:,.0f} messages/s for {config['duration']}s, "
+          f"{os.cpu_count()} CPU(s)\n")
+
+    print(f"{'workers':>8}{'sent/s':>12}{'delivered/s':>14}"
+          f"{'delivered':>12}{'p50 ms':>10}{'p99 ms':>10}")
+
+    # A port per run, so a run never waits on the last one's sockets
+    for i, num_workers in enumerate(worker_counts):
+        results = run(num_workers, port + i, config)
+        latency = results["latency_ms"]["all"]
+
+        delivered = results["deliveries"] / max(
+            results["expected_deliveries"], 1
+        )
+
+        print(f"{num_workers:>8}{results['sent_per_second']:>12,.1f}"
+              f"{results['deliveries_per_second']:>14,.1f}"
+              f"{delivered:>12.1%}"
+              f"{latency.get('p50', 0):>10.3f}"
+              f"{latency.get('p99', 0):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
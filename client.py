@@ -3,7 +3,6 @@
     dechat client
 """
 
-import socket
 import time
 import sys
 import threading
@@ -19,9 +18,13 @@ from src.commands.client_commands import (
     multicon_client_sender_command_map,
     limbo_command_map
 )
+from src.client_receiver import ClientReceiver
+from src.blocking_queue import BlockingQueue
 from src.message import Message, CLOSE_MESSAGE
-from src.protocol import message_send, message_recv, conn_socket_setup
-from src.constants import MIGRATE_FLAG, SEP
+from src.protocol import send_bytes, conn_socket_setup
+from src.authenticator import HAS_CRYPTO
+from src.scrollback import terminal_height
+from src.constants import MIGRATE_FLAG, CHALLENGE_FLAG, AUTH_FLAG, SEP
 
 INPUT_PROMPT = "> "
 SERVER_NAME_REF = "Server: "
@@ -38,7 +41,15 @@ def main():
 
     ui_enabled = "--ui" in sys.argv
 
-    client = Client(ui_enabled)
+    # --key=<path> signs in to servers started with --auth with the private
+    # key kept there, generating one the first time
+    key_path = utilities.get_flag_value(sys.argv, "--key")
+
+    if key_path is not None and not HAS_CRYPTO:
+        print("--key needs pycryptodome, which isn't installed")
+        return
+
+    client = Client(ui_enabled, key_path=key_path)
     client_thread = client.start()
     client_thread.join()
 
@@ -48,10 +59,14 @@ class Client:
     Client class
     """
     def __init__(self, ui_enabled: bool = False, testing_mode: bool = False,
-                 log: callable = utilities.flush_print) -> None:
+                 log: callable = utilities.flush_print,
+                 key_path: str = None) -> None:
         """
         Purpose of the 'log' parameter is so I can use it as a hook
         to redirect output to be read instead of printed for testing
+
+        key_path is where the private key used to sign in to servers started
+        with --auth is kept. None can't sign in to them
         """
 
         self._quitted = False
@@ -64,11 +79,29 @@ class Client:
         self.con_wrappers = {}
         self.current_wrapper = None
 
-        self.wrappers_to_close = []
+        # Wrappers for the main client thread to close, which sleeps until
+        # there are some
+        self.wrappers_to_close = BlockingQueue()
         self.migration_threads = []
 
+        # One thread receives from every connection
+        self.receiver = ClientReceiver(
+            self.process_received_message, self.wrappers_to_close.append
+        )
+
         self.printed_prompt = False
 
+        # Loaded (along with pycryptodome) from key_path once a server first
+        # asks the client to sign in
+        self.key_path = key_path
+        self.key = None
+        self.public_key = None
+
+        # Challenges are signed off the receive thread, one thread each,
+        # with the key loaded (or created) by the first of them
+        self.key_lock = threading.Lock()
+        self.signing_threads = []
+
     def clear_closed_wrappers(self) -> None:
         """
         Removes closed wrappers from self.con_wrappers
@@ -143,13 +176,11 @@ class Client:
             self.log("Already on that server!")
             return
 
-        if clear_terminal and self.ui_enabled and not self.testing_mode:
-            ansi.clear_terminal()
-
         self.current_wrapper = wrapper
         wrapper.states.active = True
 
-        self.print_wrapper_history(wrapper)
+        wrapper.scrollback.to_bottom()
+        self.print_wrapper_history(wrapper, clear_terminal=clear_terminal)
 
         if wrapper.listener is None:
             self.start_listening(wrapper)
@@ -164,32 +195,35 @@ class Client:
         if self.ui_enabled and ping_for_info:
             self.ping_for_info(wrapper)
 
-    def print_wrapper_history(self, wrapper: ClientConnectionWrapper) -> None:
+    def print_wrapper_history(self, wrapper: ClientConnectionWrapper,
+                              clear_terminal: bool = False) -> None:
         """
-        Extracts all the messages stored in a wrapper and prints them out
+        Prints the part of a wrapper's stored messages its scrollback is
+        showing, as much as fits on the terminal, in one write
         """
 
-        # Don't want handle_message_received to
-        # change states in actual wrapper
-        dummy = ClientConnectionWrapper(None)
+        screen = wrapper.scrollback.render(terminal_height())
 
-        # To get printing processed messages working correctly
-        dummy.states.active = True
+        if not self.ui_enabled or self.testing_mode:
+            if screen:
+                self.log(screen)
+            return
+
+        if screen:
+            screen = f"\r{screen}\n"
 
-        for message in reversed(wrapper.messages):
-            self.process_received_message(message, dummy, real_message=False)
+        if clear_terminal:
+            screen = ansi.CLEAR_TERMINAL + screen
+
+        self.log(screen, end="")
+        sys.stdout.flush()
 
     def start_listening(self, wrapper: ClientConnectionWrapper) -> None:
         """
         Starts listening to a wrapper
         """
-        wrapper.listener = threading.Thread(
-            target=self.listener,
-            args=(wrapper,),
-            kwargs={"tickrate": 32}
-        )
-
-        wrapper.listener.start()
+        self.receiver.register(wrapper)
+        self.receiver.start()
 
     def start_sending(self, wrapper: ClientConnectionWrapper) -> None:
         """
@@ -207,7 +241,7 @@ class Client:
         Implicitly calls /info and extracts hostname and port quietly
         """
         wrapper.states.pinging_for_info = True
-        wrapper.input_queue.insert(0, "/info")
+        wrapper.input_queue.appendleft("/info")
 
     def start(self) -> threading.Thread:
         """
@@ -226,27 +260,30 @@ class Client:
             # Purpose of this is to join all sender and listener threads from
             # the main thread. All wrappers should be closed from here to
             # avoid threads trying to join with themselves
-            while not self._quitted or len(self.wrappers_to_close) > 0:
+            while True:
+
+                wrappers = self.wrappers_to_close.take_all()
 
-                closed_wrappers = False
+                # Client has quit and every wrapper queued to close has been
+                if wrappers is None:
+                    break
 
-                for wrapper in self.wrappers_to_close:
-                    closed_wrappers = True
+                for wrapper in wrappers:
                     if wrapper == self.current_wrapper:
                         self.current_wrapper = None
                     wrapper.close()
 
-                if closed_wrappers:
+                if wrappers:
                     self.clear_closed_wrappers()
 
-                self.wrappers_to_close.clear()
-
             if not self.testing_mode:
                 input_thread.join()
 
-            for thread in self.migration_threads:
+            for thread in self.migration_threads + self.signing_threads:
                 thread.join()
 
+            self.receiver.stop()
+
         main_thread = threading.Thread(target=main_client_thread)
         main_thread.start()
         return main_thread
@@ -257,6 +294,7 @@ class Client:
         sender is taking input
         """
         self._quitted = True
+        self.wrappers_to_close.close()
 
     def input_loop(self) -> None:
         """
@@ -350,28 +388,43 @@ class Client:
 
     def client_sender(self, wrapper: ClientConnectionWrapper) -> None:
         """
-        Listens for a queue of messages to send
+        Sleeps until there is input to send. Everything queued since the
+        last send goes to the server in a single write
         """
 
-        empty_message = False
+        disconnecting = False
 
         # Sender should keep running even when not active but not closed
-        # either
-        while not wrapper.is_closed() and not empty_message:
+        # either. Should send even if not active for pinging for info in
+        # /migration
+        while not wrapper.is_closed() and not disconnecting:
 
-            # Should send even if not active for pinging for info in
-            # /migration
-            while not empty_message and len(wrapper.input_queue) > 0:
+            user_inputs = wrapper.input_queue.take_all()
 
-                user_input = wrapper.input_queue.pop(0)
+            if user_inputs is None:  # Wrapper was closed
+                break
+
+            encodings = []
 
-                if len(user_input) > 0:
-                    self.handle_input_to_server(user_input, wrapper)
+            for user_input in user_inputs:
+
+                if isinstance(user_input, Message):  # e.g. signing in
+                    message = user_input
+                elif len(user_input) > 0:
+                    message = self.handle_input_to_server(user_input, wrapper)
                 elif wrapper.confirmed_channel_name is None:  # In bare server
-                    empty_message = True
+                    message = CLOSE_MESSAGE
+                else:
+                    continue
 
-            if empty_message and not wrapper.is_closed():
-                message_send(CLOSE_MESSAGE, wrapper.connection)
+                encodings.append(message.to_bytes())
+
+                if message is CLOSE_MESSAGE:
+                    disconnecting = True
+                    break
+
+            if encodings and not wrapper.is_closed():
+                send_bytes(b"".join(encodings), wrapper.connection)
 
         # Should only come to this point when the connection to the server
         # has closed. Need to close wrapper from an outside thread so the
@@ -379,13 +432,16 @@ class Client:
         self.wrappers_to_close.append(wrapper)
 
     def handle_input_to_server(self, user_input: str,
-                               wrapper: ClientConnectionWrapper) -> None:
+                               wrapper: ClientConnectionWrapper) -> Message:
         """
         The handle_input equivelant but for user input intended for
         servers
 
         User input should be handled to be not empty prior to being passed
         in
+
+        Returns the message to send the server, which is CLOSE_MESSAGE if
+        the input disconnects from it
         """
 
         # /quit should always be a relay from cs_quit. It should never
@@ -397,9 +453,7 @@ class Client:
                 wrapper.confirmed_channel_name = None
                 wrapper.pending_channel_name = None
             else:
-                message_send(CLOSE_MESSAGE, wrapper.connection)
-                self.wrappers_to_close.append(wrapper)
-                return
+                return CLOSE_MESSAGE
 
         # Defaults to server type messages
         message_type = 0b01
@@ -436,32 +490,7 @@ class Client:
 
                 wrapper.states.just_messaged = True
 
-        if not wrapper.is_closed():
-            message_send(message, wrapper.connection)
-
-    def listener(self, wrapper: ClientConnectionWrapper,
-                 tickrate: float = 32) -> None:
-        """
-        This function will listen and print in parallel with the main program.
-        Use the wrapper variable to share state where needed.
-        """
-
-        while wrapper.states.listening and not wrapper.is_closed():
-            try:
-                # While message_obj isn't None
-                while ((message_obj := message_recv(wrapper.connection)) and
-                       wrapper.states.listening and not wrapper.is_closed()):
-
-                    self.process_received_message(message_obj, wrapper)
-
-            except socket.timeout:
-                continue
-            except ConnectionResetError:
-                if not wrapper.is_closed():
-                    self.wrappers_to_close.append(wrapper)
-                return
-
-            time.sleep(1/tickrate)
+        return message
 
     def smart_print_response(self, string: str,
                              print_prompt: bool = True) -> None:
@@ -508,13 +537,16 @@ class Client:
                     message.nickname.split(WHISPER_SEP)[0].strip()
                 )
 
-            if wrapper.states.active:
+            if wrapper.states.active and not wrapper.scrollback.is_scrolled():
                 self.smart_print_response(
                     message.format(), print_prompt=real_message
                 )
 
         elif message.message_type == 0b01:  # Server messages
-            if msg != "":
+            if msg == "":
+                store_message = False
+
+            else:
 
                 print_message = True
 
@@ -530,7 +562,8 @@ class Client:
                         wrapper.name = name
                         wrapper.states.pinging_for_info = False
 
-                if print_message and wrapper.states.active:
+                if (print_message and wrapper.states.active and
+                        not wrapper.scrollback.is_scrolled()):
 
                     self.smart_print_response(
                         message.format(), print_prompt=real_message
@@ -562,11 +595,76 @@ class Client:
                 self.migration_threads.append(thread)
                 thread.start()
 
+            elif msg.startswith(CHALLENGE_FLAG) and real_message:
+                self.answer_challenge(msg, wrapper)
+
         wrapper.states.just_messaged = False
 
         if store_message:
             wrapper.store_message(message)
 
+    def answer_challenge(self, msg: str,
+                         wrapper: ClientConnectionWrapper) -> None:
+        """
+        Signs in to a server started with --auth by signing the challenge it
+        sent with the client's key, as the current default nickname
+        """
+
+        if self.key_path is None:
+            self.smart_print_response(
+                "This server needs you to sign in. Restart the client with "
+                "--key=<path>"
+            )
+            return
+
+        # Format is like:
+        # "--challenge|<challenge in hex>"
+        challenge = bytes.fromhex(msg.split(SEP)[1])
+
+        # Generating the key the first time and signing both take a while,
+        # and would hold up receiving from every other server
+        thread = threading.Thread(
+            target=self.sign_challenge,
+            args=(challenge, wrapper)
+        )
+
+        self.signing_threads.append(thread)
+        thread.start()
+
+    def sign_challenge(self, challenge: bytes,
+                       wrapper: ClientConnectionWrapper) -> None:
+        """
+        Signs a challenge with the client's key, loading the key (or creating
+        it) first if it hasn't been yet, and queues the signature to be sent
+        """
+
+        # pylint: disable=import-outside-toplevel
+        from src.auth import load_or_create_key, export_public_key
+        from src.auth import solve_challenge
+
+        try:
+            with self.key_lock:
+                if self.key is None:
+                    self.key = load_or_create_key(self.key_path)
+                    self.public_key = export_public_key(self.key)
+        except (OSError, ValueError) as error:
+            self.smart_print_response(
+                f"Could not load the key in {self.key_path} ({error})"
+            )
+            return
+
+        signature = solve_challenge(challenge, self.key)
+
+        # Sent ahead of anything already typed, which the server would
+        # otherwise refuse
+        wrapper.input_queue.appendleft(Message(
+            0,
+            self.default_nickname,
+            time.time(),
+            0b10,
+            SEP.join((AUTH_FLAG, self.public_key, signature.hex()))
+        ))
+
     def migrate(self, old_wrapper: ClientConnectionWrapper,
                 channel_name: str, hostname: str, port: int) -> None:
         """
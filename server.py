@@ -4,28 +4,92 @@
 """
 
 import socket
-import time
 import sys
-import threading
+
+
+def take_port_early(argv: list[str]) -> socket.socket | None:
+    """
+    Starts listening on the port a single server was asked to run on before
+    the rest of the server is imported (logging above all is slow to
+    import), so clients started alongside it can connect straight away
+
+    Returns the listening socket, or None when running workers or if the
+    port couldn't be taken, leaving run_server to bind it as usual
+    """
+    if any(arg.startswith("--workers") for arg in argv):
+        return None
+
+    host, port = "localhost", 9996
+
+    if len(argv) >= 3:
+        host = argv[1]
+
+        if argv[2].isdigit():
+            port = int(argv[2])
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+    try:
+        sock.bind((host, port))
+        sock.listen()
+    except (OSError, OverflowError):
+        sock.close()
+        return None
+
+    return sock
+
+
+# Taken before anything else is imported
+EARLY_LISTENER = take_port_early(sys.argv) if __name__ == "__main__" else None
+
+# pylint: disable=wrong-import-position
+import logging
+import os
+import selectors
+import signal
+import time
 from src import ansi
 from src import utilities
+from src.channel import Channel
 from src.message import Message, CLOSE_MESSAGE
-from src.protocol import message_send, message_recv, bind_socket_setup
+from src.protocol import message_send, bind_socket_setup
 from src.commons import ServerMembers, ChannelLinkInfo, ServerConnectionInfo
-from src.commands.server_commands import server_command_map, echo_conn
+from src.commands.server_commands import (
+    server_command_map,
+    echo_conn,
+    relink_peer,
+    broadcast_migration
+)
+from src.logger import (
+    setup_logging_from_arguments,
+    stop_logging,
+    LOGGING_USAGE
+)
 from src.constants import (
+    DEFAULT_HIGH_WATER_MARK,
+    DEFAULT_SLOW_CONSUMER_POLICY,
+    SLOW_CONSUMER_POLICIES,
     SERVER_CHANNEL_ID,
     LINK_FLAG,
     LINK_RESPONSE_FLAG,
     UNLINK_FLAG,
+    WORKER_FLAG,
+    REPLICATE_FLAG,
+    SYNC_FLAG,
+    DESTROY_FLAG,
+    PEER_CHECK_INTERVAL,
+    CHALLENGE_FLAG,
+    AUTH_FLAG,
+    AUTH_TIMEOUT,
+    AUTH_HELD_MESSAGES,
     SEP
 )
 
-# A better solution to this would be to poll rather than try and except
-# But due to Windows compatibility issues Python's socket object does not
-# support native polling. As a result we will be emulating a non-blocking
-# stream using exceptions. This implementation is hopefully also easier to
-# understand.
+logger = logging.getLogger("dechat.server")
+
+# The server is driven by a selector (epoll on Linux, select on Windows) so
+# the main loop only wakes up for sockets that actually have data waiting,
+# including the listening socket. Idle connections cost nothing per tick.
 
 
 def main():
@@ -35,28 +99,237 @@ def main():
     """
 
     tickrate = 128
+
+    arguments = parse_arguments(sys.argv)
+
+    if arguments is None or not setup_logging_from_arguments(sys.argv):
+        print(
+            "Usage: server.py [hostname port] [--high-water-mark=<bytes>] "
+            f"[--slow-consumer=<{'|'.join(SLOW_CONSUMER_POLICIES)}>] "
+            "[--log-dir=<path>] [--workers=<n>] [--metrics] "
+            "[--metrics-port=<port>] [--relay-batch-window=<ms>] [--auth] "
+            f"{LOGGING_USAGE}"
+        )
+        return
+
+    host, port, num_workers, options = arguments
+
+    if num_workers > 1:
+        run_workers(host, port, tickrate, num_workers, **options)
+    else:
+        run_server(host, port, tickrate, listener=EARLY_LISTENER, **options)
+
+
+def parse_arguments(argv: list[str]) -> tuple[str, int, int, dict] | None:
+    """
+    Parses the server's command line arguments
+
+    Returns (hostname, port, number of workers, options for run_server), or
+    None if any of them are invalid
+    """
+
     port = 9996
     host = "localhost"
 
-    if len(sys.argv) >= 3:
-        host = sys.argv[1]
+    if len(argv) >= 3:
+        host = argv[1]
 
-        if utilities.is_integer(sys.argv[2]):
-            port = int(sys.argv[2])
+        if utilities.is_integer(argv[2]):
+            port = int(argv[2])
 
-    run_server(host, port, tickrate)
+    # --high-water-mark=<bytes> --slow-consumer=<drop|disconnect|coalesce>
+    high_water_mark = utilities.get_flag_value(
+        argv, "--high-water-mark", str(DEFAULT_HIGH_WATER_MARK)
+    )
 
+    slow_consumer_policy = utilities.get_flag_value(
+        argv, "--slow-consumer", DEFAULT_SLOW_CONSUMER_POLICY
+    )
+
+    # --workers=<n> runs n processes sharing the port
+    num_workers = utilities.get_flag_value(argv, "--workers", "1")
+
+    if (not utilities.is_integer(high_water_mark) or
+            slow_consumer_policy not in SLOW_CONSUMER_POLICIES or
+            not utilities.is_integer(num_workers) or int(num_workers) < 1):
+        return None
+
+    # --log-dir=<path> keeps channel history on disk
+    log_directory = utilities.get_flag_value(argv, "--log-dir")
+
+    # --metrics collects metrics for /stats, --metrics-port=<port> also
+    # serves them over HTTP
+    metrics_port = utilities.get_flag_value(argv, "--metrics-port")
+
+    if metrics_port is not None and not utilities.is_integer(metrics_port):
+        return None
+
+    # --relay-batch-window=<ms> batches relays to linked servers that batch
+    # too, sending everything relayed within the window in one write
+    relay_batch_window = utilities.get_flag_value(argv, "--relay-batch-window")
+
+    if (relay_batch_window is not None and
+            not utilities.is_integer(relay_batch_window)):
+        return None
 
-def run_server(hostname="localhost", port=9996, tickrate=1):
+    options = {
+        "high_water_mark": int(high_water_mark),
+        "slow_consumer_policy": slow_consumer_policy,
+        "log_directory": log_directory,
+        "metrics": "--metrics" in argv or metrics_port is not None,
+        "metrics_port": int(metrics_port) if metrics_port else None,
+        "relay_batch_window": (
+            int(relay_batch_window) / 1000 if relay_batch_window else None
+        ),
+        # --auth makes clients sign in with their key
+        "auth": "--auth" in argv
+    }
+
+    return host, port, int(num_workers), options
+
+
+def run_workers(hostname, port, tickrate, num_workers, **options):
+    """
+    Runs the server as num_workers processes that all listen on the same
+    port, so messages are handled on as many cores. The kernel spreads new
+    connections across the workers, and channels are replicated to every
+    worker (see workers.py)
+
+    Stops every worker once any of them stops (e.g. through /die)
+    """
+    # Imported here so a single server starts faster
+    # pylint: disable=import-outside-toplevel
+    from src.workers import WorkerGroup, HAS_REUSE_PORT
+
+    if not HAS_REUSE_PORT or not hasattr(os, "fork"):
+        logger.error("--workers needs SO_REUSEPORT and fork, which this "
+                     "platform doesn't have")
+        return
+
+    # Which key owns a nickname is only known to the worker it signed in on
+    if options.get("auth"):
+        logger.error("--auth can't be used with --workers")
+        return
+
+    # Bound before forking so every worker knows where every other worker is
+    listeners = []
+
+    for _ in range(num_workers):
+        successful, listener = bind_socket_setup("127.0.0.1", 0)
+
+        if not successful:
+            logger.error("Could not set up connections between workers")
+            return
+
+        listeners.append(listener)
+
+    addresses = [listener.getsockname() for listener in listeners]
+
+    # Workers see the pipe close if this process dies without stopping them
+    parent_pipe, parent_pipe_write = os.pipe()
+
+    pids = []
+
+    for index, listener in enumerate(listeners):
+        pid = os.fork()
+
+        if pid == 0:  # Worker
+            os.close(parent_pipe_write)
+
+            for other in listeners:
+                if other is not listener:
+                    other.close()
+
+            workers = WorkerGroup(index, addresses, listener, parent_pipe)
+
+            run_server(hostname, port, tickrate, workers=workers, **options)
+
+            stop_logging()
+            sys.stdout.flush()
+            os._exit(0)  # pylint: disable=protected-access
+
+        pids.append(pid)
+
+    for listener in listeners:
+        listener.close()
+
+    os.close(parent_pipe)
+
+    def stop_workers(_signum, _frame):
+        raise KeyboardInterrupt
+
+    # Being terminated takes the workers down too
+    signal.signal(signal.SIGTERM, stop_workers)
+
+    try:
+        pid, _ = os.wait()
+        pids.remove(pid)
+    except KeyboardInterrupt:
+        pass
+
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+
+    os.close(parent_pipe_write)
+
+
+def run_server(hostname="localhost", port=9996, tickrate=1,
+               high_water_mark=DEFAULT_HIGH_WATER_MARK,
+               slow_consumer_policy=DEFAULT_SLOW_CONSUMER_POLICY,
+               log_directory=None, metrics=False, metrics_port=None,
+               relay_batch_window=None, auth=False, workers=None,
+               listener=None):
     """
     Runs the server
     :: hostname : str :: hostname to run on, default "localhost"
     :: port : int :: port to run on, default 9996
-    :: tickrate : float :: How often the server should poll, default 1 second
+    :: tickrate : float :: How often the server wakes up when idle to check
+                          whether it should quit, default 1 second
+    :: high_water_mark : int :: Bytes a connection can have queued before
+                                the slow consumer policy kicks in
+    :: slow_consumer_policy : str :: What to do with a connection over the
+                                     high-water mark (see constants.py)
+    :: log_directory : str :: Directory to keep channel history in, default
+                              None which keeps history in memory only
+    :: metrics : bool :: Whether to collect metrics for /stats, default
+                         False
+    :: metrics_port : int :: Port to serve metrics over HTTP on (localhost
+                             only), default None which doesn't serve them.
+                             Workers each serve on this port plus their
+                             index
+    :: relay_batch_window : float :: Seconds to hold relays to linked
+                                     servers that batch too, so they are
+                                     sent together. Default None which
+                                     sends each relay on its own
+    :: auth : bool :: Whether clients have to sign in with their key (see
+                      authenticator.py), default False
+    :: workers : WorkerGroup :: The other workers when running as one of
+                                several, default None
+    :: listener : socket.socket :: Socket already listening on hostname and
+                                   port, default None which binds one
     """
 
+    if auth:
+        # Imported here so servers without --auth start faster
+        # pylint: disable=import-outside-toplevel
+        from src.authenticator import HAS_CRYPTO
+
+        if not HAS_CRYPTO:
+            logger.error("--auth needs pycryptodome, which isn't installed")
+            return
+
+    reuse_port = workers is not None
+
     # Bound socket
-    successful, sock = bind_socket_setup(hostname, port)
+    if listener is not None:
+        successful, sock = True, listener
+    else:
+        successful, sock = bind_socket_setup(hostname, port,
+                                             reuse_port=reuse_port)
 
     if not successful:
 
@@ -67,241 +340,786 @@ def run_server(hostname="localhost", port=9996, tickrate=1):
                     time.sleep(1)
                     ansi.clear_line()
 
-                successful, sock = bind_socket_setup(hostname, port)
+                successful, sock = bind_socket_setup(hostname, port,
+                                                     reuse_port=reuse_port)
         else:
-            print("Server setup not successful, please try again")
+            logger.error("Server setup not successful, please try again")
             return
 
-    print(f"Hosting on {hostname}:{port}")
+    s_mems = ServerMembers(hostname, port, high_water_mark,
+                           slow_consumer_policy, log_directory,
+                           relay_batch_window)
 
-    s_mems = ServerMembers(hostname, port)
+    metrics_server = None
 
-    def accept_new_connections() -> None:
-        while not s_mems.quitted:
-            try:  # Check for a new connection
-                connection, addr = sock.accept()
-                connection.settimeout(0.05)
-                s_mems.conns.append(ServerConnectionInfo(connection))
+    if auth:
+        s_mems.enable_authentication()
 
-                server_command_map["motd"](None, connection, s_mems)
+    if metrics or metrics_port is not None:
+        s_mems.enable_metrics()
 
-                print(f"New Connection! {addr}")
+    if metrics_port is not None:
+        if workers is not None:
+            metrics_port += workers.index
 
-            except socket.timeout:
-                pass
+        metrics_server = start_metrics_server(s_mems, metrics_port)
 
-    accept_connections_thread = threading.Thread(
-        target=accept_new_connections
-    )
+    # Listening sockets are registered without any data attached so they can
+    # be told apart from client and server connections in the event loop
+    sock.setblocking(False)
+    s_mems.selector.register(sock, selectors.EVENT_READ)
+
+    if workers is None:
+        logger.info("Hosting on %s:%d", hostname, port)
+    else:
+        logger.info("Hosting on %s:%d (worker %d of %d)", hostname, port,
+                    workers.index + 1, len(workers))
+
+        s_mems.workers = workers
+
+        workers.listener.setblocking(False)
+        s_mems.selector.register(workers.listener, selectors.EVENT_READ)
 
-    accept_connections_thread.start()
+        if workers.parent_pipe is not None:
+            s_mems.selector.register(workers.parent_pipe, selectors.EVENT_READ)
+
+        for connection in workers.connect_peers():
+            s_mems.add_connection(
+                ServerConnectionInfo(connection, is_server=True,
+                                     address=connection.getpeername(),
+                                     is_worker=True)
+            )
+
+    s_mems.timers.schedule(PEER_CHECK_INTERVAL, check_peers, s_mems)
 
     while not s_mems.quitted:
 
-        prev = time.time()
+        # Only wakes up for sockets that are ready to be read from (or
+        # written to when they have queued messages), or once every tick so
+        # the server can expire timers and notice it has been told to quit
+        events = s_mems.selector.select(
+            timeout=select_timeout(s_mems, tickrate)
+        )
+
+        for key, mask in events:
+            if key.data is None:
+                if key.fileobj is sock:
+                    accept_new_connection(sock, s_mems)
+                elif key.fileobj is workers.listener:
+                    accept_worker_connection(key.fileobj, s_mems)
+                else:  # Parent process is gone
+                    s_mems.quitted = True
+                continue
+
+            if mask & selectors.EVENT_WRITE:
+                flush_connection(key.data, s_mems)
+
+            if mask & selectors.EVENT_READ:
+                service_connection(key.data, s_mems)
+
+        s_mems.take_server_connections()
+        finish_authentications(s_mems)
+        release_held_writes(s_mems)
+        handle_write_events(s_mems)
+
+        s_mems.timers.advance()
+
+    s_mems.selector.close()
+    sock.close()
+
+    if s_mems.authenticator is not None:
+        s_mems.authenticator.close()
+
+    if workers is not None:
+        workers.close()
 
-        # Check currently connected sessions
-        i = 0
-        while i < len(s_mems.conns):
+    if metrics_server is not None:
+        metrics_server.shutdown()
 
-            message_obj = -1
 
-            try:  # Check if any data has been passed in and print it
+def start_metrics_server(s_mems: ServerMembers,
+                         port: int) -> "ThreadingHTTPServer | None":
+    """
+    Serves the server's metrics over HTTP on localhost
 
-                message_obj = message_recv(s_mems.conns[i].connection)
+    Returns the HTTP server, or None if the port couldn't be bound
+    """
+    # Imported here so servers without metrics start faster
+    # pylint: disable=import-outside-toplevel
+    from src.metrics import serve_metrics, METRICS_PATH
 
-                print(f"Message received from {i}")
+    try:
+        metrics_server = serve_metrics(s_mems.metrics, port)
+    except OSError:
+        logger.error("Could not serve metrics on port %d", port)
+        return None
 
-            # Connection exists, but no message received
-            except socket.timeout:
-                pass
-            except ConnectionResetError:
-                print(f"Connection {i} unexpectedly got reset")
-                s_mems.conns.pop(i)
-                i -= 1
+    logger.info("Serving metrics on http://localhost:%d%s", port,
+                METRICS_PATH)
 
-            connection_closed = False
+    return metrics_server
 
-            if message_obj is None or message_obj == CLOSE_MESSAGE:
 
-                print("Closing user " + str(i))
+def accept_new_connection(sock: socket.socket,
+                          s_mems: ServerMembers) -> None:
+    """
+    Accepts a pending connection on the listening socket and greets it with
+    the MOTD, or its challenge to sign if clients have to sign in
+    """
+    try:
+        connection, addr = sock.accept()
+    except BlockingIOError:  # Another wake-up already took the connection
+        return
 
-                conn = s_mems.conns.pop(i).connection
+    conn_info = ServerConnectionInfo(connection, address=addr)
+    s_mems.add_connection(conn_info)
 
-                if conn in s_mems.conn_channel_map:
-                    channel = s_mems.conn_channel_map[conn]
-                    channel.remove_connection(conn)
-                    del s_mems.conn_channel_map[conn]
+    if s_mems.authenticator is None:
+        server_command_map["motd"](None, connection, s_mems)
+    else:
+        start_authentication(conn_info, s_mems)
 
-                if conn in s_mems.conn_nick_map:
-                    nick = s_mems.conn_nick_map[conn]
+    logger.info("New Connection! %s", addr, extra={"conn": addr})
 
-                    if nick in s_mems.nick_conn_map:
-                        del s_mems.nick_conn_map[nick]
 
-                    del s_mems.conn_nick_map[conn]
+def accept_worker_connection(listener: socket.socket,
+                             s_mems: ServerMembers) -> None:
+    """
+    Accepts a connection from another worker on the internal listener. The
+    worker introduces itself with its first message
+    """
+    try:
+        connection, addr = listener.accept()
+    except BlockingIOError:
+        return
+
+    s_mems.add_connection(
+        ServerConnectionInfo(connection, is_server=True, address=addr,
+                             is_worker=True)
+    )
 
-                conn.close()
-                i -= 1
 
-                connection_closed = True
+def close_connection(conn_info: ServerConnectionInfo,
+                     s_mems: ServerMembers) -> None:
+    """
+    Intelligently closes a connection while removing all references to it
+    """
 
-            if isinstance(message_obj, Message) and not connection_closed:
+    logger.info("Closing user %s", conn_info.address,
+                extra={"conn": conn_info.address})
 
-                msg = message_obj.message
-                conn_info = s_mems.conns[i]
-                conn = conn_info.connection
+    s_mems.remove_connection(conn_info)
 
-                if message_obj.message_type not in (0b11, 0b10):
+    conn = conn_info.connection
 
-                    s_mems.nick_conn_map[message_obj.nickname] = conn
-                    s_mems.conn_nick_map[conn] = message_obj.nickname
+    if s_mems.workers is not None:
+        s_mems.workers.remove_peer(conn)
 
-                    is_command = msg and msg[0] == "/"
+    if conn_info.is_server:
+        relink_peer(conn, s_mems)
 
-                    if conn in s_mems.conn_channel_map:
+    if conn in s_mems.conn_channel_map:
+        channel = s_mems.conn_channel_map[conn]
+        channel.remove_connection(conn)
+        del s_mems.conn_channel_map[conn]
 
-                        channel = s_mems.conn_channel_map[conn]
+    if conn in s_mems.conn_nick_map:
+        nick = s_mems.conn_nick_map[conn]
 
-                        if is_command:
-                            channel.handle_command_input(conn, message_obj)
-                        else:
-                            channel.handle_user_message(conn, message_obj)
+        if nick in s_mems.nick_conn_map:
+            del s_mems.nick_conn_map[nick]
 
-                    elif is_command:
-                        splits = msg.split(" ")
-                        splits = list(filter(lambda s: s != "", splits))
+        del s_mems.conn_nick_map[conn]
 
-                        command = splits[0][1:]
+    conn.close()
 
-                        if command in server_command_map:
 
-                            func = server_command_map[command]
+def check_peers(s_mems: ServerMembers) -> None:
+    """
+    Closes pooled connections to other servers that are no longer healthy,
+    which relinks their channels over a new connection. Runs every
+    PEER_CHECK_INTERVAL seconds
+    """
 
-                            func(message_obj, conn, s_mems)
+    for connection in s_mems.peers.unhealthy():
+        conn_info = s_mems.conns.get(connection)
 
-                        else:
+        if conn_info is not None:
+            logger.warning("Connection to %s is unhealthy, closing it",
+                           conn_info.address,
+                           extra={"conn": conn_info.address})
+            close_connection(conn_info, s_mems)
+        else:
+            relink_peer(connection, s_mems)
 
-                            echo_conn(conn, "Command not recognized")
+    s_mems.timers.schedule(PEER_CHECK_INTERVAL, check_peers, s_mems)
 
-                elif message_obj.message_type == 0b10:
 
-                    conn_info.is_server = True
+def start_authentication(conn_info: ServerConnectionInfo,
+                         s_mems: ServerMembers) -> None:
+    """
+    Sends a new connection its challenge to sign. Closes it if it hasn't
+    signed in within AUTH_TIMEOUT seconds
+    """
 
-                    if msg.startswith(LINK_FLAG):
-                        # Channel linkage requests
-                        # Standard is:
-                        # '--link|<channel_name>|<hostname>|<port>|'
-                        # Where | is the special SEP constant
-                        splits = msg.split(SEP)
+    conn_info.authenticated = False
+    conn_info.challenge = s_mems.authenticator.take_challenge()
 
-                        channel_name = splits[1]
+    # Standard is:
+    # '--challenge|<challenge in hex>'
+    message_send(
+        Message(SERVER_CHANNEL_ID, "", time.time(), 0b10,
+                SEP.join((CHALLENGE_FLAG, conn_info.challenge.hex()))),
+        conn_info.connection
+    )
 
-                        channel_id = SERVER_CHANNEL_ID
-                        channel = None
+    s_mems.timers.schedule(AUTH_TIMEOUT, authentication_timeout, conn_info,
+                           s_mems)
 
-                        if channel_name in s_mems.channels:
-                            channel = s_mems.channels[channel_name]
-                            channel_id = channel.id
 
-                        # Requested link channel exists
-                        if channel is not None:
+def authenticate(message_obj: Message, conn_info: ServerConnectionInfo,
+                 s_mems: ServerMembers) -> None:
+    """
+    Starts checking a connection's signed challenge off the server loop.
+    The result is handled by finish_authentications
+    """
+
+    challenge = conn_info.challenge
+
+    if challenge is None:  # Already signed once
+        return
+
+    conn_info.challenge = None
+
+    # Standard is:
+    # '--auth|<public key>|<signature in hex>'
+    # Sent with the nickname to sign in as
+    splits = message_obj.message.split(SEP)
+    nickname = message_obj.nickname
+
+    try:
+        signature = bytes.fromhex(splits[2])
+    except (IndexError, ValueError):
+        reject_authentication(conn_info, s_mems, "Malformed sign in")
+        return
 
-                            link_info = ChannelLinkInfo(
-                                channel_name=channel_name,
-                                hostname=splits[2],
-                                port=int(splits[3]),
-                                connection=conn,
-                                channel_id=message_obj.channel_id
-                            )
+    if not nickname:
+        reject_authentication(conn_info, s_mems, "Set a nickname to sign in")
 
-                            channel.link_channel(link_info)
+    elif not s_mems.authenticator.verify(conn_info, challenge, nickname,
+                                         splits[1], signature):
+        reject_authentication(
+            conn_info, s_mems, f"{nickname} belongs to someone else's key"
+        )
 
-                        response = Message(
-                            channel_id,
-                            "",
-                            time.time(),
-                            0b10,
-                            SEP.join((
-                                LINK_RESPONSE_FLAG,
-                                channel_name,
-                                hostname,
-                                str(port)
-                            ))
-                        )
 
-                        message_send(response, conn)
+def finish_authentications(s_mems: ServerMembers) -> None:
+    """
+    Lets in connections whose signature checked out and closes those whose
+    didn't, since the last time it was called
+    """
+
+    if s_mems.authenticator is None:
+        return
+
+    for conn_info, nickname, valid in s_mems.authenticator.finished():
 
-                    elif msg.startswith(UNLINK_FLAG):
-                        # Channel unlinkage requests
-                        # Standard is:
-                        # '--link|<channel_name>|<hostname>|<port>|'
-                        # Where | is the special SEP constant
+        if conn_info.connection not in s_mems.conns:  # Left meanwhile
+            continue
 
-                        splits = msg.split(SEP)
+        if not valid:
+            reject_authentication(conn_info, s_mems,
+                                  f"Could not authenticate as {nickname}")
+            continue
 
-                        channel_name = splits[1]
+        conn_info.authenticated = True
+        conn_info.nickname = nickname
 
-                        if channel_name in s_mems.channels:
-                            channel = s_mems.channels[channel_name]
+        server_command_map["motd"](None, conn_info.connection, s_mems)
+        echo_conn(conn_info.connection, f"Authenticated as {nickname}")
 
-                            if channel.linked_to_channel(
-                                channel_name,
-                                hostname=splits[2],
-                                port=int(splits[3])
-                            ):
-                                channel.unlink_channel(
-                                    channel_name,
-                                    hostname=splits[2],
-                                    port=int(splits[3])
-                                )
+        logger.info("%s authenticated as %s", conn_info.address, nickname,
+                    extra={"conn": conn_info.address})
 
-                    elif msg.startswith(LINK_RESPONSE_FLAG):
-                        # Standard is:
-                        # '--response|<channel_name>|<hostname>|<port>|'
+        held_messages = conn_info.held_messages
+        conn_info.held_messages = []
 
-                        success = message_obj.channel_id != SERVER_CHANNEL_ID
+        for message_obj in held_messages:
+            handle_message(message_obj, conn_info, s_mems)
 
-                        if success:
-                            splits = msg.split(SEP)
+            if conn_info.connection not in s_mems.conns:  # Closed by it
+                break
 
-                            channel_name = splits[1]
 
-                            for channel in s_mems.channels.values():
-                                if channel.name == channel_name:
+def reject_authentication(conn_info: ServerConnectionInfo,
+                          s_mems: ServerMembers, reason: str) -> None:
+    """
+    Tells a connection why it couldn't sign in and closes it
+    """
+
+    logger.warning("%s failed to authenticate: %s", conn_info.address,
+                   reason, extra={"conn": conn_info.address})
+
+    echo_conn(conn_info.connection, reason)
+    close_connection(conn_info, s_mems)
+
+
+def authentication_timeout(conn_info: ServerConnectionInfo,
+                           s_mems: ServerMembers) -> None:
+    """
+    Closes a connection that still hasn't signed in
+    """
+
+    if (not conn_info.authenticated and
+            conn_info.connection in s_mems.conns):
+        reject_authentication(conn_info, s_mems,
+                              "Took too long to authenticate")
+
+
+def flush_connection(conn_info: ServerConnectionInfo,
+                     s_mems: ServerMembers) -> None:
+    """
+    Writes out as much of a connection's queued messages as it will take.
+    Stops waiting for it to be writable once its queue is empty
+    """
+
+    if conn_info.outbound.flush():
+        s_mems.selector.modify(
+            conn_info.connection, selectors.EVENT_READ, conn_info
+        )
+
+
+def select_timeout(s_mems: ServerMembers, tickrate: float) -> float:
+    """
+    Returns how long the server loop can wait for events: one tick, or
+    until the first batch of relays is due to be sent
+    """
+
+    timeout = 1 / tickrate
+
+    if s_mems.held_writes:
+        now = time.monotonic()
+
+        for conn_info in s_mems.held_writes:
+            timeout = min(timeout, conn_info.outbound.hold_until - now)
+
+    return max(timeout, 0)
+
+
+def release_held_writes(s_mems: ServerMembers) -> None:
+    """
+    Hands connections whose batch of relays is due back to
+    handle_write_events, to be written out once writable
+    """
+
+    if not s_mems.held_writes:
+        return
+
+    now = time.monotonic()
+    still_held = []
+
+    for conn_info in s_mems.held_writes:
+        if conn_info.outbound.hold_until <= now:
+            s_mems.write_events.append(conn_info)
+        else:
+            still_held.append(conn_info)
+
+    s_mems.held_writes = still_held
+
+
+def handle_write_events(s_mems: ServerMembers) -> None:
+    """
+    Waits for connections that have started queueing messages to become
+    writable, and closes connections that overflowed their outbound buffer
+
+    Connections holding a batch of relays are set aside until it is due
+    (see release_held_writes)
+    """
+
+    while s_mems.write_events:
+        conn_info = s_mems.write_events.popleft()
+
+        if conn_info.connection not in s_mems.conns:  # Already closed
+            continue
+
+        if conn_info.outbound.hold_until > time.monotonic():
+            s_mems.held_writes.append(conn_info)
+
+        elif conn_info.outbound.overflowed:
+            logger.warning("Connection %s is too slow, closing it",
+                           conn_info.address,
+                           extra={"conn": conn_info.address})
+            close_connection(conn_info, s_mems)
+
+        elif conn_info.outbound.pending:
+            s_mems.selector.modify(
+                conn_info.connection,
+                selectors.EVENT_READ | selectors.EVENT_WRITE,
+                conn_info
+            )
+
+
+def service_connection(conn_info: ServerConnectionInfo,
+                       s_mems: ServerMembers) -> None:
+    """
+    Reads everything available on a connection the selector has marked as
+    readable and handles every complete message in it
+    """
+
+    metrics = s_mems.metrics
+
+    try:
+        if metrics is None:
+            messages = conn_info.reader.recv(conn_info.connection)
+        else:
+            messages = metrics.read(conn_info.reader, conn_info.connection)
+    except (BlockingIOError, socket.timeout):  # Spurious wake-up
+        return
+    except OSError:
+        logger.warning("Connection %s unexpectedly got reset",
+                       conn_info.address, extra={"conn": conn_info.address})
+        close_connection(conn_info, s_mems)
+        return
+
+    if messages is None:
+        close_connection(conn_info, s_mems)
+        return
+
+    # Checked once per read so disabled debug logging costs nothing per
+    # message
+    debug = logger.isEnabledFor(logging.DEBUG)
+
+    for message_obj in messages:
+
+        if message_obj == CLOSE_MESSAGE:
+            close_connection(conn_info, s_mems)
+            return
+
+        if debug:
+            logger.debug("Message received from %s", conn_info.address,
+                         extra={"conn": conn_info.address})
+
+        handle_message(message_obj, conn_info, s_mems)
+
+        if conn_info.connection not in s_mems.conns:  # Closed by the message
+            return
+
+
+def handle_message(message_obj: Message, conn_info: ServerConnectionInfo,
+                   s_mems: ServerMembers) -> None:
+    """
+    Handles a message received from a connection, whether it is from a
+    client or from a linked server
+    """
+
+    msg = message_obj.message
+    conn = conn_info.connection
+
+    hostname = s_mems.hostname
+    port = s_mems.port
+
+    # Workers share the same public address so they identify themselves to
+    # each other by their internal one
+    if s_mems.is_worker_connection(conn):
+        hostname, port = s_mems.workers.address
+
+    if not conn_info.authenticated:
+
+        if message_obj.message_type == 0b10 and msg.startswith(AUTH_FLAG):
+            authenticate(message_obj, conn_info, s_mems)
+            return
+
+        # Nothing but signing in is taken from a connection that hasn't
+        # signed in, so it can't relay into channels or pass itself off as
+        # another server. Other servers are only trusted on connections
+        # this server made to them
+        if message_obj.message_type in (0b11, 0b10):
+            reject_authentication(conn_info, s_mems,
+                                  "Authenticate before anything else")
+            return
+
+        # Anything else sent while signing in is handled once signed in
+        if len(conn_info.held_messages) < AUTH_HELD_MESSAGES:
+            conn_info.held_messages.append(message_obj)
+        else:
+            echo_conn(conn, "Authenticate first (start the client with "
+                            "--key=<path>)")
+        return
+
+    if conn_info.nickname is not None:
+        # Signed in, so can only speak as who it signed in as, and never as
+        # a server
+        if message_obj.message_type in (0b11, 0b10):
+            logger.warning("Ignored a server message from %s, who signed in "
+                           "as %s", conn_info.address, conn_info.nickname,
+                           extra={"conn": conn_info.address})
+            return
+
+        message_obj.set_nickname(conn_info.nickname)
+
+    if message_obj.message_type not in (0b11, 0b10):
+
+        s_mems.nick_conn_map[message_obj.nickname] = conn
+        s_mems.conn_nick_map[conn] = message_obj.nickname
+
+        is_command = msg and msg[0] == "/"
+
+        if conn in s_mems.conn_channel_map:
+
+            channel = s_mems.conn_channel_map[conn]
+
+            if is_command:
+                channel.handle_command_input(conn, message_obj)
+            else:
+                channel.handle_user_message(conn, message_obj)
+
+        elif is_command:
+            splits = msg.split(" ")
+            splits = list(filter(lambda s: s != "", splits))
+
+            command = splits[0][1:]
+
+            if command in server_command_map:
+
+                func = server_command_map[command]
+
+                func(message_obj, conn, s_mems)
+
+            else:
+
+                echo_conn(conn, "Command not recognized")
+
+    elif message_obj.message_type == 0b10:
+
+        if msg.startswith(WORKER_FLAG):
+            # Another worker introducing itself. Only taken from connections
+            # on the internal listener
+            # Standard is:
+            # '--worker|<worker index>'
+            splits = msg.split(SEP)
+
+            if (s_mems.workers is None or not conn_info.is_worker or
+                    len(splits) < 2 or not splits[1].isdigit() or
+                    int(splits[1]) >= len(s_mems.workers)):
+                logger.warning("Ignored a worker introduction from %s",
+                               conn_info.address,
+                               extra={"conn": conn_info.address})
+                return
+
+            s_mems.workers.add_peer(int(splits[1]), conn)
+
+            # Catches it up on channels created before it connected
+            for channel in list(s_mems.channels.values()):
+                s_mems.workers.replicate_channel(channel, [conn])
+
+        elif msg.startswith((REPLICATE_FLAG, SYNC_FLAG, DESTROY_FLAG)):
+            # Another worker created, changed or destroyed a channel. Only
+            # taken from workers that have introduced themselves
+            if not s_mems.is_worker_connection(conn):
+                logger.warning("Ignored a channel replica from %s",
+                               conn_info.address,
+                               extra={"conn": conn_info.address})
+                return
+
+            apply_replica(msg, conn, s_mems)
+
+        elif msg.startswith(LINK_FLAG):
+            # Channel linkage requests
+            # Standard is:
+            # '--link|<channel_name>|<hostname>|<port>|[capabilities...]'
+            # Where | is the special SEP constant
+            splits = msg.split(SEP)
+
+            channel_name = splits[1]
+
+            channel_id = SERVER_CHANNEL_ID
+            channel = s_mems.resolve_channel(channel_name)
+
+            if channel is not None:
+                channel_id = channel.id
+
+            # Requested link channel exists
+            if channel is not None:
+
+                link_info = ChannelLinkInfo(
+                    channel_name=channel_name,
+                    hostname=splits[2],
+                    port=int(splits[3]),
+                    connection=conn,
+                    channel_id=message_obj.channel_id,
+                    batched=s_mems.batches_with(splits[4:])
+                )
+
+                channel.link_channel(link_info)
+
+            # Replies to the server go over the connection it made too, and
+            # it is relinked if that connection drops
+            if not s_mems.is_worker_connection(conn):
+                conn_info.is_server = True
+                s_mems.peers.adopt(splits[2], int(splits[3]), conn)
+
+            response = Message(
+                channel_id,
+                "",
+                time.time(),
+                0b10,
+                SEP.join((
+                    LINK_RESPONSE_FLAG,
+                    channel_name,
+                    hostname,
+                    str(port),
+                    *s_mems.link_capabilities()
+                ))
+            )
+
+            message_send(response, conn)
+
+        elif msg.startswith(UNLINK_FLAG):
+            # Channel unlinkage requests
+            # Standard is:
+            # '--link|<channel_name>|<hostname>|<port>|'
+            # Where | is the special SEP constant
+
+            splits = msg.split(SEP)
+
+            channel_name = splits[1]
+            channel = s_mems.resolve_channel(channel_name)
+
+            if (channel is not None and
+                    channel.linked_to_channel(channel_name, splits[2],
+                                              int(splits[3]))):
+                channel.unlink_channel(channel_name, splits[2],
+                                       int(splits[3]))
+
+        elif msg.startswith(LINK_RESPONSE_FLAG):
+            # Standard is:
+            # '--response|<channel_name>|<hostname>|<port>|[capabilities...]'
+
+            success = message_obj.channel_id != SERVER_CHANNEL_ID
+
+            if success:
+                splits = msg.split(SEP)
+
+                channel_name = splits[1]
+                channel = s_mems.resolve_channel(channel_name)
+
+                if channel is not None:
+
+                    link_info = ChannelLinkInfo(
+                        channel_name=channel_name,
+                        hostname=splits[2],
+                        port=int(splits[3]),
+                        connection=conn,
+                        channel_id = message_obj.channel_id,
+                        batched=s_mems.batches_with(splits[4:])
+                    )
+
+                    channel.link_channel(link_info)
+
+    elif message_obj.message_type == 0b11:
+        # / Cross server channel synchronisation
+
+        channel = s_mems.resolve_channel(message_obj.channel_id)
+
+        if channel is not None:
+            message_obj.set_message_type(0b00)
+            channel.broadcast_message(
+                message_obj,
+                is_relay=True,
+                relay_to_workers=not s_mems.is_worker_connection(conn)
+            )
+        else:
+            logger.warning(
+                "Attempt to relay to a channel that doesn't exist (id:%d)",
+                message_obj.channel_id, extra={"conn": conn_info.address}
+            )
+
+
+def apply_replica(msg: str, conn: socket.socket,
+                  s_mems: ServerMembers) -> None:
+    """
+    Applies a channel being created, changed or destroyed on another worker
+    to the replica of it on this worker
+    """
+
+    splits = msg.split(SEP)
+
+    flag = splits[0]
+    channel_name = splits[1]
+    channel = s_mems.resolve_channel(channel_name)
+
+    if flag == REPLICATE_FLAG:
+        # Always followed by a link request for it. Other workers pass
+        # replicas on too, so they can arrive after the channel already has
+        # Standard is:
+        # '--replicate|<channel_name>|<password>|<messages to store>|
+        #  <created on>'
+        created_on = int(splits[4])
+
+        if channel is not None:
+            adopt_replica(channel, splits[2] or None, int(splits[3]),
+                          created_on)
+            return
+
+        channel = Channel(s_mems, None, channel_name, splits[2] or None)
+        channel.set_messages_to_store(int(splits[3]))
+        channel.created_on = created_on
+
+        s_mems.channels[channel.id] = channel
+        s_mems.channels.add_alias(channel.id, channel_name)
+
+        # Links with the remaining workers too, as relays from a worker
+        # aren't passed on to other workers
+        s_mems.workers.replicate_channel(channel, [
+            connection
+            for connection in s_mems.workers.connections.values()
+            if connection is not conn
+        ])
+
+    elif channel is None:  # Already destroyed on this worker
+        return
+
+    elif flag == SYNC_FLAG:
+        # Standard is:
+        # '--sync|<channel_name>|<password>|<messages to store>|<created on>'
+        channel.password = splits[2] or None
+        channel.set_messages_to_store(int(splits[3]))
+
+    else:
+        # Members on this worker migrate along with the rest
+        # Standard is:
+        # '--destroy|<channel_name>|[<hostname>|<port>]'
+        if len(splits) >= 4:
+            broadcast_migration(channel, splits[2], int(splits[3]),
+                                channel.id)
+
+        channel.destroy()
+
+
+def adopt_replica(channel: Channel, password: str, messages_to_store: int,
+                  created_on: int) -> None:
+    """
+    Settles a channel that was created on two workers at once. Both copies
+    are linked either way, but the one created on the lower worker index
+    wins: its password and message limit replace this worker's, and whoever
+    created the channel here is no longer its admin
+    """
 
-                                    link_info = ChannelLinkInfo(
-                                        channel_name=channel_name,
-                                        hostname=splits[2],
-                                        port=int(splits[3]),
-                                        connection=conn,
-                                        channel_id = message_obj.channel_id
-                                    )
+    if channel.created_on is None or created_on >= channel.created_on:
+        return
 
-                                    channel.link_channel(link_info)
-                                    break
+    channel.password = password
+    channel.set_messages_to_store(messages_to_store)
+    channel.created_on = created_on
 
-                elif message_obj.message_type == 0b11:
-                    # / Cross server channel synchronisation
+    if channel.creator in channel.connections:
+        channel.echo_conn(
+            channel.creator,
+            f"{channel.name} was created on another worker first, "
+            "so you are no longer its admin"
+        )
 
-                    conn_info.is_server = True
-
-                    if message_obj.channel_id in s_mems.channels:
-                        channel = s_mems.channels[message_obj.channel_id]
-                        message_obj.set_message_type(0b00)
-                        channel.broadcast_message(message_obj, is_relay=True)
-                    else:
-                        print(
-                            "WARNING: Attempt to relay to a channel that "
-                            f"doesn't exist (id:{message_obj.channel_id})"
-                        )
-
-            i += 1
-
-        # Sleep until the next server tick
-        time.sleep(max((1 / tickrate) - (time.time() - prev), 0))
-
-    accept_connections_thread.join()
+    channel.creator = None
 
 
 if __name__ == "__main__":
@@ -4,6 +4,9 @@ access a channel by its name and the protocol needing to be
 able to access a channel by its id
 """
 
+import itertools
+
+
 # Idea by https://discuss.python.org/t/syntax-for-aliases-to-keys-of-python-dictionaries/14992
 class AliasDictionary:
     """
@@ -15,6 +18,10 @@ class AliasDictionary:
         self.dict = dict(*args, **kwargs)
         self.aliases = {}
 
+        # Key -> the aliases that point to it, so deleting a key only looks
+        # at its own aliases
+        self.key_aliases = {}
+
     def __getitem__(self, key):
 
         # Will get the key an alias points to if exists, otherwise
@@ -35,46 +42,22 @@ class AliasDictionary:
 
     def __delitem__(self, key):
         """
-        Recursively deletes all keys and aliases
+        Deletes a key along with every alias pointing to it. Deleting an
+        alias deletes the key it points to
         """
+        key = self.aliases.get(key, key)
 
-        recurse = False
-
-        aliased_key = self.aliases.get(key, key)
-
-        if aliased_key == key:  # Key to delete is direct key not alias
-            del self.dict[aliased_key]
-        else:  # Key to delete is an alias
-            recurse = True
-            del self.aliases[key]
-
-        marked_for_deletion = set()
-
-        # Deletes all aliases that points to this key
-        # Need separate loops because cannot delete items as you iterate
-        for alias, i_key in self.aliases.items():
-            if aliased_key == i_key:
-                marked_for_deletion.add(alias)
+        del self.dict[key]
 
-        for alias in marked_for_deletion:
+        for alias in self.key_aliases.pop(key, ()):
             del self.aliases[alias]
 
-        if recurse:
-            self.__delitem__(aliased_key)
-
     def __iter__(self):
         """
-        Iterates through all keys and aliases in the dictionary
+        Iterates through all keys and aliases in the dictionary, without
+        copying them
         """
-
-        # Not the cleanest solution because iterating through builtin
-        # python dictionaries uses a dict_keyiterator under the hood,
-        # but it works
-        alias_keys = self.aliases.keys()
-        all_keys = list(self.dict.keys())
-        all_keys.extend(alias_keys)
-
-        return iter(all_keys)
+        return itertools.chain(self.dict, self.aliases)
 
     def __contains__(self, key) -> bool:
         return key in self.aliases or key in self.dict
@@ -82,6 +65,12 @@ class AliasDictionary:
     def __len__(self) -> int:
         return len(self.dict)
 
+    def get(self, key, default=None):
+        """
+        Returns the value for a key or alias, or default if there isn't one
+        """
+        return self.dict.get(self.aliases.get(key, key), default)
+
     def values(self):
         """
         Intermediate method to return the stored dictionary's values
@@ -92,4 +81,10 @@ class AliasDictionary:
         """
         Binds an alias to a key
         """
+        previous_key = self.aliases.get(alias)
+
+        if previous_key is not None:  # Rebinding, so unbinds it first
+            self.key_aliases[previous_key].discard(alias)
+
         self.aliases[alias] = key
+        self.key_aliases.setdefault(key, set()).add(alias)
@@ -4,6 +4,9 @@ ANSI based utility functions for the multi-con module
 
 import sys
 
+# Clears the screen and the scrollback
+CLEAR_TERMINAL = "\033[2J\n\033[3J\n"
+
 
 def clear_line() -> None:
     """
@@ -24,5 +27,4 @@ def clear_terminal() -> None:
     """
     Clears the terminal using ansi escape sequences
     """
-    print("\033[2J")
-    print("\033[3J")
+    sys.stdout.write(CLEAR_TERMINAL)
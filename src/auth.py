@@ -3,6 +3,7 @@
     Authentication functions for dechat
 """
 
+import os
 from Crypto.PublicKey import RSA
 from Crypto.Signature import pkcs1_15
 from Crypto.Random import get_random_bytes
@@ -82,6 +83,48 @@ def verify_challenge(challenge: bytes, response: bytes, pub_key) -> bool:
         return False
 
 
+def load_or_create_key(path: str):
+    """
+        load_or_create_key
+        Loads a private key from a PEM file, generating and saving a new
+        one there first if it doesn't exist
+        :: path :: File the private key is kept in
+        Returns the private key
+    """
+    if os.path.isfile(path):
+        with open(path, "rb") as file:
+            return RSA.import_key(file.read())
+
+    key = RSA.generate(2048)
+
+    # Only readable by its owner, as it proves who they are
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+
+    with os.fdopen(descriptor, "wb") as file:
+        file.write(key.export_key())
+
+    return key
+
+
+def export_public_key(priv_key) -> str:
+    """
+        export_public_key
+        The printable public key to share with the server
+        :: priv_key :: Private key the public key belongs to
+    """
+    return priv_key.public_key().export_key().decode("ascii")
+
+
+def import_public_key(printable_key: str):
+    """
+        import_public_key
+        Turns a printable public key back into a key object
+        :: printable_key :: Public key from export_public_key
+        Raises ValueError if it isn't a valid key
+    """
+    return RSA.import_key(printable_key)
+
+
 # This is an example of using the authentication
 if __name__ == "__main__":
     main()
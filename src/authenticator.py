@@ -0,0 +1,266 @@
+"""
+Challenge-response authentication for servers started with --auth (see
+auth.py for the RSA functions)
+
+New client connections are sent a random challenge and have to sign it with
+their private key before anything else they send is handled. The nickname
+they sign in with is bound to their public key the first time it is used,
+so after that only the same key can sign in as it
+
+Nothing here blocks the server loop on RSA: challenges are generated ahead
+of time, imported public keys are cached, and signatures are verified on a
+thread pool whose results the server loop collects every tick, or as soon
+as they are ready if it sets on_result
+
+pycryptodome and the thread pool are only imported once the first
+connection needs a challenge, so servers (and clients) that never sign
+anyone in start without paying for them
+"""
+
+# False-positive import error
+# pylint: disable=import-error, import-outside-toplevel
+
+import os
+import threading
+from collections import deque, OrderedDict
+from importlib.util import find_spec
+
+# Checked without importing it, which is slow
+HAS_CRYPTO = find_spec("Crypto") is not None
+
+# Challenges kept generated ahead of time, topped up once fewer than
+# CHALLENGE_POOL_LOW are left
+CHALLENGE_POOL_SIZE = 1024
+CHALLENGE_POOL_LOW = 256
+
+# Imported public keys kept, least recently used dropped first
+KEY_CACHE_SIZE = 10_000
+
+# Threads verifying signatures
+AUTH_WORKERS = min(os.cpu_count() or 1, 8)
+
+# Keys that can be signed in with. Verifying with a bigger modulus or
+# exponent takes far longer, so one could keep the verifying threads busy
+MIN_KEY_BITS = 2048
+MAX_KEY_BITS = 4096
+PUBLIC_EXPONENT = 65537
+
+# Longest printable public key taken, a 4096 bit key being 799 characters.
+# Checked before anything is imported
+MAX_PRINTABLE_KEY_LENGTH = 1024
+
+
+def is_acceptable_key(key) -> bool:
+    """
+    Whether an imported key is a public key of a size and exponent that is
+    quick to verify with
+    """
+    return (
+        not key.has_private() and key.e == PUBLIC_EXPONENT and
+        MIN_KEY_BITS <= key.size_in_bits() <= MAX_KEY_BITS
+    )
+
+
+class Authenticator:
+    """
+    Hands out challenges, verifies signed ones off the server loop and
+    remembers which public key each nickname belongs to
+    """
+
+    def __init__(self, workers: int = AUTH_WORKERS,
+                 pool_size: int = CHALLENGE_POOL_SIZE,
+                 key_cache_size: int = KEY_CACHE_SIZE) -> None:
+        """
+        :: workers : int :: Threads verifying signatures
+        :: pool_size : int :: Challenges kept generated ahead of time
+        :: key_cache_size : int :: Imported public keys kept
+        """
+        # auth.py and the thread pool, once load is called
+        self.auth = None
+        self.executor = None
+        self.workers = workers
+
+        self.pool_size = pool_size
+        self.challenges = deque()
+        self.refilling = False
+
+        # Printable public key -> imported key
+        self.key_cache_size = key_cache_size
+        self.keys = OrderedDict()
+        self.keys_lock = threading.Lock()
+
+        # Nickname -> printable public key it is bound to
+        self.nick_keys = {}
+
+        # (conn_info, nickname, printable key, valid) for every verified
+        # signature, collected by the server loop with finished()
+        self.results = deque()
+
+        # Called from the thread pool once a result is ready, to wake the
+        # server loop, or None if the loop collects them every tick
+        self.on_result = None
+
+        self.verified = 0
+        self.rejected = 0
+        self.key_cache_hits = 0
+        self.key_cache_misses = 0
+        self.pool_misses = 0
+
+    def load(self) -> None:
+        """
+        Imports the RSA functions, starts the thread pool and fills the
+        challenge pool. Done when the first challenge is needed
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from src import auth
+
+        self.auth = auth
+        self.executor = ThreadPoolExecutor(max_workers=self.workers,
+                                           thread_name_prefix="auth")
+
+        self.fill_pool()
+
+    def fill_pool(self) -> None:
+        """
+        Generates challenges until the pool is full
+        """
+        generate_challenge = self.auth.generate_challenge
+
+        while len(self.challenges) < self.pool_size:
+            self.challenges.append(generate_challenge())
+
+        self.refilling = False
+
+    def take_challenge(self) -> bytes:
+        """
+        Returns a new challenge, used for one connection only
+        """
+        if self.auth is None:
+            self.load()
+
+        try:
+            challenge = self.challenges.popleft()
+        except IndexError:  # Ran dry before the pool was topped up
+            self.pool_misses += 1
+            challenge = self.auth.generate_challenge()
+
+        if len(self.challenges) < CHALLENGE_POOL_LOW and not self.refilling:
+            self.refilling = True
+            self.executor.submit(self.fill_pool)
+
+        return challenge
+
+    def verify(self, conn_info: "ServerConnectionInfo", challenge: bytes,
+               nickname: str, printable_key: str, signature: bytes) -> bool:
+        """
+        Starts verifying a signed challenge on the thread pool. The result
+        is handed back by finished()
+
+        Returns False straight away if the nickname belongs to another key,
+        or the key is too long to be one that can be signed in with
+        """
+        bound_key = self.nick_keys.get(nickname)
+
+        if ((bound_key is not None and bound_key != printable_key) or
+                len(printable_key) > MAX_PRINTABLE_KEY_LENGTH):
+            self.rejected += 1
+            return False
+
+        self.executor.submit(self.check, conn_info, challenge, nickname,
+                             printable_key, signature)
+
+        return True
+
+    def check(self, conn_info: "ServerConnectionInfo", challenge: bytes,
+              nickname: str, printable_key: str, signature: bytes) -> None:
+        """
+        Verifies a signed challenge. Runs on the thread pool
+        """
+        try:
+            key = self.get_key(printable_key)
+            valid = self.auth.verify_challenge(challenge, signature, key)
+        except (ValueError, IndexError, TypeError):  # Malformed key
+            valid = False
+
+        self.results.append((conn_info, nickname, printable_key, valid))
+
+        if self.on_result is not None:
+            self.on_result()
+
+    def get_key(self, printable_key: str):
+        """
+        Returns the imported public key, importing it if it isn't cached
+
+        Raises ValueError if it isn't a key that can be signed in with
+        """
+        with self.keys_lock:
+            key = self.keys.get(printable_key)
+
+            if key is not None:
+                self.keys.move_to_end(printable_key)
+                self.key_cache_hits += 1
+                return key
+
+            self.key_cache_misses += 1
+
+        key = self.auth.import_public_key(printable_key)
+
+        if not is_acceptable_key(key):
+            raise ValueError("Key can't be signed in with")
+
+        with self.keys_lock:
+            self.keys[printable_key] = key
+
+            if len(self.keys) > self.key_cache_size:
+                self.keys.popitem(last=False)
+
+        return key
+
+    def finished(self) -> list[tuple["ServerConnectionInfo", str, bool]]:
+        """
+        Returns (conn_info, nickname, whether it signed in) for every
+        signature verified since the last call. Binds nicknames signing in
+        for the first time to their key. Should only be called from the
+        server loop
+        """
+        finished = []
+
+        while self.results:
+            conn_info, nickname, printable_key, valid = (
+                self.results.popleft()
+            )
+
+            # Another connection may have claimed the nickname meanwhile
+            if valid:
+                bound_key = self.nick_keys.setdefault(nickname, printable_key)
+                valid = bound_key == printable_key
+
+            if valid:
+                self.verified += 1
+            else:
+                self.rejected += 1
+
+            finished.append((conn_info, nickname, valid))
+
+        return finished
+
+    def stats(self) -> dict[str, int]:
+        """
+        How many sign-ins succeeded and failed, and how well the pool and
+        key cache are keeping up
+        """
+        return {
+            "verified": self.verified,
+            "rejected": self.rejected,
+            "key_cache_hits": self.key_cache_hits,
+            "key_cache_misses": self.key_cache_misses,
+            "challenge_pool": len(self.challenges),
+            "challenge_pool_misses": self.pool_misses
+        }
+
+    def close(self) -> None:
+        """
+        Stops the thread pool
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,70 @@
+"""
+Thread-safe queue whose consumer sleeps until there is something to take
+"""
+
+import threading
+from collections import deque
+
+
+class BlockingQueue:
+    """
+    A FIFO queue one consumer thread takes from in batches, sleeping while
+    it is empty instead of polling it
+
+    Closing the queue wakes the consumer. Items already queued (or queued
+    afterwards) are still handed out, and once the queue is closed and
+    empty the consumer is told to stop
+    """
+
+    def __init__(self) -> None:
+        self.items = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def append(self, item) -> None:
+        """
+        Adds an item to the back of the queue
+        """
+        with self.condition:
+            self.items.append(item)
+            self.condition.notify()
+
+    def appendleft(self, item) -> None:
+        """
+        Adds an item to the front of the queue, to be taken before anything
+        already queued
+        """
+        with self.condition:
+            self.items.appendleft(item)
+            self.condition.notify()
+
+    def close(self) -> None:
+        """
+        Wakes the consumer and stops it from waiting for more items
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def take_all(self, timeout: float = None) -> list | None:
+        """
+        Waits for the queue to have items then takes every one of them, so
+        items queued in quick succession are handled together
+
+        Returns None once the queue is closed and empty, or an empty list if
+        timeout seconds pass first
+        """
+        with self.condition:
+            if not self.items and not self.closed:
+                self.condition.wait(timeout)
+
+            if not self.items:
+                return None if self.closed else []
+
+            items = list(self.items)
+            self.items.clear()
+
+            return items
@@ -6,13 +6,13 @@ to every member messages as well as having its own commands
 # False-positive import error
 # pylint: disable=import-error
 
-import threading
 import socket
 import time
 from src import utilities
 from src.commons import ServerMembers, ChannelLinkInfo
-from src.protocol import message_send
+from src.protocol import message_send, send_bytes
 from src.message import Message
+from src.ring_buffer import RingBuffer
 from src.constants import MAX_NICK_LENGTH, CHANNEL_NICK
 
 
@@ -34,8 +34,31 @@ class Channel:
         self.id = Channel.instances
         Channel.instances += 1
 
+        # Index of the worker the channel was created on, when the server
+        # has workers. If two workers create it at once, the copy created
+        # on the lower index wins on every worker
+        self.created_on = None
+
         self.messages_to_store = 50
-        self.messages = []
+        self.messages = RingBuffer(self.messages_to_store)
+
+        # Encoded bytes of each stored message, in step with self.messages,
+        # so history can be replayed without encoding anything
+        self.message_encodings = RingBuffer(self.messages_to_store)
+
+        # When the server keeps logs, history lives on disk instead of in
+        # the rings above, and survives restarts. Only the owning worker
+        # writes a channel's log when there are several
+        self.log = None
+
+        if s_mems.log_directory is not None and s_mems.owns_channel(name):
+            # Imported here so servers without --log-dir start faster
+            # pylint: disable=import-outside-toplevel
+            from src.channel_log import ChannelLog, channel_log_directory
+
+            self.log = ChannelLog(
+                channel_log_directory(s_mems.log_directory, name)
+            )
         self.connections = set()
         self.connection_nickname_map = {}
         self.nickname_connection_map = {}
@@ -44,6 +67,11 @@ class Channel:
         self.seen_messages = set()
         self.marked_for_deletion = set()
 
+        # Number of Message.to_bytes calls avoided by encoding broadcasts once
+        # instead of once per recipient
+        self.last_encodes_saved = 0
+        self.total_encodes_saved = 0
+
     def destroy(self) -> None:
         """
         Intelligently deletes the channel while removing all references to it
@@ -55,14 +83,20 @@ class Channel:
 
         del self.s_mems.channels[self.id]  # Deleting by name works too
 
-        marked_for_deletion = set()
+        for key in self.linked_channels:
+            self.s_mems.unindex_link(key)
 
-        for conn, channel in self.s_mems.conn_channel_map.items():
-            if channel == self:
-                marked_for_deletion.add(conn)
+        # Only members of the channel are mapped to it, so there's no need
+        # to look through every connection on the server
+        for conn in self.connections:
+            if self.s_mems.conn_channel_map.get(conn) is self:
+                del self.s_mems.conn_channel_map[conn]
+
+        if self.log is not None:
+            self.log.close()
 
-        for conn in marked_for_deletion:
-            del self.s_mems.conn_channel_map[conn]
+        if self.s_mems.metrics is not None:
+            self.s_mems.metrics.forget_channel(self.name)
 
         del self
 
@@ -72,7 +106,7 @@ class Channel:
         """
         return self.name
 
-    def get_messages(self) -> list:
+    def get_messages(self) -> RingBuffer:
         """
         Getter for messages
         """
@@ -88,7 +122,17 @@ class Channel:
         """
         Setter for messages to store
         """
-        self.messages_to_store = num
+        self.messages_to_store = max(num, 0)
+        self.messages.resize(self.messages_to_store)
+        self.message_encodings.resize(self.messages_to_store)
+
+    def sync_workers(self) -> None:
+        """
+        Replicates the channel's password and message limit to the other
+        workers, if there are any, once either has changed
+        """
+        if self.s_mems.workers is not None:
+            self.s_mems.workers.sync_channel(self)
 
     def set_nickname(self, connection: socket.socket, nickname: str) -> str:
         """
@@ -122,9 +166,8 @@ class Channel:
         """
         Links to a channel on another server. LINKS ONE WAY ONLY
         """
-        key = (info.channel_name, info.hostname, info.port)
-
-        self.linked_channels[key] = info
+        self.linked_channels[info.key()] = info
+        self.s_mems.index_link(info)
 
     def unlink_channel(self, channel_name: str, hostname: str,
                        port: int) -> None:
@@ -133,7 +176,10 @@ class Channel:
 
         Will raise error of input is not valid
         """
-        del self.linked_channels[(channel_name, hostname, port)]
+        key = (channel_name, hostname, port)
+
+        del self.linked_channels[key]
+        self.s_mems.unindex_link(key)
 
     def linked_to_channel(self, channel_name: str, hostname: str,
                           port: int) -> None:
@@ -176,11 +222,45 @@ class Channel:
         """
         Echoes message history to a connection when they first join
         a channel
+
+        The whole backlog is sent as a single write of the stored encodings
+        """
+
+        if self.log is not None:
+            backlog = self.log.read_newest(
+                self.messages_to_store - ignore_recent,
+                skip=ignore_recent,
+                channel_id=self.id
+            )
+        else:
+            num_messages = len(self.message_encodings) - ignore_recent
+
+            backlog = b"".join(
+                self.message_encodings.newest(num_messages, skip=ignore_recent)
+            )
+
+        if backlog:
+            send_bytes(backlog, connection)
+
+    def send_history_since(self, connection: socket.socket,
+                           timestamp: int) -> None:
+        """
+        Echoes every stored message since a timestamp to a connection as a
+        single write
         """
 
-        for i, msg in enumerate(reversed(self.messages)):
-            if i < len(self.messages) - ignore_recent:
-                message_send(msg, connection)
+        if self.log is not None:
+            backlog = self.log.read_since(timestamp, channel_id=self.id,
+                                          limit=self.messages_to_store)
+        else:
+            backlog = b"".join(
+                encoding for message_obj, encoding in
+                zip(self.messages, self.message_encodings)
+                if message_obj.timestamp >= timestamp
+            )
+
+        if backlog:
+            send_bytes(backlog, connection)
 
     def remove_connection(self, connection: socket.socket) -> None:
         """
@@ -200,11 +280,25 @@ class Channel:
 
     def broadcast_message(self, message_obj: Message,
                           save_message: bool = True, do_relay: bool = True,
-                          is_relay: bool = False):
+                          is_relay: bool = False,
+                          relay_to_workers: bool = True) -> int:
         """
         Echoes a message of type to all connections in the channel
+
+        The message is encoded once for all members and linked channels,
+        rather than once per recipient
+
+        Messages relayed from another worker already reached every worker,
+        so relay_to_workers should be False for them
+
+        Returns the number of encodes saved by doing so
         """
 
+        metrics = self.s_mems.metrics
+
+        if metrics is not None:
+            start = time.perf_counter()
+
         # This has 2 purposes:
         # 1. Making handling repeat messages channel id agnostic
         # 2. In case the client needs to know which channel the message came
@@ -217,46 +311,80 @@ class Channel:
 
                 self.marked_for_deletion.add(message_obj)
 
-                def callback() -> None:
-                    if message_obj in self.seen_messages:
-                        self.seen_messages.remove(message_obj)
-                    self.marked_for_deletion.remove(message_obj)
-
                 # Gives some time for linked messages to circulate around
                 # multiple linked channels before removing it from the set to
                 # free up space
-                threading.Timer(10, callback).start()
+                self.s_mems.timers.schedule(
+                    10, self.forget_message, message_obj
+                )
 
-            return
+            return 0
 
         self.seen_messages.add(message_obj)
 
-        def cleanup() -> None:
-            # If this message isn't relayed back and hence will never
-            # be marked for deletion otherwise
-            if message_obj in self.seen_messages:
-                self.seen_messages.remove(message_obj)
+        # If this message isn't relayed back and hence will never be marked
+        # for deletion otherwise
+        self.s_mems.timers.schedule(20, self.seen_messages.discard,
+                                    message_obj)
 
-        threading.Timer(20, cleanup).start()
+        links = []
 
-        if save_message:
-            self.messages.insert(0, message_obj)
+        if do_relay:
+            links = [
+                link_info for link_info in self.linked_channels.values()
+                if relay_to_workers or
+                not self.s_mems.is_worker_connection(link_info.connection)
+            ]
+
+        encodes = 0
 
-            if len(self.messages) > self.messages_to_store:
-                self.messages = self.messages[:self.messages_to_store]
+        if self.connections or save_message or links:
+            encoding = message_obj.to_bytes()
+            encodes += 1
+
+        if save_message:
+            if self.log is not None:
+                self.log.append(encoding, message_obj.timestamp)
+            else:
+                self.messages.append(message_obj)
+                self.message_encodings.append(encoding)
 
         for conn in self.connections:
-            message_send(message_obj, conn)
+            send_bytes(encoding, conn)
 
-        if do_relay:
+        if links:
+
+            # Relays only differ from the encoding above in their type, and
+            # only the channel id differs between links so everything after
+            # it is shared
+            relay_tail = memoryview(Message.retyped(encoding, 0b11))[2:]
+
+            for link_info in links:
+                channel_id_bytes = link_info.channel_id.to_bytes(2, "little")
+                send_bytes(channel_id_bytes + relay_tail, link_info.connection,
+                           batch=link_info.batched)
+
+        recipients = len(self.connections) + len(links)
 
-            relay = message_obj.copy()
+        # Encoding for history alone isn't a saving but isn't a loss either
+        encodes_saved = max(recipients - encodes, 0)
 
-            relay.set_message_type(0b11)
+        self.last_encodes_saved = encodes_saved
+        self.total_encodes_saved += encodes_saved
 
-            for link_info in self.linked_channels.values():
-                relay.set_channel_id(link_info.channel_id)
-                message_send(relay, link_info.connection)
+        if metrics is not None:
+            metrics.broadcast(self.name, recipients,
+                              time.perf_counter() - start, encodes_saved)
+
+        return encodes_saved
+
+    def forget_message(self, message_obj: Message) -> None:
+        """
+        Stops treating a message as already seen once it has had time to
+        circulate around linked channels
+        """
+        self.seen_messages.discard(message_obj)
+        self.marked_for_deletion.discard(message_obj)
 
     def announce(self, msg: str) -> None:
         """
@@ -322,6 +450,10 @@ class Channel:
 
                     echo = "\n".join(map(nick_extractor, self.connections))
 
+                    # Members on other workers are never seen by this one
+                    if self.s_mems.workers is not None:
+                        echo += "\n(only members on this worker are listed)"
+
                     self.echo_conn(connection, echo)
 
                 case "emote":
@@ -346,8 +478,11 @@ class Channel:
 
                         echo = target_name
 
-                        if not user_exists:
+                        # Members on other workers aren't known here
+                        if not user_exists and self.s_mems.workers is None:
                             echo += " doesn't exist"
+                        elif not user_exists:
+                            echo += " isn't on this worker"
                         elif is_admin:
                             echo += " is an operator"
                         else:
@@ -364,6 +499,16 @@ class Channel:
                         message_limit = int(splits[1])
 
                         self.set_messages_to_store(message_limit)
+                        self.sync_workers()
+
+                case "history":
+
+                    if len(splits) >= 2 and utilities.is_integer(splits[1]):
+                        seconds = int(splits[1])
+
+                        self.send_history_since(
+                            connection, int(time.time()) - seconds
+                        )
 
                 case "pass":
 
@@ -381,6 +526,7 @@ class Channel:
                             password = splits[1]
 
                         self.password = password
+                        self.sync_workers()
 
                 case "msg":
 
@@ -408,6 +554,13 @@ class Channel:
                         message_send(message_obj, connection)
                         message_send(message_obj, target_conn)
 
+                    # Private messages can't reach members on other workers,
+                    # so say so instead of dropping them without a word
+                    elif target_name and self.s_mems.workers is not None:
+                        self.echo_conn(
+                            connection, f"{target_name} isn't on this worker"
+                        )
+
                 case "quit":
 
                     quit_message = ""
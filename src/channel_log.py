@@ -0,0 +1,424 @@
+"""
+Optional persistent history for channels. Messages are appended to disk in
+their wire format so they can be replayed straight from a memory-mapped
+segment without decoding or re-encoding them
+"""
+
+# False-positive import error
+# pylint: disable=import-error
+
+import os
+import re
+import mmap
+import struct
+from bisect import bisect_left, bisect_right
+from src.message import Message, HEADER_STRUCT, HEADER_SIZE
+
+SEGMENT_SUFFIX = ".log"
+INDEX_SUFFIX = ".index"
+
+# Segments are sealed and a new one started once they reach this size
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+
+# A sparse index entry is written every this many messages in a segment
+DEFAULT_INDEX_INTERVAL = 64
+
+# Most messages one replay copies out of the log, however many are asked
+# for, so a replay never reads a whole log into memory
+DEFAULT_MAX_REPLAY = 1000
+
+# Frame number, byte offset in the segment and the newest timestamp of any
+# message up to and including it. Relayed messages can be older than the
+# ones before them, so this is what keeps the index sorted by time
+INDEX_ENTRY_STRUCT = struct.Struct("<QQI")
+
+CHANNEL_ID_STRUCT = struct.Struct("<H")
+
+SAFE_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def channel_log_directory(log_directory: str, channel_name: str) -> str:
+    """
+    Returns the directory a channel's log is kept in. Names that aren't safe
+    to use as a directory name are hex encoded, behind a prefix no safe name
+    can start with so the two can't clash
+    """
+    if SAFE_NAME_PATTERN.match(channel_name):
+        return os.path.join(log_directory, channel_name)
+
+    return os.path.join(log_directory, "%" + channel_name.encode().hex())
+
+
+def map_file(path: str) -> mmap.mmap | None:
+    """
+    Memory maps a file read-only. Returns None for empty files since they
+    can't be mapped
+    """
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return None
+
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class LogSegment:
+    """
+    One file of a channel log along with its sparse index
+    """
+
+    def __init__(self, directory: str, first_frame: int,
+                 index_interval: int, newest_timestamp: int = 0) -> None:
+        """
+        :: directory : str :: Directory of the channel's log
+        :: first_frame : int :: Number of the segment's first message
+        :: index_interval : int :: Messages between index entries
+        :: newest_timestamp : int :: Newest timestamp in earlier segments
+        """
+        self.first_frame = first_frame
+        self.index_interval = index_interval
+
+        prefix = os.path.join(directory, f"{first_frame:020d}")
+        self.log_path = prefix + SEGMENT_SUFFIX
+        self.index_path = prefix + INDEX_SUFFIX
+
+        # (frame number, byte offset, newest timestamp) of every
+        # index_interval'th message in the segment, starting from its first
+        self.index = []
+        self.num_frames = 0
+        self.size = 0
+
+        # Newest timestamp of any message in this segment or before it
+        self.newest_timestamp = newest_timestamp
+
+        self.log_file = None
+        self.index_file = None
+
+        # Read-only map of the segment and a view of it, kept for replays
+        # until the segment grows past mapped_size
+        self.buffer = None
+        self.view = None
+        self.mapped_size = 0
+
+    def load(self) -> None:
+        """
+        Reads the index of an existing segment and works out how many
+        messages it holds. A message only partially written before a crash
+        is cut off
+        """
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, "rb") as file:
+                data = file.read()
+
+            usable = len(data) - len(data) % INDEX_ENTRY_STRUCT.size
+            self.index = list(INDEX_ENTRY_STRUCT.iter_unpack(data[:usable]))
+
+        file_size = os.path.getsize(self.log_path)
+
+        # Entries past the end of the file can't be trusted
+        while self.index and self.index[-1][1] >= file_size:
+            self.index.pop()
+
+        frame, offset = self.first_frame, 0
+
+        if self.index:
+            frame, offset = self.index[-1][0], self.index[-1][1]
+            self.newest_timestamp = max(self.newest_timestamp,
+                                        self.index[-1][2])
+
+        buffer = map_file(self.log_path)
+
+        if buffer is not None:
+            with buffer, memoryview(buffer) as view:
+                while file_size - offset >= HEADER_SIZE:
+                    end = offset + Message.frame_length(view, offset)
+
+                    if end > file_size:
+                        break
+
+                    timestamp = HEADER_STRUCT.unpack_from(view, offset)[2]
+                    self.newest_timestamp = max(self.newest_timestamp,
+                                                timestamp)
+
+                    # Fills in index entries that never made it to disk
+                    local_frame = frame - self.first_frame
+                    indexed = self.index and self.index[-1][0] >= frame
+
+                    if local_frame % self.index_interval == 0 and not indexed:
+                        self.index.append(
+                            (frame, offset, self.newest_timestamp)
+                        )
+
+                    offset = end
+                    frame += 1
+
+        self.num_frames = frame - self.first_frame
+        self.size = offset
+
+        if offset < file_size:
+            os.truncate(self.log_path, offset)
+
+        # Rewrites the index so it matches what was recovered
+        with open(self.index_path, "wb") as file:
+            for entry in self.index:
+                file.write(INDEX_ENTRY_STRUCT.pack(*entry))
+
+    def open_for_append(self) -> None:
+        """
+        Opens the segment's files so messages can be appended to it
+        """
+        # Kept open for as long as the segment is being appended to
+        # pylint: disable=consider-using-with
+        self.log_file = open(self.log_path, "ab")
+        self.index_file = open(self.index_path, "ab")
+
+    def append(self, encoding: bytes, timestamp: int) -> None:
+        """
+        Appends an encoded message to the end of the segment
+        """
+        self.newest_timestamp = max(self.newest_timestamp, timestamp)
+
+        if self.num_frames % self.index_interval == 0:
+            entry = (self.first_frame + self.num_frames, self.size,
+                     self.newest_timestamp)
+            self.index.append(entry)
+            self.index_file.write(INDEX_ENTRY_STRUCT.pack(*entry))
+            self.index_file.flush()
+
+        self.log_file.write(encoding)
+
+        # Has to reach the OS for replays through mmap to see it
+        self.log_file.flush()
+
+        self.num_frames += 1
+        self.size += len(encoding)
+
+    def close(self) -> None:
+        """
+        Closes the segment's files if they are open
+        """
+        if self.log_file is not None:
+            self.log_file.close()
+            self.index_file.close()
+            self.log_file = None
+            self.index_file = None
+
+    def mapped(self) -> memoryview:
+        """
+        Returns a view of every message in the segment. The segment is only
+        mapped again once it has grown since it was last mapped
+        """
+        if self.size > self.mapped_size:
+            self.unmap()
+
+            self.buffer = map_file(self.log_path)
+            self.view = memoryview(self.buffer)
+            self.mapped_size = self.size
+
+        return self.view
+
+    def unmap(self) -> None:
+        """
+        Releases the segment's map if it has one
+        """
+        if self.buffer is not None:
+            self.view.release()
+            self.buffer.close()
+            self.buffer = None
+            self.view = None
+            self.mapped_size = 0
+
+    def offset_of(self, view: memoryview, frame: int) -> int:
+        """
+        Returns the byte offset of a message in the segment by jumping to
+        the closest index entry before it and scanning forward
+        """
+        if frame >= self.first_frame + self.num_frames:
+            return self.size
+
+        index_frame, offset, _ = self.index[
+            (frame - self.first_frame) // self.index_interval
+        ]
+
+        for _ in range(frame - index_frame):
+            offset += Message.frame_length(view, offset)
+
+        return offset
+
+    def first_frame_since(self, view: memoryview, timestamp: int) -> int:
+        """
+        Returns the number of the first message at or after a timestamp, or
+        the frame after the end of the segment if there is none
+        """
+        timestamps = [entry[2] for entry in self.index]
+
+        # Starts scanning from the last index entry that only follows older
+        # messages, as none before it can be at or after the timestamp
+        position = max(bisect_left(timestamps, timestamp) - 1, 0)
+        frame, offset, _ = self.index[position]
+
+        end_frame = self.first_frame + self.num_frames
+
+        while frame < end_frame:
+            if HEADER_STRUCT.unpack_from(view, offset)[2] >= timestamp:
+                return frame
+
+            offset += Message.frame_length(view, offset)
+            frame += 1
+
+        return end_frame
+
+
+class ChannelLog:
+    """
+    Append-only log of a channel's messages on disk, split into segments
+    with a sparse index of message numbers, offsets and timestamps
+
+    Replays copy the requested messages straight out of the memory-mapped
+    segments, so any amount of history can be kept without holding it in
+    memory, and a restarted server can replay it right away
+    """
+
+    def __init__(self, directory: str,
+                 segment_size: int = DEFAULT_SEGMENT_SIZE,
+                 index_interval: int = DEFAULT_INDEX_INTERVAL,
+                 max_replay: int = DEFAULT_MAX_REPLAY) -> None:
+        self.directory = directory
+        self.segment_size = segment_size
+        self.index_interval = index_interval
+        self.max_replay = max_replay
+
+        os.makedirs(directory, exist_ok=True)
+
+        self.segments = []
+
+        first_frames = sorted(
+            int(file_name[:-len(SEGMENT_SUFFIX)])
+            for file_name in os.listdir(directory)
+            if file_name.endswith(SEGMENT_SUFFIX)
+        )
+
+        newest_timestamp = 0
+
+        for first_frame in first_frames:
+            segment = LogSegment(directory, first_frame, index_interval,
+                                 newest_timestamp)
+            segment.load()
+            self.segments.append(segment)
+
+            newest_timestamp = segment.newest_timestamp
+
+        if not self.segments:
+            self.segments.append(LogSegment(directory, 0, index_interval))
+
+        self.segments[-1].open_for_append()
+
+    def __len__(self) -> int:
+        last = self.segments[-1]
+        return last.first_frame + last.num_frames
+
+    def append(self, encoding: bytes, timestamp: int) -> None:
+        """
+        Appends an encoded message to the log
+        """
+        active = self.segments[-1]
+
+        if active.size and active.size + len(encoding) > self.segment_size:
+            active.close()
+
+            active = LogSegment(self.directory, len(self),
+                                self.index_interval, active.newest_timestamp)
+            active.open_for_append()
+            self.segments.append(active)
+
+        active.append(encoding, timestamp)
+
+    def read_newest(self, count: int, skip: int = 0,
+                    channel_id: int = None) -> bytearray:
+        """
+        Returns the count newest messages, leaving out the skip most recent
+        ones, as one buffer of encoded messages from oldest to newest
+
+        If channel_id is given the messages are rewritten to have it, as
+        channel ids can change between restarts
+        """
+        end = len(self) - max(skip, 0)
+        start = max(end - max(count, 0), 0)
+
+        return self.read_range(start, end, channel_id)
+
+    def read_since(self, timestamp: int, channel_id: int = None,
+                   limit: int = None) -> bytearray:
+        """
+        Returns every message since a timestamp as one buffer of encoded
+        messages from oldest to newest, or only the limit newest of them
+        if there are more
+        """
+        # The first segment with a message at or after the timestamp
+        newest_timestamps = [
+            segment.newest_timestamp for segment in self.segments
+        ]
+
+        position = bisect_left(newest_timestamps, timestamp)
+        start = len(self)
+
+        for segment in self.segments[position:]:
+            if not segment.num_frames:
+                continue
+
+            frame = segment.first_frame_since(segment.mapped(), timestamp)
+
+            if frame < segment.first_frame + segment.num_frames:
+                start = frame
+                break
+
+        if limit is not None:
+            start = max(start, len(self) - max(limit, 0))
+
+        return self.read_range(start, len(self), channel_id)
+
+    def read_range(self, start: int, end: int,
+                   channel_id: int = None) -> bytearray:
+        """
+        Returns messages numbered start up to (not including) end as one
+        buffer of encoded messages, only the max_replay newest of them if
+        there are more
+        """
+        backlog = bytearray()
+        start = max(start, end - self.max_replay)
+
+        if start >= end:
+            return backlog
+
+        first_frames = [segment.first_frame for segment in self.segments]
+        position = bisect_right(first_frames, start) - 1
+
+        for segment in self.segments[position:]:
+            if segment.first_frame >= end:
+                break
+
+            if not segment.num_frames:
+                continue
+
+            view = segment.mapped()
+
+            begin = segment.offset_of(view, max(start, segment.first_frame))
+            stop = segment.offset_of(view, end)
+
+            backlog += view[begin:stop]
+
+        if channel_id is not None:
+            offset = 0
+            while offset < len(backlog):
+                CHANNEL_ID_STRUCT.pack_into(backlog, offset, channel_id)
+                offset += Message.frame_length(backlog, offset)
+
+        return backlog
+
+    def close(self) -> None:
+        """
+        Closes the log. It can be opened again later with a new ChannelLog
+        """
+        self.segments[-1].close()
+
+        for segment in self.segments:
+            segment.unmap()
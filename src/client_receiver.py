@@ -0,0 +1,170 @@
+"""
+A single thread that receives from every server a client is connected to
+"""
+
+# False-positive import error
+# pylint: disable=import-error
+
+import logging
+import selectors
+import socket
+import threading
+
+logger = logging.getLogger("dechat.client")
+
+
+class ClientReceiver:
+    """
+    Waits on a selector for any of the client's connections to have data
+    and hands each message to on_message as soon as it has arrived, so
+    receiving takes one thread however many servers the client is connected
+    to and no time is spent sleeping between polls
+
+    Connections can be registered and unregistered from any thread
+    """
+
+    def __init__(self, on_message: callable, on_closed: callable) -> None:
+        """
+        :: on_message : callable :: Called with (message, wrapper) for every
+                                    message received
+        :: on_closed : callable :: Called with the wrapper whose connection
+                                   was closed or reset by the server
+        """
+        self.on_message = on_message
+        self.on_closed = on_closed
+
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+
+        # Written to whenever the registered connections change or the
+        # receiver is stopped, so select returns straight away
+        self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+        self.wakeup_receiver.setblocking(False)
+        self.wakeup_sender.setblocking(False)
+        self.selector.register(self.wakeup_receiver, selectors.EVENT_READ)
+
+        self.running = False
+        self.thread = None
+
+    def start(self) -> None:
+        """
+        Starts the receive thread if it isn't running already
+        """
+        with self.lock:
+            if self.running:
+                return
+
+            self.running = True
+            self.thread = threading.Thread(target=self.receive_loop)
+            self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the receive thread. Should not be called by the receive thread
+        """
+        with self.lock:
+            self.running = False
+            thread = self.thread
+            self.thread = None
+
+        self.wakeup()
+
+        if thread is not None:
+            thread.join()
+
+    def register(self, wrapper: "ClientConnectionWrapper") -> None:
+        """
+        Starts receiving from a wrapper's connection
+        """
+        with self.lock:
+            self.selector.register(
+                wrapper.connection, selectors.EVENT_READ, wrapper
+            )
+
+        wrapper.listener = self
+        self.wakeup()
+
+    def unregister(self, wrapper: "ClientConnectionWrapper") -> None:
+        """
+        Stops receiving from a wrapper's connection. Does not close it
+        """
+        with self.lock:
+            try:
+                self.selector.unregister(wrapper.connection)
+            except (KeyError, ValueError):  # Already unregistered or closed
+                pass
+
+        self.wakeup()
+
+    def wakeup(self) -> None:
+        """
+        Makes a blocked select return
+        """
+        try:
+            self.wakeup_sender.send(b"\x00")
+        except (BlockingIOError, OSError):  # Already has a wakeup pending
+            pass
+
+    def receive_loop(self) -> None:
+        """
+        Receives until stopped
+        """
+        while self.running:
+
+            for key, _ in self.selector.select():
+
+                if key.fileobj is self.wakeup_receiver:
+                    try:
+                        self.wakeup_receiver.recv(4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+
+                try:
+                    self.receive(key.data)
+                except Exception:  # pylint: disable=broad-exception-caught
+                    # Only the connection it came from is dropped, so every
+                    # other connection keeps being received from
+                    logger.exception("Error handling a message from %s, "
+                                     "disconnecting from it",
+                                     key.data.name or "a server")
+                    self.drop(key.data)
+
+        with self.lock:
+            self.selector.close()
+            self.wakeup_receiver.close()
+            self.wakeup_sender.close()
+
+    def receive(self, wrapper: "ClientConnectionWrapper") -> None:
+        """
+        Handles every message that has arrived on a wrapper's connection
+        """
+        if wrapper.is_closed() or not wrapper.states.listening:
+            return
+
+        try:
+            messages = wrapper.reader.recv(wrapper.connection)
+        except (BlockingIOError, socket.timeout):  # Spurious wake-up
+            return
+        except OSError:  # Reset, or closed by another thread
+            messages = None
+
+        if messages is None:
+            self.drop(wrapper)
+            return
+
+        for message_obj in messages:
+            if wrapper.is_closed() or not wrapper.states.listening:
+                break
+
+            self.on_message(message_obj, wrapper)
+
+    def drop(self, wrapper: "ClientConnectionWrapper") -> None:
+        """
+        Stops receiving from a wrapper's connection and hands the wrapper to
+        on_closed to be closed
+        """
+        self.unregister(wrapper)
+
+        if not wrapper.is_closed():
+            self.on_closed(wrapper)
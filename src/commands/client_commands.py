@@ -13,6 +13,7 @@ from src.commons import (
     ClientConnectionWrapper,
 )
 from src.protocol import conn_socket_setup
+from src.scrollback import terminal_height
 from src.constants import MAX_NICK_LENGTH
 
 # Prefix meanings:
@@ -131,7 +132,7 @@ def cs_quit(user_input: str, client) -> None:
         client.log("Disconnecting from server...")
 
     # Not gonna send close message here as to not block
-    wrapper.input_queue.insert(0, user_input)
+    wrapper.input_queue.appendleft(user_input)
 
 
 def cs_connect(user_input: str, client) -> None:
@@ -195,6 +196,54 @@ def cs_connect(user_input: str, client) -> None:
         )
 
 
+def cs_page_up(user_input: str, client) -> None:
+    """
+    CLIENT SENDER COMMAND
+
+    Pages back through the stored messages of the server being displayed.
+    New messages aren't printed until paged back down to the newest
+    """
+    page(user_input, client, up=True)
+
+
+def cs_page_down(user_input: str, client) -> None:
+    """
+    CLIENT SENDER COMMAND
+
+    Pages forward through the stored messages of the server being displayed
+    """
+    page(user_input, client, up=False)
+
+
+def page(user_input: str, client, up: bool) -> None:
+    """
+    Scrolls the current wrapper's scrollback by the number of pages given
+    (1 if not given) and redraws it
+    """
+
+    splits = utilities.smart_split(user_input)
+
+    pages = 1
+
+    if len(splits) >= 2:
+        if not utilities.is_integer(splits[1]) or int(splits[1]) < 1:
+            client.log("Usage: /page_up [pages] or /page_down [pages]")
+            return
+
+        pages = int(splits[1])
+
+    wrapper = client.current_wrapper
+    scrollback = wrapper.scrollback
+    height = terminal_height()
+
+    if up:
+        scrollback.page_up(height, pages)
+    else:
+        scrollback.page_down(height, pages)
+
+    client.print_wrapper_history(wrapper, clear_terminal=True)
+
+
 # The _ parameter is there just to make the function signature work with both
 # client commands and client sender commands
 def m_list_displays(_user_input: str, client) -> None:
@@ -289,7 +338,9 @@ limbo_command_map = {
 client_sender_command_map = {
     "reply": cs_reply,
     "quit": cs_quit,
-    "connect": cs_connect
+    "connect": cs_connect,
+    "page_up": cs_page_up,
+    "page_down": cs_page_down
 }
 
 
@@ -297,6 +348,8 @@ multicon_client_sender_command_map = {
     "reply": cs_reply,
     "quit": cs_quit,
     "connect": cs_connect,
+    "page_up": cs_page_up,
+    "page_down": cs_page_down,
     "list_displays": m_list_displays,
     "display": m_display
 }
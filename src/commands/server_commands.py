@@ -6,25 +6,25 @@ command to their functions
 # False-positive import error
 # pylint: disable=import-error
 
-import os
+import logging
 import socket
 import time
 import threading
 from src import utilities
-from src.commons import ServerMembers, ServerConnectionInfo
+from src.commons import ServerMembers
 from src.channel import Channel
 from src.message import Message
-from src.protocol import message_send, conn_socket_setup
+from src.protocol import message_send, send_bytes
 from src.constants import (
     SERVER_CHANNEL_ID,
-    CONFIG_FOLDER,
     LINK_FLAG,
     UNLINK_FLAG,
     MIGRATE_FLAG,
+    PEER_RECONNECT_DELAYS,
     SEP
 )
 
-PROJECT_PATH = os.getcwd()
+logger = logging.getLogger("dechat.server")
 
 
 def echo_conn(conn: socket.socket, message: str) -> None:
@@ -77,54 +77,39 @@ def join_user_to_channel(obj: Message, conn: socket.socket,
 
 
 def c_motd(_obj: Message, conn: socket.socket,
-           _s_mems: ServerMembers) -> None:
+           s_mems: ServerMembers) -> None:
     """
     Displays server's config/MOTD.txt file
     """
 
-    file_path = f"{PROJECT_PATH}/{CONFIG_FOLDER}/MOTD.txt"
-    file_exists = os.path.isfile(file_path)
-
-    if file_exists:
-        with open(file_path, "r", encoding="ascii") as file:
-
-            echo_conn(conn, file.read())
-    else:
-        echo_conn(conn, "Server has no MOTD file")
+    send_bytes(
+        s_mems.config.get_encoding("MOTD.txt", "Server has no MOTD file"),
+        conn
+    )
 
 
 def c_help(_obj: Message, conn: socket.socket,
-           _s_mems: ServerMembers) -> None:
+           s_mems: ServerMembers) -> None:
     """
     Displays server's config/HELP.txt file
     """
 
-    file_path = f"{PROJECT_PATH}/{CONFIG_FOLDER}/HELP.txt"
-    file_exists = os.path.isfile(file_path)
-
-    if file_exists:
-        with open(file_path, "r", encoding="ascii") as file:
-
-            echo_conn(conn, file.read())
-    else:
-        echo_conn(conn, "Server has no HELP file")
+    send_bytes(
+        s_mems.config.get_encoding("HELP.txt", "Server has no HELP file"),
+        conn
+    )
 
 
 def c_rules(_obj: Message, conn: socket.socket,
-            _s_mems: ServerMembers) -> None:
+            s_mems: ServerMembers) -> None:
     """
     Displays server's config/RULES.txt file
     """
 
-    file_path = f"{PROJECT_PATH}/{CONFIG_FOLDER}/RULES.txt"
-    file_exists = os.path.isfile(file_path)
-
-    if file_exists:
-        with open(file_path, "r", encoding="ascii") as file:
-
-            echo_conn(conn, file.read())
-    else:
-        echo_conn(conn, "Server has no RULES file")
+    send_bytes(
+        s_mems.config.get_encoding("RULES.txt", "Server has no RULES file"),
+        conn
+    )
 
 
 def c_info(_obj: Message, conn: socket.socket,
@@ -141,11 +126,17 @@ def c_info(_obj: Message, conn: socket.socket,
 
     uptime = time.time() - s_mems.created_timestamp
 
-    client_conns = list(filter(lambda i: not i.is_server, s_mems.conns))
+    client_conns = list(
+        filter(lambda i: not i.is_server, list(s_mems.conns.values()))
+    )
 
     server_name = f"Server: {s_mems.hostname}:{s_mems.port}"
     channels_str = f"{len(s_mems.channels)} channels"
     users_str = f"{len(client_conns)} connected users"
+
+    # Every worker only knows about its own connections
+    if s_mems.workers is not None:
+        users_str += f" on worker {s_mems.workers.index}"
     uptime_str = f"Uptime: {utilities.format_time_period(uptime)}"
 
     echo = "\n".join([
@@ -158,6 +149,21 @@ def c_info(_obj: Message, conn: socket.socket,
     echo_conn(conn, echo)
 
 
+def c_stats(_obj: Message, conn: socket.socket,
+            s_mems: ServerMembers) -> None:
+    """
+    Echoes connection with the server's metrics, if it is collecting them
+    """
+
+    if s_mems.metrics is None:
+        echo_conn(
+            conn, "Server isn't collecting metrics (start it with --metrics)"
+        )
+        return
+
+    echo_conn(conn, s_mems.metrics.summary())
+
+
 def c_list(_obj: Message, conn: socket.socket,
            s_mems: ServerMembers) -> None:
     """
@@ -205,6 +211,10 @@ def c_create(obj: Message, conn: socket.socket,
     s_mems.channels[channel.id] = channel
     s_mems.channels.add_alias(channel.id, channel_name)
 
+    if s_mems.workers is not None:
+        channel.created_on = s_mems.workers.index
+        s_mems.workers.replicate_channel(channel)
+
     join_user_to_channel(
         obj, conn, s_mems, channel, password
     )
@@ -276,7 +286,10 @@ def c_invite(obj: Message, conn: socket.socket,
     channel_name = splits[2]
 
     if target_nick not in s_mems.nick_conn_map:
-        echo_conn(conn, f"User {target_nick} doesn't exist")
+        if s_mems.workers is not None:
+            echo_conn(conn, f"User {target_nick} isn't on this worker")
+        else:
+            echo_conn(conn, f"User {target_nick} doesn't exist")
         return
 
     if channel_name not in s_mems.channels:
@@ -298,7 +311,7 @@ def c_die(_obj: Message, _conn: socket.socket, s_mems: ServerMembers) -> None:
     """
     Kills the server
     """
-    s_mems.quitted = True
+    s_mems.quit()
 
 
 def c_link(obj: Message, conn: socket.socket, s_mems: ServerMembers) -> None:
@@ -318,12 +331,7 @@ def c_link(obj: Message, conn: socket.socket, s_mems: ServerMembers) -> None:
         return
 
     channel_name = splits[1]
-    channel = None
-
-    for i_channel in s_mems.channels.values():
-        if i_channel.name == channel_name:
-            channel = i_channel
-            break
+    channel = s_mems.resolve_channel(channel_name)
 
     if channel is None:  # No channels with the inputted name found
         echo_conn(
@@ -343,45 +351,93 @@ def c_link(obj: Message, conn: socket.socket, s_mems: ServerMembers) -> None:
         )
         return
 
-    threading.Thread(
-        target=link_thread,
-        args=(channel.id, channel_name, hostname, port, conn, s_mems)
-    ).start()
+    args = (channel.id, channel_name, hostname, port, conn, s_mems)
 
+    if s_mems.connector is not None:
+        run_coroutine(link_coroutine(*args))
+    else:
+        threading.Thread(target=link_thread, args=args).start()
 
-def link_thread(channel_id: int, channel_name: str, hostname: str,
-                port: int, requester: socket.socket,
-                s_mems: ServerMembers) -> None:
+
+def link_request(channel_id: int, channel_name: str,
+                 s_mems: ServerMembers) -> Message:
     """
-    Links in a separate thread to not block the main thread
+    Returns the request sent to another server to link a channel with it
     """
 
-    echo_conn(requester, f"Establishing connection with {hostname}:{port}...")
-
-    successful, connection = conn_socket_setup(hostname, port)
-
-    if not successful:
-        echo_conn(requester, "Connection unsuccessful")
-        return
+    return Message(
+        channel_id,
+        "",
+        time.time(),
+        0b10,
+        SEP.join((
+            LINK_FLAG,
+            channel_name,
+            s_mems.hostname,
+            str(s_mems.port),
+            *s_mems.link_capabilities()
+        ))
+    )
 
-    echo_conn(requester, "Connection successful. Sending link request")
 
-    s_mems.conns.append(ServerConnectionInfo(connection, is_server=True))
+def unlink_request(channel_id: int, channel_name: str,
+                   s_mems: ServerMembers) -> Message:
+    """
+    Returns the request sent to another server to unlink a channel from it
+    """
 
-    request = Message(
+    return Message(
         channel_id,
         "",
         time.time(),
         0b10,
         SEP.join((
-            LINK_FLAG,
+            UNLINK_FLAG,
             channel_name,
             s_mems.hostname,
             str(s_mems.port)
         ))
     )
 
-    message_send(request, connection)
+
+def link_thread(channel_id: int, channel_name: str, hostname: str,
+                port: int, requester: socket.socket,
+                s_mems: ServerMembers) -> None:
+    """
+    Links in a separate thread to not block the main thread
+    """
+
+    echo_conn(requester, f"Establishing connection with {hostname}:{port}...")
+
+    connection = s_mems.peers.get(hostname, port)
+
+    if connection is None:
+        echo_conn(requester, "Connection unsuccessful")
+        return
+
+    echo_conn(requester, "Connection successful. Sending link request")
+
+    message_send(link_request(channel_id, channel_name, s_mems), connection)
+
+
+async def link_coroutine(channel_id: int, channel_name: str, hostname: str,
+                         port: int, requester: socket.socket,
+                         s_mems: ServerMembers) -> None:
+    """
+    Links without blocking the event loop when running the asyncio server
+    """
+
+    echo_conn(requester, f"Establishing connection with {hostname}:{port}...")
+
+    connection = await s_mems.peers.get_async(hostname, port)
+
+    if connection is None:
+        echo_conn(requester, "Connection unsuccessful")
+        return
+
+    echo_conn(requester, "Connection successful. Sending link request")
+
+    message_send(link_request(channel_id, channel_name, s_mems), connection)
 
 
 def c_unlink(obj: Message, conn: socket.socket,
@@ -400,12 +456,7 @@ def c_unlink(obj: Message, conn: socket.socket,
         return
 
     channel_name = splits[1]
-    channel = None
-
-    for i_channel in s_mems.channels.values():
-        if i_channel.name == channel_name:
-            channel = i_channel
-            break
+    channel = s_mems.resolve_channel(channel_name)
 
     if channel is None:  # No channels with the inputted name found
         echo_conn(
@@ -423,10 +474,12 @@ def c_unlink(obj: Message, conn: socket.socket,
         echo_conn(conn, "Unlinked channel on current end")
         channel.unlink_channel(channel_name, hostname, port)
 
-    threading.Thread(
-        target=unlink_thread,
-        args=(channel.id, channel_name, hostname, port, conn, s_mems)
-    ).start()
+    args = (channel.id, channel_name, hostname, port, conn, s_mems)
+
+    if s_mems.connector is not None:
+        run_coroutine(unlink_coroutine(*args))
+    else:
+        threading.Thread(target=unlink_thread, args=args).start()
 
 
 def unlink_thread(channel_id: int, channel_name: str, hostname: str,
@@ -438,28 +491,139 @@ def unlink_thread(channel_id: int, channel_name: str, hostname: str,
 
     echo_conn(requester, f"Establishing connection with {hostname}:{port}...")
 
-    successful, connection = conn_socket_setup(hostname, port)
+    connection = s_mems.peers.get(hostname, port)
 
-    if not successful:
+    if connection is None:
         echo_conn(requester, "Connection unsuccessful")
         return
 
     echo_conn(requester, "Connection successful. Sending unlink request")
 
-    request = Message(
-        channel_id,
-        "",
-        time.time(),
-        0b10,
-        SEP.join((
-            UNLINK_FLAG,
-            channel_name,
-            s_mems.hostname,
-            str(s_mems.port)
-        ))
-    )
+    message_send(unlink_request(channel_id, channel_name, s_mems), connection)
+
+
+async def unlink_coroutine(channel_id: int, channel_name: str,
+                           hostname: str, port: int,
+                           requester: socket.socket,
+                           s_mems: ServerMembers) -> None:
+    """
+    Unlinks without blocking the event loop when running the asyncio server
+    """
+
+    echo_conn(requester, f"Establishing connection with {hostname}:{port}...")
+
+    connection = await s_mems.peers.get_async(hostname, port)
+
+    if connection is None:
+        echo_conn(requester, "Connection unsuccessful")
+        return
+
+    echo_conn(requester, "Connection successful. Sending unlink request")
+
+    message_send(unlink_request(channel_id, channel_name, s_mems), connection)
 
-    message_send(request, connection)
+
+def relink_peer(connection: socket.socket, s_mems: ServerMembers) -> None:
+    """
+    Drops the links that went over a connection to another server once it
+    has closed. If the connection was pooled, reconnects to the server and
+    links the channels again
+    """
+
+    peer = s_mems.peers.discard(connection)
+    dropped = s_mems.drop_links(connection)
+
+    if peer is None:
+        return
+
+    channel_names = [link_info.channel_name for link_info in dropped]
+
+    if not channel_names:
+        return
+
+    logger.warning("Lost connection to %s:%s, relinking %d channel(s)",
+                   *peer, len(channel_names))
+
+    args = (*peer, channel_names, s_mems)
+
+    if s_mems.connector is not None:
+        run_coroutine(relink_coroutine(*args))
+    else:
+        threading.Thread(target=relink_thread, args=args, daemon=True).start()
+
+
+def run_coroutine(coroutine) -> None:
+    """
+    Schedules a coroutine on the asyncio server's event loop
+    """
+    # Only the asyncio server (which has already imported asyncio) gets
+    # here, so the selector server and client don't import it at startup
+    import asyncio  # pylint: disable=import-outside-toplevel
+
+    asyncio.ensure_future(coroutine)
+
+
+def relink_thread(hostname: str, port: int, channel_names: list[str],
+                  s_mems: ServerMembers) -> None:
+    """
+    Reconnects to a server in a separate thread, backing off between
+    attempts, and sends link requests for channels that were linked to it
+    """
+
+    for delay in PEER_RECONNECT_DELAYS:
+        time.sleep(delay)
+
+        if s_mems.quitted:
+            return
+
+        connection = s_mems.peers.get(hostname, port)
+
+        if connection is not None:
+            send_relinks(hostname, port, channel_names, connection, s_mems)
+            return
+
+    logger.warning("Gave up reconnecting to %s:%s", hostname, port)
+
+
+async def relink_coroutine(hostname: str, port: int,
+                           channel_names: list[str],
+                           s_mems: ServerMembers) -> None:
+    """
+    relink_thread for the asyncio server
+    """
+    import asyncio  # pylint: disable=import-outside-toplevel
+
+    for delay in PEER_RECONNECT_DELAYS:
+        await asyncio.sleep(delay)
+
+        if s_mems.quitted:
+            return
+
+        connection = await s_mems.peers.get_async(hostname, port)
+
+        if connection is not None:
+            send_relinks(hostname, port, channel_names, connection, s_mems)
+            return
+
+    logger.warning("Gave up reconnecting to %s:%s", hostname, port)
+
+
+def send_relinks(hostname: str, port: int, channel_names: list[str],
+                 connection: socket.socket, s_mems: ServerMembers) -> None:
+    """
+    Sends link requests for channels that still exist and haven't been
+    linked again in the meantime (e.g. by the other server)
+    """
+
+    for channel_name in channel_names:
+        channel = s_mems.resolve_channel(channel_name)
+
+        if (channel is None or
+                s_mems.resolve_link(channel_name, hostname, port)):
+            continue
+
+        message_send(link_request(channel.id, channel_name, s_mems),
+                     connection)
 
 
 def c_migrate(obj: Message, conn: socket.socket,
@@ -479,12 +643,7 @@ def c_migrate(obj: Message, conn: socket.socket,
         return
 
     channel_name = splits[1]
-    channel = None
-
-    for i_channel in s_mems.channels.values():
-        if i_channel.name == channel_name:
-            channel = i_channel
-            break
+    channel = s_mems.resolve_channel(channel_name)
 
     if channel is None:  # No channels with the inputted name found
         echo_conn(
@@ -498,7 +657,9 @@ def c_migrate(obj: Message, conn: socket.socket,
         echo_conn(conn, "Invalid hostname:port")
         return
 
-    if not channel.linked_to_channel(channel_name, hostname, port):
+    link_info = s_mems.resolve_link(channel_name, hostname, port)
+
+    if link_info is None:
         echo_conn(conn, f"Not linked to {channel_name} on {hostname}:{port}")
         return
 
@@ -511,40 +672,45 @@ def c_migrate(obj: Message, conn: socket.socket,
 
     echo_conn(conn, echo)
 
-    link_info = channel.linked_channels[(channel_name, hostname, port)]
-
-    unlink_request = Message(
-        link_info.channel_id,
-        "",
-        time.time(),
-        0b10,
-        SEP.join((
-            UNLINK_FLAG,
-            channel_name,
-            s_mems.hostname,
-            str(s_mems.port)
-        ))
+    message_send(
+        unlink_request(link_info.channel_id, channel_name, s_mems),
+        link_info.connection
     )
 
-    message_send(unlink_request, link_info.connection)
+    broadcast_migration(channel, link_info.hostname, link_info.port,
+                        link_info.channel_id)
+    channel.destroy()
+
+    # Members on other workers migrate too
+    if s_mems.workers is not None:
+        s_mems.workers.destroy_channel(
+            channel, migrate_to=(link_info.hostname, link_info.port)
+        )
+
+
+def broadcast_migration(channel: Channel, hostname: str, port: int,
+                        channel_id: int) -> None:
+    """
+    Tells every member of a channel on this server to migrate to the
+    channel of the same name on another server
+    """
 
     broadcast = Message(
-        link_info.channel_id,  # This will probably be unused since channel
-        "",                    # name is also being broadcasted
+        channel_id,  # This will probably be unused since channel
+        "",          # name is also being broadcasted
         time.time(),
         0b10,  # Not sure about this message type??
         SEP.join((
             MIGRATE_FLAG,
-            channel_name,
-            link_info.hostname,
-            str(link_info.port)
+            channel.name,
+            hostname,
+            str(port)
         ))
     )
 
     # Save message probably doesn't matter since channel is being destroyed
     # anyways but just to be safe
     channel.broadcast_message(broadcast, save_message=False, do_relay=False)
-    channel.destroy()
 
 
 server_command_map = {
@@ -552,6 +718,7 @@ server_command_map = {
     "help": c_help,
     "rules": c_rules,
     "info": c_info,
+    "stats": c_stats,
     "list": c_list,
     "create": c_create,
     "join": c_join,
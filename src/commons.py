@@ -5,10 +5,36 @@ Common information containers to be used between files
 # False-positive import error
 # pylint: disable=import-error
 
+import os
+import selectors
 import socket
+import threading
 import time
+from collections import deque
 from src.alias_dictionary import AliasDictionary
+from src.blocking_queue import BlockingQueue
+from src.timer_wheel import TimerWheel
+from src.peer_pool import PeerPool
+from src.config_cache import ConfigCache
+from src.ring_buffer import RingBuffer
 from src.message import Message
+from src.protocol import (
+    MessageReader,
+    OutboundBuffer,
+    register_outbound,
+    unregister_outbound,
+    set_send_observer
+)
+from src.constants import (
+    CLIENT_MESSAGES_TO_STORE,
+    CONFIG_FOLDER,
+    DEFAULT_HIGH_WATER_MARK,
+    DEFAULT_SLOW_CONSUMER_POLICY,
+    RELAY_BATCH_CAPABILITY
+)
+
+# Seconds a thread waits for the server loop to take a connection it made
+HANDOVER_TIMEOUT = 5
 
 
 class ServerMembers:
@@ -17,31 +43,387 @@ class ServerMembers:
     so functions in server_commands.py can mutate server members by
     passing in an instance of this class
     """
-    def __init__(self, hostname: str, port: int) -> None:
+    def __init__(self, hostname: str, port: int,
+                 high_water_mark: int = DEFAULT_HIGH_WATER_MARK,
+                 slow_consumer_policy: str = DEFAULT_SLOW_CONSUMER_POLICY,
+                 log_directory: str = None,
+                 relay_batch_window: float = None) -> None:
         self.hostname = hostname
         self.port = port
 
+        # Seconds relays to linked servers that also batch are held back to
+        # be sent together. None never batches
+        self.relay_batch_window = relay_batch_window
+
+        # Where channels keep their history on disk. None keeps history in
+        # memory only
+        self.log_directory = log_directory
+
+        # Outbound buffer limits for every connection
+        self.high_water_mark = high_water_mark
+        self.slow_consumer_policy = slow_consumer_policy
+
         self.created_timestamp = time.time()
-        self.conns = []
+
+        # Maps each connection to its ServerConnectionInfo. Should only be
+        # mutated through add_connection and remove_connection so the
+        # selector stays in sync
+        self.conns = {}
+        self.selector = selectors.DefaultSelector()
+
+        # ServerConnectionInfos whose outbound buffer has started queueing or
+        # has overflowed. Thread-safe so other threads can send too
+        self.write_events = deque()
+
+        # (ServerConnectionInfo, threading.Event) for connections to other
+        # servers made on other threads, waiting for the server loop to
+        # start tracking them. Thread-safe
+        self.server_handovers = deque()
+
+        # ServerConnectionInfos whose outbound buffer is holding a batch of
+        # relays until its batch window ends
+        self.held_writes = []
+
+        # Expiry for anything short-lived (e.g. seen relay messages). Swept
+        # by the server loop instead of starting a thread per timer
+        self.timers = TimerWheel()
+
         self.channels = AliasDictionary()
 
+        # Every channel link by (channel name, hostname, port), and the keys
+        # of the links over each connection. Kept up to date by Channel
+        self.links = {}
+        self.connection_links = {}
+
         # To help remove users from previous channels when they join a new one
         self.conn_channel_map = {}
 
         self.nick_conn_map = {}
         self.conn_nick_map = {}
 
+        # WorkerGroup when running as one of several worker processes (see
+        # workers.py), otherwise None
+        self.workers = None
+
+        # Coroutine function (hostname, port) -> connection to another
+        # server when running the asyncio server, otherwise None
+        self.connector = None
+
+        # Connections to other servers, shared by every link to them
+        self.peers = PeerPool(self)
+
+        # MOTD, HELP and RULES files, read once and reloaded when changed
+        self.config = ConfigCache(os.path.join(os.getcwd(), CONFIG_FOLDER))
+
+        # Metrics registry once enable_metrics is called, otherwise None so
+        # nothing is measured
+        self.metrics = None
+
+        # Authenticator once enable_authentication is called, otherwise None
+        # so connections don't have to sign in
+        self.authenticator = None
+
+        # asyncio.Event set by quit when running the asyncio server, which
+        # waits on it, otherwise None
+        self.quit_event = None
+
         self.quitted = False
 
+    def quit(self) -> None:
+        """
+        Tells the server loop to stop
+        """
+        self.quitted = True
+
+        if self.quit_event is not None:
+            self.quit_event.set()
+
+    def enable_metrics(self) -> "Metrics":
+        """
+        Starts collecting metrics (see metrics.py)
+
+        Returns the registry
+        """
+        # Imported here so servers without metrics start faster
+        # pylint: disable=import-outside-toplevel
+        from src.metrics import Metrics
+
+        metrics = Metrics()
+
+        metrics.gauge("connections", "Open connections",
+                      lambda: len(self.conns))
+        metrics.gauge("channels", "Channels", lambda: len(self.channels))
+        metrics.gauge(
+            "outbound_queued_bytes",
+            "Bytes queued for connections that can't keep up",
+            lambda: sum(
+                conn_info.outbound.pending
+                for conn_info in list(self.conns.values())
+                if conn_info.outbound is not None
+            )
+        )
+        metrics.gauge(
+            "write_events_queued",
+            "Connections waiting for the server loop to handle their "
+            "outbound buffer",
+            lambda: len(self.write_events)
+        )
+        metrics.gauge("timers_pending", "Scheduled timers",
+                      lambda: len(self.timers))
+        metrics.gauge(
+            "seen_messages",
+            "Relayed messages remembered to drop repeats, across channels",
+            lambda: sum(
+                len(channel.seen_messages)
+                for channel in list(self.channels.values())
+            )
+        )
+
+        for name, help_text in (
+            ("size", "Pooled connections to other servers"),
+            ("reuses", "Times a pooled connection was reused"),
+            ("connects", "Connections made to other servers"),
+            ("reconnects", "Connections remade after the last one closed"),
+            ("failures", "Failed attempts to connect to other servers")
+        ):
+            metrics.gauge(f"peer_pool_{name}", help_text,
+                          lambda name=name: self.peers.stats()[name])
+
+        if self.authenticator is not None:
+            self.add_authentication_gauges(metrics)
+
+        self.metrics = metrics
+        set_send_observer(metrics.sent)
+
+        return metrics
+
+    def enable_authentication(self) -> "Authenticator":
+        """
+        Makes new client connections sign a challenge with their key before
+        anything else they send is handled (see authenticator.py)
+
+        Returns the authenticator
+        """
+        # Imported here so servers without --auth start faster
+        # pylint: disable=import-outside-toplevel
+        from src.authenticator import Authenticator
+
+        self.authenticator = Authenticator()
+
+        if self.metrics is not None:
+            self.add_authentication_gauges(self.metrics)
+
+        return self.authenticator
+
+    def add_authentication_gauges(self, metrics: "Metrics") -> None:
+        """
+        Measures how sign-ins are going
+        """
+        for name, help_text in (
+            ("verified", "Connections that signed in"),
+            ("rejected", "Connections that failed to sign in"),
+            ("key_cache_hits", "Sign-ins with an already imported key"),
+            ("key_cache_misses", "Sign-ins that had to import their key"),
+            ("challenge_pool", "Challenges generated ahead of time"),
+            ("challenge_pool_misses",
+             "Challenges generated on the spot as the pool ran dry")
+        ):
+            metrics.gauge(
+                f"auth_{name}", help_text,
+                lambda name=name: self.authenticator.stats()[name]
+            )
+
+    def resolve_channel(self, key: str | int) -> "Channel | None":
+        """
+        Returns the channel with a name or id, or None if there isn't one
+        """
+        return self.channels.get(key)
+
+    def resolve_link(self, channel_name: str, hostname: str,
+                     port: int) -> "ChannelLinkInfo | None":
+        """
+        Returns the link between a channel and the channel of the same name
+        on another server, or None if they aren't linked
+        """
+        return self.links.get((channel_name, hostname, port))
+
+    def index_link(self, link_info: "ChannelLinkInfo") -> None:
+        """
+        Adds a link to the indexes, replacing any link with the same key
+        """
+        key = link_info.key()
+
+        self.unindex_link(key)
+
+        self.links[key] = link_info
+        self.connection_links.setdefault(link_info.connection, set()).add(key)
+
+    def unindex_link(self, key: tuple[str, str, int]) -> None:
+        """
+        Removes a link from the indexes, if it is in them
+        """
+        link_info = self.links.pop(key, None)
+
+        if link_info is None:
+            return
+
+        keys = self.connection_links.get(link_info.connection)
+
+        if keys is not None:
+            keys.discard(key)
+
+            if not keys:
+                del self.connection_links[link_info.connection]
+
+    def link_capabilities(self) -> tuple[str, ...]:
+        """
+        Returns what this server advertises when linking channels
+        """
+        if self.relay_batch_window is None:
+            return ()
+
+        return (RELAY_BATCH_CAPABILITY,)
+
+    def batches_with(self, capabilities: list[str]) -> bool:
+        """
+        Returns whether to batch relays on a link, given what the server on
+        the other end advertised
+        """
+        return (self.relay_batch_window is not None and
+                RELAY_BATCH_CAPABILITY in capabilities)
+
+    def owns_channel(self, channel_name: str) -> bool:
+        """
+        Returns whether this server owns a channel. Always true unless it is
+        one of several workers, which each own a share of the channels
+        """
+        return self.workers is None or self.workers.owns(channel_name)
+
+    def is_worker_connection(self, connection: socket.socket) -> bool:
+        """
+        Returns whether a connection is to another worker of this server
+        """
+        return self.workers is not None and self.workers.is_peer(connection)
+
+    def add_connection(self, conn_info: "ServerConnectionInfo") -> None:
+        """
+        Starts tracking a connection and registers it with the selector so
+        the server loop gets woken up when it has data
+
+        Everything sent to the connection from then on is queued in its
+        outbound buffer instead of blocking the sender
+
+        Should only be called from the server loop, so other threads hand
+        connections over with add_server_connection instead
+        """
+        conn_info.connection.setblocking(False)
+
+        conn_info.outbound = OutboundBuffer(
+            conn_info.connection,
+            high_water_mark=self.high_water_mark,
+            policy=self.slow_consumer_policy,
+            on_pending=lambda _: self.write_events.append(conn_info),
+            batch_window=self.relay_batch_window or 0.0
+        )
+
+        register_outbound(conn_info.outbound)
+
+        self.conns[conn_info.connection] = conn_info
+        self.selector.register(
+            conn_info.connection, selectors.EVENT_READ, conn_info
+        )
+
+    def add_server_connection(self, connection: socket.socket,
+                              address: tuple[str, int]) -> bool:
+        """
+        Hands a connection this server made to another server on another
+        thread over to the server loop, which starts tracking it. Waits for
+        it to be tracked, so whatever is sent to it next is queued in its
+        outbound buffer
+
+        Returns False if the server loop didn't take it within
+        HANDOVER_TIMEOUT seconds, e.g. because it is stopping
+        """
+        taken = threading.Event()
+
+        self.server_handovers.append((
+            ServerConnectionInfo(connection, is_server=True, address=address),
+            taken
+        ))
+
+        return taken.wait(HANDOVER_TIMEOUT)
+
+    def take_server_connections(self) -> None:
+        """
+        Starts tracking the connections handed over by
+        add_server_connection. Should only be called from the server loop
+        """
+        while self.server_handovers:
+            conn_info, taken = self.server_handovers.popleft()
+
+            self.add_connection(conn_info)
+            taken.set()
+
+    def drop_links(self, connection) -> list["ChannelLinkInfo"]:
+        """
+        Unlinks every channel linked over a connection, e.g. once it has
+        closed
+
+        Returns the links that were dropped
+        """
+        dropped = []
+
+        for key in list(self.connection_links.get(connection, ())):
+            link_info = self.links[key]
+            channel = self.resolve_channel(link_info.channel_name)
+
+            if channel is not None:
+                channel.unlink_channel(*key)
+            else:
+                self.unindex_link(key)
+
+            dropped.append(link_info)
+
+        return dropped
+
+    def remove_connection(self, conn_info: "ServerConnectionInfo") -> None:
+        """
+        Stops tracking a connection. Does not close it
+        """
+        self.conns.pop(conn_info.connection, None)
+        unregister_outbound(conn_info.connection)
+
+        try:
+            self.selector.unregister(conn_info.connection)
+        except (KeyError, ValueError):  # Already unregistered or closed
+            pass
+
 
 class ServerConnectionInfo:
     """
     Information wrapper for connections on server-side
     """
     def __init__(self, connection: socket.socket,
-                 is_server: bool = False) -> None:
+                 is_server: bool = False, address: tuple = None,
+                 is_worker: bool = False) -> None:
         self.connection = connection
         self.is_server = is_server
+        self.address = address
+
+        # Made to or accepted on a worker's internal listener, so the only
+        # connections worker messages are taken from
+        self.is_worker = is_worker
+
+        self.reader = MessageReader()
+        self.outbound = None  # Set once added to ServerMembers
+
+        # On servers started with --auth, client connections aren't
+        # authenticated until they sign their challenge, and then only
+        # speak as the nickname they signed in with
+        self.authenticated = True
+        self.challenge = None
+        self.nickname = None
+        self.held_messages = []
 
 
 class ClientStates:
@@ -74,7 +456,7 @@ class ClientConnectionWrapper:
     information related
     """
     def __init__(self, connection: socket.socket | None,
-                 messages_to_store: int = 50) -> None:
+                 messages_to_store: int = CLIENT_MESSAGES_TO_STORE) -> None:
 
         self.connection = connection
         self.last_whisperer = None
@@ -83,14 +465,26 @@ class ClientConnectionWrapper:
         self.confirmed_channel_name = None
         self.pending_channel_name = None
 
+        # The client's ClientReceiver once it is receiving from the
+        # connection, along with the parser for what it receives
         self.listener = None
+        self.reader = MessageReader()
+
         self.sender = None
 
-        self.input_queue = []
+        # User input waiting to be sent. The sender sleeps until there is
+        # some, and is woken to stop when the wrapper is closed
+        self.input_queue = BlockingQueue()
         self.states = ClientStates()
 
         self.messages_to_store = messages_to_store
-        self.messages = []
+        self.messages = RingBuffer(messages_to_store)
+        # Imported here as only clients draw a scrollback, and it is slow
+        # to import
+        # pylint: disable=import-outside-toplevel
+        from src.scrollback import Scrollback
+
+        self.scrollback = Scrollback(self.messages)
 
         # This is the only attribute that should never be accessed directly
         # because it should only be set to false when .close() is called
@@ -104,10 +498,10 @@ class ClientConnectionWrapper:
 
     def close_listener(self) -> None:
         """
-        Should not be called by the listener thread
+        Stops receiving from the connection
         """
         self.states.listening = False
-        self.listener.join()
+        self.listener.unregister(self)
         self.listener = None
 
     def close_sender(self) -> None:
@@ -129,6 +523,8 @@ class ClientConnectionWrapper:
         self._closed = True
         self.states.active = False
 
+        self.input_queue.close()
+
         if self.listener is not None:
             self.close_listener()
 
@@ -145,10 +541,7 @@ class ClientConnectionWrapper:
 
         Does so intelligently to abide the max number of messages to store
         """
-        self.messages.insert(0, message_obj)
-
-        if len(self.messages) > self.messages_to_store:
-            self.messages = self.messages[:self.messages_to_store]
+        self.scrollback.append(message_obj)
 
 
 class ChannelLinkInfo:
@@ -156,9 +549,19 @@ class ChannelLinkInfo:
     Stores information for a channel link
     """
     def __init__(self, channel_name: str, hostname: str, port: int,
-                 connection: socket.socket, channel_id: int) -> None:
+                 connection: socket.socket, channel_id: int,
+                 batched: bool = False) -> None:
         self.channel_name = channel_name
         self.hostname = hostname
         self.port = port
         self.connection = connection
         self.channel_id = channel_id
+
+        # Whether relays on the link are batched (see OutboundBuffer)
+        self.batched = batched
+
+    def key(self) -> tuple[str, str, int]:
+        """
+        Identifies the link among every link on the server
+        """
+        return (self.channel_name, self.hostname, self.port)
@@ -0,0 +1,131 @@
+"""
+Cache of the server's config files (MOTD, HELP and RULES) so sending one
+doesn't touch the filesystem. Files are polled for changes and reloaded when
+they are edited
+"""
+
+# False-positive import error
+# pylint: disable=import-error
+
+import os
+import time
+from src.message import Message
+from src.constants import SERVER_CHANNEL_ID
+
+# Seconds between checks of whether a config file has changed
+CONFIG_POLL_INTERVAL = 1.0
+
+
+class ConfigFile:
+    """
+    One config file's text, and the server message carrying it already
+    encoded
+
+    The file is stat'ed at most once every poll_interval seconds, and only
+    read again when its modification time or size has changed. The encoded
+    message is reused until its timestamp is out of date, i.e. at most once a
+    second however many connections it is sent to
+    """
+
+    __slots__ = ("path", "missing_text", "poll_interval", "next_poll",
+                 "signature", "text", "encoding", "encoded_at")
+
+    def __init__(self, path: str, missing_text: str,
+                 poll_interval: float = CONFIG_POLL_INTERVAL) -> None:
+        """
+        :: path : str :: Path to the file
+        :: missing_text : str :: Sent instead while the file doesn't exist
+        :: poll_interval : float :: Seconds between checks for changes
+        """
+        self.path = path
+        self.missing_text = missing_text
+        self.poll_interval = poll_interval
+
+        self.next_poll = 0.0
+
+        # (modification time, size) when last read, None if it was missing
+        # or () if it hasn't been read yet
+        self.signature = ()
+
+        self.text = missing_text
+        self.encoding = None
+        self.encoded_at = None  # Timestamp the encoding carries
+
+    def poll(self) -> None:
+        """
+        Reloads the file if it has changed since it was last read, as long
+        as it hasn't been checked in the last poll_interval seconds
+        """
+        now = time.monotonic()
+
+        if now < self.next_poll:
+            return
+
+        self.next_poll = now + self.poll_interval
+
+        try:
+            stat = os.stat(self.path)
+        except OSError:  # Missing (or deleted since)
+            signature = None
+        else:
+            signature = (stat.st_mtime_ns, stat.st_size)
+
+        if signature == self.signature:
+            return
+
+        self.signature = signature
+
+        if signature is None:
+            self.text = self.missing_text
+        else:
+            try:
+                with open(self.path, "r", encoding="ascii") as file:
+                    self.text = file.read()
+            except OSError:  # Removed between stat and open
+                self.signature = None
+                self.text = self.missing_text
+
+        self.encoding = None
+
+    def get_encoding(self) -> bytes:
+        """
+        Returns the server message carrying the file's text, encoded
+        """
+        self.poll()
+
+        timestamp = int(time.time())
+
+        if self.encoding is None or self.encoded_at != timestamp:
+            self.encoding = Message(SERVER_CHANNEL_ID, "", timestamp, 0b01,
+                                    self.text).to_bytes()
+            self.encoded_at = timestamp
+
+        return self.encoding
+
+
+class ConfigCache:
+    """
+    The config files in a directory, by file name
+    """
+
+    def __init__(self, directory: str,
+                 poll_interval: float = CONFIG_POLL_INTERVAL) -> None:
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.files = {}
+
+    def get_encoding(self, file_name: str, missing_text: str) -> bytes:
+        """
+        Returns the encoded server message carrying a config file's text,
+        or missing_text if the file doesn't exist
+        """
+        config_file = self.files.get(file_name)
+
+        if config_file is None:
+            config_file = ConfigFile(
+                os.path.join(self.directory, file_name), missing_text,
+                self.poll_interval
+            )
+            self.files[file_name] = config_file
+
+        return config_file.get_encoding()
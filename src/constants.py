@@ -14,7 +14,59 @@ LINK_RESPONSE_FLAG = "--response"
 
 UNLINK_FLAG = "--unlink"
 
+# Advertised after a link request or response by servers that batch relays.
+# Relays on a link are only batched when both ends advertise it
+RELAY_BATCH_CAPABILITY = "batch"
+
+# Bytes of relays held back for a batch before they are sent regardless of
+# the batch window
+RELAY_BATCH_BYTES = 64 * 1024
+
+# Seconds between checks that pooled connections to other servers are still
+# healthy (see peer_pool.py)
+PEER_CHECK_INTERVAL = 5
+
+# Seconds waited before each attempt to reconnect to a server whose links
+# were lost with its connection. Gives up after the last one
+PEER_RECONNECT_DELAYS = (0.5, 1, 2, 4, 8)
+
 MIGRATE_FLAG = "--migrate"
 
+# Challenge-response sign in for servers started with --auth (see
+# authenticator.py)
+CHALLENGE_FLAG = "--challenge"
+AUTH_FLAG = "--auth"
+
+# Seconds a connection has to sign its challenge before it is closed
+AUTH_TIMEOUT = 30
+
+# Messages sent before signing in that are held to be handled once signed
+# in. Any more are refused
+AUTH_HELD_MESSAGES = 16
+
+# Between workers of the same server (see workers.py)
+WORKER_FLAG = "--worker"
+REPLICATE_FLAG = "--replicate"
+SYNC_FLAG = "--sync"
+DESTROY_FLAG = "--destroy"
+
+# What to do with a connection whose outbound buffer is over the high-water
+# mark because it isn't reading fast enough
+SLOW_CONSUMER_DROP = "drop"  # Drop new messages until it catches up
+SLOW_CONSUMER_DISCONNECT = "disconnect"  # Close the connection
+SLOW_CONSUMER_COALESCE = "coalesce"  # Drop the oldest unsent messages
+SLOW_CONSUMER_POLICIES = (
+    SLOW_CONSUMER_DROP,
+    SLOW_CONSUMER_DISCONNECT,
+    SLOW_CONSUMER_COALESCE
+)
+
+DEFAULT_SLOW_CONSUMER_POLICY = SLOW_CONSUMER_DISCONNECT
+DEFAULT_HIGH_WATER_MARK = 1024 * 1024  # Bytes
+
+# Messages a client keeps for each connection to page back through (see
+# scrollback.py)
+CLIENT_MESSAGES_TO_STORE = 100_000
+
 # Unit separator. Safe way to separate data in formatted strings
 SEP = chr(31)
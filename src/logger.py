@@ -0,0 +1,217 @@
+"""
+Logging for the server. Records are handed to a queue on the calling thread
+and written out by a background thread, so the server loop never waits on
+stdout or a log file
+
+Per-connection messages pass a "conn" extra, which rate limits them per
+connection (see RateLimitFilter) and shows up as a field in JSON logs
+"""
+
+# False-positive import error
+# pylint: disable=import-error
+
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+from src import utilities
+
+LOG_LEVELS = ("debug", "info", "warning", "error")
+LOG_FORMATS = ("text", "json")
+
+DEFAULT_LOG_LEVEL = "info"
+DEFAULT_LOG_FORMAT = "text"
+
+# Per-connection messages allowed per period before the rest are suppressed
+RATE_LIMIT_MESSAGES = 10
+RATE_LIMIT_PERIOD = 1.0
+
+# Connections tracked before windows that have ended are cleared out
+RATE_LIMIT_MAX_KEYS = 10_000
+
+LOGGING_USAGE = (
+    f"[--log-level=<{'|'.join(LOG_LEVELS)}>] [--log-file=<path>] "
+    f"[--log-format=<{'|'.join(LOG_FORMATS)}>]"
+)
+
+TEXT_FORMAT = "%(asctime)s %(levelname)-7s %(message)s"
+
+# Attributes every LogRecord has, so anything else was passed as an extra
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message"}
+
+logger = logging.getLogger("dechat")
+
+# The running listener and its queue handler, once setup_logging is called
+listener = None
+queue_handler = None
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most max_messages records per period for each
+    connection. The first record after a connection was limited says how
+    many were suppressed. Records without a "conn" extra are never limited
+    """
+
+    def __init__(self, max_messages: int = RATE_LIMIT_MESSAGES,
+                 period: float = RATE_LIMIT_PERIOD) -> None:
+        super().__init__()
+
+        self.max_messages = max_messages
+        self.period = period
+
+        # Connection -> [window start, records in window, suppressed]
+        self.windows = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        conn = getattr(record, "conn", None)
+
+        if conn is None:
+            return True
+
+        now = time.monotonic()
+        window = self.windows.get(conn)
+
+        if window is None or now - window[0] >= self.period:
+            if len(self.windows) >= RATE_LIMIT_MAX_KEYS:
+                self.clear_ended_windows(now)
+
+            suppressed = window[2] if window is not None else 0
+            window = self.windows[conn] = [now, 0, 0]
+
+            if suppressed:
+                record.msg = (f"{record.msg} ({suppressed} similar "
+                              "messages suppressed)")
+
+        if window[1] >= self.max_messages:
+            window[2] += 1
+            return False
+
+        window[1] += 1
+        return True
+
+    def clear_ended_windows(self, now: float) -> None:
+        """
+        Forgets connections whose window has ended
+        """
+        self.windows = {
+            conn: window for conn, window in self.windows.items()
+            if now - window[0] < self.period
+        }
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats each record as one JSON object per line, with any extras as
+    fields of their own
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": record.created,
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                if not isinstance(value, (int, float, str)):
+                    value = str(value)
+
+                entry[key] = value
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry)
+
+
+def setup_logging(level: str = DEFAULT_LOG_LEVEL, log_file: str = None,
+                  log_format: str = DEFAULT_LOG_FORMAT) -> None:
+    """
+    Sends the server's logs through a queue to a background thread that
+    writes them to stdout, or to log_file if given
+    :: level : str :: Lowest level logged, one of LOG_LEVELS
+    :: log_file : str :: File to append logs to instead of stdout
+    :: log_format : str :: One of LOG_FORMATS
+    """
+    global listener, queue_handler  # pylint: disable=global-statement
+
+    stop_logging()
+
+    if log_file is not None:
+        output = logging.FileHandler(log_file, encoding="utf-8")
+    else:
+        output = logging.StreamHandler(sys.stdout)
+
+    if log_format == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    queue_handler = QueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(RateLimitFilter())
+
+    logger.handlers = [queue_handler]
+    logger.setLevel(level.upper())
+    logger.propagate = False
+
+    listener = QueueListener(queue_handler.queue, output)
+    listener.start()
+
+
+def setup_logging_from_arguments(argv: list[str]) -> bool:
+    """
+    Sets up logging from --log-level, --log-file and --log-format arguments
+
+    Returns False without setting anything up if any of them are invalid
+    """
+    level = utilities.get_flag_value(argv, "--log-level", DEFAULT_LOG_LEVEL)
+    log_file = utilities.get_flag_value(argv, "--log-file")
+    log_format = utilities.get_flag_value(argv, "--log-format",
+                                          DEFAULT_LOG_FORMAT)
+
+    if level not in LOG_LEVELS or log_format not in LOG_FORMATS:
+        return False
+
+    setup_logging(level, log_file, log_format)
+
+    return True
+
+
+def stop_logging() -> None:
+    """
+    Writes out everything still queued and stops the background thread
+    """
+    global listener  # pylint: disable=global-statement
+
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+def restart_after_fork() -> None:
+    """
+    Gives a forked child (e.g. a worker) its own queue and background
+    thread, since threads don't survive a fork
+    """
+    global listener  # pylint: disable=global-statement
+
+    if listener is None:
+        return
+
+    queue_handler.queue = queue.SimpleQueue()
+
+    listener = QueueListener(queue_handler.queue, *listener.handlers)
+    listener.start()
+
+
+atexit.register(stop_logging)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=restart_after_fork)
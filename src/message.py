@@ -5,15 +5,56 @@ Wrapper class for the message protocol. Intended to make life easier
 # False-positive import error
 # pylint: disable=import-error
 
+import functools
+import struct
 from src import utilities
 from src.constants import NICK_MSG_SEPARATOR, MAX_NICK_LENGTH
 
+# Channel ID, nickname, timestamp then message type and length, all little
+# endian. Precompiled so encoding and decoding the header is a single call
+HEADER_STRUCT = struct.Struct("<H32sIH")
+HEADER_SIZE = HEADER_STRUCT.size
+
+# The conjoined message type and length bytes on their own, found at the end
+# of the header
+TYPE_AND_LENGTH_STRUCT = struct.Struct("<H")
+TYPE_AND_LENGTH_OFFSET = HEADER_SIZE - TYPE_AND_LENGTH_STRUCT.size
+
+# Width nicknames are right-aligned to when displayed, and the indent of
+# every line of a multi-line message after the first
+NICK_DISPLAY_WIDTH = MAX_NICK_LENGTH * 2 + 2
+CONTINUATION_INDENT = " " * (NICK_DISPLAY_WIDTH + 10)
+
+# Distinct nicknames remembered already padded for display
+PADDED_NICKNAME_CACHE_SIZE = 1024
+
+
+@functools.lru_cache(maxsize=PADDED_NICKNAME_CACHE_SIZE)
+def pad_nickname(nickname: str) -> str:
+    """
+    Right-aligns a nickname for display. Cached, as the same few nicknames
+    are displayed over and over
+    """
+    return nickname.rjust(NICK_DISPLAY_WIDTH)
+
 
 class Message:
     """
     Wrapper class to make encoding and decoding bytes easier
     """
 
+    # Messages are created for every frame on the server so they shouldn't
+    # carry a __dict__ around each
+    __slots__ = (
+        "channel_id",
+        "nickname",
+        "timestamp",
+        "message_type",
+        "message_length",
+        "message",
+        "rendered"  # What format returned, until the message is changed
+    )
+
     @staticmethod
     def from_bytes(message_bytes: bytes) -> "Message":
         """
@@ -25,24 +66,70 @@ class Message:
 
         Returns None if passed in bytes is invalid
         """
-        if len(message_bytes) < 40:
+        if len(message_bytes) < HEADER_SIZE:
             return None
 
-        channel_id = int.from_bytes(message_bytes[:2], "little")
-        nickname = message_bytes[2:34].decode("ascii").strip("\x00")
-        timestamp = int.from_bytes(message_bytes[34:38], "little")
+        return Message.from_buffer(message_bytes)
 
-        message_type, message_length = Message.decode_type_and_length(
-            message_bytes[38:40]
+    @staticmethod
+    def from_buffer(buffer: bytes | bytearray | memoryview,
+                    offset: int = 0) -> "Message":
+        """
+        Decodes the message starting at offset in a buffer without copying
+        the buffer. The buffer must hold at least a full header from offset
+        """
+        channel_id, nickname, timestamp, type_and_length = (
+            HEADER_STRUCT.unpack_from(buffer, offset)
         )
 
-        message = message_bytes[40:40 + message_length].decode("ascii")
-
-        message_obj = Message(channel_id, nickname, timestamp,
-                              message_type, message)
+        message_length = type_and_length >> 2
+        start = offset + HEADER_SIZE
+
+        # Every field read from the wire is already valid, so the setters'
+        # checks are skipped
+        message_obj = Message.__new__(Message)
+        message_obj.channel_id = channel_id
+        message_obj.nickname = nickname.strip(b"\x00").decode("ascii")
+        message_obj.timestamp = timestamp
+        message_obj.message_type = type_and_length & 0b11
+        message_obj.message = str(
+            buffer[start:start + message_length], "ascii"
+        )
+        message_obj.message_length = len(message_obj.message)
+        message_obj.rendered = None
 
         return message_obj
 
+    @staticmethod
+    def frame_length(buffer: bytes | bytearray | memoryview,
+                     offset: int = 0) -> int:
+        """
+        Returns the total length in bytes of the message starting at offset
+        in a buffer. The buffer must hold at least a full header from offset
+        """
+        type_and_length = TYPE_AND_LENGTH_STRUCT.unpack_from(
+            buffer, offset + TYPE_AND_LENGTH_OFFSET
+        )[0]
+
+        return HEADER_SIZE + (type_and_length >> 2)
+
+    @staticmethod
+    def retyped(encoding: bytes, message_type: int) -> bytes:
+        """
+        Returns an encoded message with its type changed, without decoding
+        it and encoding it again
+        """
+        type_and_length = TYPE_AND_LENGTH_STRUCT.unpack_from(
+            encoding, TYPE_AND_LENGTH_OFFSET
+        )[0]
+
+        return b"".join((
+            encoding[:TYPE_AND_LENGTH_OFFSET],
+            Message.encode_type_and_length(message_type,
+                                           type_and_length >> 2),
+            encoding[HEADER_SIZE:]
+        ))
+
     @staticmethod
     def encode_type_and_length(message_type: int,
                                message_length: int) -> bytes:
@@ -50,6 +137,16 @@ class Message:
         Encodes type and length into 2 bytes, 2 and 14 bits each respectively
         """
 
+        return TYPE_AND_LENGTH_STRUCT.pack(
+            Message.pack_type_and_length(message_type, message_length)
+        )
+
+    @staticmethod
+    def pack_type_and_length(message_type: int, message_length: int) -> int:
+        """
+        Packs type and length into the 16 bit integer that gets encoded
+        """
+
         if not 0 <= message_type <= 0b11:
             raise ValueError("Message type must be a 2 bit integer")
 
@@ -58,7 +155,7 @@ class Message:
         type_bits = 0b11 & message_type
         length_bits = ((0xffff >> 2) & message_length) << 2
 
-        return (type_bits | length_bits).to_bytes(2, "little")
+        return type_bits | length_bits
 
     @staticmethod
     def decode_type_and_length(encoded_bytes: bytes) -> tuple[int, int]:
@@ -83,6 +180,7 @@ class Message:
         self.message_type = None
         self.message_length = None
         self.message = None
+        self.rendered = None
 
         # To avoid super long lines of code
         args = (channel_id, nickname, timestamp, message_type, message)
@@ -96,19 +194,17 @@ class Message:
         itself to bytes that fit the message protocol
         """
 
-        type_and_length_bytes = Message.encode_type_and_length(
-            self.message_type, self.message_length
+        header = HEADER_STRUCT.pack(
+            self.channel_id,
+            # Nicknames are padded on the left
+            self.nickname.encode("ascii").rjust(32, b"\x00"),
+            self.timestamp,
+            Message.pack_type_and_length(
+                self.message_type, self.message_length
+            )
         )
 
-        encoding = b""
-
-        encoding += self.channel_id.to_bytes(2, "little")
-        encoding += self.nickname.rjust(32, "\x00").encode("ascii")
-        encoding += self.timestamp.to_bytes(4, "little")
-        encoding += type_and_length_bytes
-        encoding += self.message.encode("ascii")
-
-        return encoding
+        return header + self.message.encode("ascii")
 
     def __bytes__(self) -> bytes:
         return self.to_bytes()
@@ -124,6 +220,7 @@ class Message:
         Setter for nickname
         """
         self.nickname = nickname
+        self.rendered = None
 
     def set_timestamp(self, timestamp: float) -> None:
         """
@@ -133,6 +230,7 @@ class Message:
             timestamp = int(timestamp)
 
         self.timestamp = timestamp
+        self.rendered = None
 
     def set_message_type(self, message_type: int) -> None:
         """
@@ -142,6 +240,7 @@ class Message:
             raise ValueError("Message type must be a 2 bit integer")
 
         self.message_type = message_type
+        self.rendered = None
 
     def set_message(self, message: str) -> None:
         """
@@ -149,6 +248,7 @@ class Message:
         """
         self.message = message
         self.message_length = len(message)
+        self.rendered = None
 
     def set_all(self, channel_id: int, nickname: str, timestamp: float,
                 message_type: int, message: str) -> None:
@@ -165,8 +265,14 @@ class Message:
     def format(self) -> str:
         """
         Formats the Message object itself into the client display format
+
+        Only formatted the first time, then reused until the message is
+        changed through one of its setters
         """
 
+        if self.rendered is not None:
+            return self.rendered
+
         time_string = utilities.unix_to_str(self.timestamp)
 
         message_separator = NICK_MSG_SEPARATOR
@@ -175,24 +281,20 @@ class Message:
             message_separator = ":"
 
         if self.message_type == 0b01:
-            nickname = "*"
+            nickname = pad_nickname("*")
         else:
-            nickname = self.nickname
-
-        nickname = nickname.rjust(MAX_NICK_LENGTH * 2 + 2)
+            nickname = pad_nickname(self.nickname)
 
-        lines = self.message.split("\n")
+        echo = self.message
 
-        echo = lines[0]
+        if "\n" in echo:
+            echo = f"\n{CONTINUATION_INDENT}{message_separator} ".join(
+                echo.split("\n")
+            )
 
-        for i, line in enumerate(lines):
-            if i != 0:
-                echo += "\n"
-                echo += " " * ((MAX_NICK_LENGTH * 2 + 2) + 10)
-                echo += message_separator
-                echo += f" {line}"
+        self.rendered = f"{time_string}{nickname}{message_separator} {echo}"
 
-        return f"{time_string}{nickname}{message_separator} {echo}"
+        return self.rendered
 
     def copy(self) -> "Message":
         """
@@ -0,0 +1,395 @@
+"""
+Counters, gauges and latency histograms describing what the server is doing,
+shown by /stats and optionally served over HTTP for scraping
+
+Metrics are only collected when the server is started with --metrics (or
+--metrics-port). Otherwise ServerMembers.metrics is None and the hot paths
+skip them after a single check
+"""
+
+# False-positive import error
+# pylint: disable=import-error
+
+import bisect
+import threading
+import time
+
+# Histogram bucket upper bounds in seconds, doubling from 1 microsecond to
+# about 8 seconds
+HISTOGRAM_BOUNDS = [1e-6 * 2 ** i for i in range(24)]
+
+# Path the scrape endpoint serves metrics on
+METRICS_PATH = "/metrics"
+
+
+class Counter:
+    """
+    A value that only goes up
+    """
+
+    __slots__ = ("value",)
+
+    kind = "counter"
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        """
+        Adds amount to the counter
+        """
+        self.value += amount
+
+
+class Gauge:
+    """
+    A value that is read when the metrics are, e.g. the length of a queue,
+    so keeping it up to date costs nothing
+    """
+
+    __slots__ = ("read",)
+
+    kind = "gauge"
+
+    def __init__(self, read: callable) -> None:
+        self.read = read
+
+    @property
+    def value(self) -> float:
+        """
+        The gauge's current value
+        """
+        return self.read()
+
+
+class Histogram:
+    """
+    Counts observations (in seconds) in exponentially sized buckets, which
+    is enough to estimate percentiles to within a factor of two
+    """
+
+    __slots__ = ("counts", "count", "total")
+
+    kind = "histogram"
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        """
+        Records one observation
+        """
+        self.counts[bisect.bisect_left(HISTOGRAM_BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Returns the upper bound of the bucket the given fraction of
+        observations fall under
+        """
+        target = fraction * self.count
+        seen = 0
+
+        for i, count in enumerate(self.counts):
+            seen += count
+
+            if seen >= target and seen > 0:
+                if i == len(HISTOGRAM_BOUNDS):
+                    return float("inf")
+                return HISTOGRAM_BOUNDS[i]
+
+        return 0.0
+
+    @property
+    def value(self) -> float:
+        """
+        Mean observation
+        """
+        return self.total / self.count if self.count else 0.0
+
+
+class Metrics:
+    """
+    Registry of every metric, keyed by name and labels
+    """
+
+    def __init__(self) -> None:
+        self.created_timestamp = time.time()
+
+        # (name, labels) -> metric, and name -> help text
+        self.metrics = {}
+        self.help = {}
+
+        self.frames_in = self.counter(
+            "frames_in_total", "Messages received"
+        )
+        self.bytes_in = self.counter(
+            "bytes_in_total", "Bytes received"
+        )
+        self.frames_out = self.counter(
+            "frames_out_total",
+            "Writes queued to connections (one message, or a batch of them "
+            "such as channel history)"
+        )
+        self.bytes_out = self.counter(
+            "bytes_out_total", "Bytes queued to connections"
+        )
+        self.read_seconds = self.histogram(
+            "read_decode_seconds",
+            "Time to read from a connection and decode what arrived"
+        )
+        self.broadcast_seconds = self.histogram(
+            "broadcast_seconds",
+            "Time to fan a channel message out to its members and links"
+        )
+        self.fanout = self.counter(
+            "broadcast_recipients_total",
+            "Connections and links channel messages were sent to"
+        )
+        self.encodes_saved = self.counter(
+            "broadcast_encodes_saved_total",
+            "Encodes avoided by encoding each channel message once for "
+            "every member and link"
+        )
+
+    def counter(self, name: str, help_text: str = "", **labels) -> Counter:
+        """
+        Returns the counter with the given name and labels, creating it if
+        it doesn't exist yet
+        """
+        return self.get_or_create(name, help_text, labels, Counter)
+
+    def gauge(self, name: str, help_text: str, read: callable,
+              **labels) -> Gauge:
+        """
+        Registers a gauge that calls read() for its value
+        """
+        return self.get_or_create(name, help_text, labels,
+                                  lambda: Gauge(read))
+
+    def histogram(self, name: str, help_text: str = "",
+                  **labels) -> Histogram:
+        """
+        Returns the histogram with the given name and labels, creating it if
+        it doesn't exist yet
+        """
+        return self.get_or_create(name, help_text, labels, Histogram)
+
+    def get_or_create(self, name: str, help_text: str, labels: dict,
+                      factory: callable):
+        """
+        Returns a registered metric, creating it if it doesn't exist yet
+        """
+        key = (name, tuple(sorted(labels.items())))
+
+        metric = self.metrics.get(key)
+
+        if metric is None:
+            metric = factory()
+            self.metrics[key] = metric
+            self.help.setdefault(name, help_text)
+
+        return metric
+
+    def read(self, reader: "MessageReader",
+             connection: "socket.socket") -> list | None:
+        """
+        reader.recv(connection), counting and timing what was read
+        """
+        start = time.perf_counter()
+
+        messages = reader.recv(connection)
+
+        self.read_seconds.observe(time.perf_counter() - start)
+
+        if messages is not None:
+            self.frames_in.inc(len(messages))
+            self.bytes_in.inc(reader.last_read)
+
+        return messages
+
+    def feed(self, reader: "MessageReader", data: bytes) -> list:
+        """
+        reader.feed(data), counting and timing what was decoded
+        """
+        start = time.perf_counter()
+
+        messages = reader.feed(data)
+
+        self.read_seconds.observe(time.perf_counter() - start)
+
+        self.frames_in.inc(len(messages))
+        self.bytes_in.inc(len(data))
+
+        return messages
+
+    def sent(self, num_bytes: int) -> None:
+        """
+        Counts one write to a connection
+        """
+        self.frames_out.value += 1
+        self.bytes_out.value += num_bytes
+
+    def broadcast(self, channel_name: str, recipients: int, seconds: float,
+                  encodes_saved: int = 0) -> None:
+        """
+        Records one channel message being fanned out
+        """
+        self.broadcast_seconds.observe(seconds)
+        self.fanout.inc(recipients)
+        self.encodes_saved.inc(encodes_saved)
+
+        self.counter(
+            "channel_messages_total", "Messages broadcast in each channel",
+            channel=channel_name
+        ).inc()
+
+    def forget_channel(self, channel_name: str) -> None:
+        """
+        Drops a destroyed channel's message counter, so channels coming and
+        going don't grow the registry forever
+        """
+        self.metrics.pop(
+            ("channel_messages_total", (("channel", channel_name),)), None
+        )
+
+    def channel_rates(self) -> dict[str, float]:
+        """
+        Returns each channel's average messages per second since the
+        metrics started
+        """
+        uptime = max(time.time() - self.created_timestamp, 1e-9)
+
+        return {
+            dict(labels)["channel"]: metric.value / uptime
+            for (name, labels), metric in list(self.metrics.items())
+            if name == "channel_messages_total"
+        }
+
+    def summary(self) -> str:
+        """
+        Human readable summary of every metric, for /stats
+        """
+        lines = []
+
+        for (name, labels), metric in sorted(list(self.metrics.items())):
+
+            if name == "channel_messages_total":
+                continue
+
+            label = name + format_labels(labels)
+
+            if isinstance(metric, Histogram):
+                lines.append(
+                    f"{label}: {metric.count} observed, mean "
+                    f"{metric.value * 1e6:.1f}us, p50 "
+                    f"{metric.percentile(0.5) * 1e6:.0f}us, p99 "
+                    f"{metric.percentile(0.99) * 1e6:.0f}us"
+                )
+            else:
+                lines.append(f"{label}: {metric.value:g}")
+
+        for channel_name, rate in sorted(self.channel_rates().items()):
+            lines.append(f"channel {channel_name}: {rate:.2f} messages/s")
+
+        return "\n".join(lines)
+
+    def render(self) -> str:
+        """
+        Every metric in the Prometheus text exposition format
+        """
+        lines = []
+        described = set()
+
+        for (name, labels), metric in sorted(list(self.metrics.items())):
+
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} {metric.kind}")
+
+            if not isinstance(metric, Histogram):
+                lines.append(f"{name}{format_labels(labels)} {metric.value}")
+                continue
+
+            cumulative = 0
+
+            for bound, count in zip(HISTOGRAM_BOUNDS + ["+Inf"],
+                                    metric.counts):
+                cumulative += count
+                bucket_labels = format_labels(labels + (("le", bound),))
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+
+            lines.append(f"{name}_sum{format_labels(labels)} {metric.total}")
+            lines.append(f"{name}_count{format_labels(labels)} {metric.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+def escape_label_value(value: str | float) -> str:
+    """
+    Escapes a label value as the exposition format requires, so a channel
+    name can't end the value early or start a new line
+    """
+    return (
+        str(value).replace("\\", "\\\\").replace('"', '\\"')
+        .replace("\n", "\\n")
+    )
+
+
+def format_labels(labels: tuple) -> str:
+    """
+    Formats labels as {key="value",...}, or nothing if there are none
+    """
+    if not labels:
+        return ""
+
+    return "{" + ",".join(
+        f'{key}="{escape_label_value(value)}"' for key, value in labels
+    ) + "}"
+
+
+def serve_metrics(metrics: Metrics, port: int,
+                  hostname: str = "localhost") -> "ThreadingHTTPServer":
+    """
+    Serves metrics over HTTP at METRICS_PATH from a background thread
+
+    Returns the HTTP server so it can be shut down
+    """
+    # Imported here as it is slow to import and most servers never serve
+    # metrics over HTTP
+    # pylint: disable=import-outside-toplevel
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        """
+        Answers scrapes
+        """
+
+        def do_GET(self) -> None:  # pylint: disable=invalid-name
+            """
+            Sends the metrics
+            """
+            if self.path != METRICS_PATH:
+                self.send_error(404)
+                return
+
+            body = metrics.render().encode()
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *_args) -> None:
+            pass
+
+    http_server = ThreadingHTTPServer((hostname, port), MetricsHandler)
+
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+
+    return http_server
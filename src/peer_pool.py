@@ -0,0 +1,276 @@
+"""
+Long-lived connections to other servers, shared by everything sent to them
+(link and unlink requests, relays and migrations) instead of connecting
+again for each one
+"""
+
+# False-positive import error
+# pylint: disable=import-error
+
+import socket
+import threading
+from src.protocol import conn_socket_setup
+
+
+class PeerPool:
+    """
+    One connection per other server, keyed by the (hostname, port) it
+    listens on. Connections are checked before being handed out, and a
+    dead one is replaced by connecting again
+
+    Connections this server made are dialled. Connections other servers
+    made to link with this one are adopted, so replies to them go over the
+    same connection instead of another one
+    """
+
+    def __init__(self, s_mems: "ServerMembers") -> None:
+        self.s_mems = s_mems
+
+        # (hostname, port) -> connection, and back
+        self.peers = {}
+        self.keys = {}
+
+        # Keys of connections made by this server rather than adopted
+        self.dialled = set()
+
+        # Held while connecting to a peer so only one connection is made
+        # however many threads (or coroutines, with a future instead of a
+        # lock) want it at once. Dropped once nothing is connecting
+        self.lock = threading.Lock()
+        self.connecting = {}
+
+        # Times a connection was reused, made, remade after the last one to
+        # the same peer closed, and couldn't be made
+        self.reuses = 0
+        self.connects = 0
+        self.reconnects = 0
+        self.failures = 0
+
+        # Peers a connection has been made to before, so the next one is
+        # counted as a reconnect
+        self.seen = set()
+
+    def __len__(self) -> int:
+        return len(self.peers)
+
+    def healthy(self, connection) -> bool:
+        """
+        Returns whether a pooled connection can still be sent to: it is
+        still open and tracked by the server, and its outbound buffer
+        hasn't broken or overflowed
+        """
+        conn_info = self.s_mems.conns.get(connection)
+
+        if conn_info is None or connection.fileno() == -1:
+            return False
+
+        outbound = conn_info.outbound
+
+        return outbound is None or not (outbound.broken or
+                                        outbound.overflowed)
+
+    def lookup(self, hostname: str, port: int):
+        """
+        Returns the healthy pooled connection to a peer, or None. Unhealthy
+        connections are dropped from the pool
+        """
+        with self.lock:
+            connection = self.peers.get((hostname, port))
+
+            if connection is None:
+                return None
+
+            if self.healthy(connection):
+                self.reuses += 1
+                return connection
+
+            self.forget(connection)
+            return None
+
+    def get(self, hostname: str, port: int) -> socket.socket | None:
+        """
+        Returns the connection to a peer, connecting if there isn't a
+        healthy one. Blocks while connecting so should be called from a
+        thread other than the server loop
+
+        Returns None if the peer can't be connected to
+        """
+        connection = self.lookup(hostname, port)
+
+        if connection is not None:
+            return connection
+
+        key = (hostname, port)
+
+        # [lock, number of threads using it], dropped by the last of them
+        with self.lock:
+            peer_lock = self.connecting.setdefault(key, [threading.Lock(), 0])
+            peer_lock[1] += 1
+
+        try:
+            with peer_lock[0]:
+                return self.connect(hostname, port)
+        finally:
+            with self.lock:
+                peer_lock[1] -= 1
+
+                if peer_lock[1] == 0:
+                    del self.connecting[key]
+
+    def connect(self, hostname: str, port: int) -> socket.socket | None:
+        """
+        get, with the peer's lock already held
+        """
+        # Another thread may have connected while this one waited
+        connection = self.lookup(hostname, port)
+
+        if connection is not None:
+            return connection
+
+        successful, connection = conn_socket_setup(hostname, port)
+
+        if successful:
+            keep_alive(connection)
+
+            # The server loop starts tracking the connection, as only it
+            # touches the selector
+            successful = self.s_mems.add_server_connection(connection,
+                                                           (hostname, port))
+
+        if not successful:
+            with self.lock:
+                self.failures += 1
+
+            return None
+
+        self.add(hostname, port, connection, dialled=True)
+
+        return connection
+
+    async def get_async(self, hostname: str, port: int):
+        """
+        get for the asyncio server, connecting with s_mems.connector
+
+        Returns None if the peer can't be connected to
+        """
+        # Only the asyncio server gets here, and it has already imported
+        # asyncio. Importing it up front would slow down every other start
+        import asyncio  # pylint: disable=import-outside-toplevel
+
+        connection = self.lookup(hostname, port)
+
+        if connection is not None:
+            return connection
+
+        key = (hostname, port)
+        pending = self.connecting.get(key)
+
+        # Already connecting, so waits for that connection instead
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        pending = asyncio.get_running_loop().create_future()
+        self.connecting[key] = pending
+
+        try:
+            connection = await self.s_mems.connector(hostname, port)
+        except OSError:
+            with self.lock:
+                self.failures += 1
+        else:
+            keep_alive(connection.transport.get_extra_info("socket"))
+            self.add(hostname, port, connection, dialled=True)
+        finally:
+            # Waiters get None if this was cancelled while connecting
+            del self.connecting[key]
+            pending.set_result(connection)
+
+        return connection
+
+    def adopt(self, hostname: str, port: int, connection) -> None:
+        """
+        Pools a connection another server made to this one, if there isn't
+        already a connection to it
+        """
+        with self.lock:
+            if (hostname, port) in self.peers or connection in self.keys:
+                return
+
+            self.peers[(hostname, port)] = connection
+            self.keys[connection] = (hostname, port)
+
+    def add(self, hostname: str, port: int, connection,
+            dialled: bool) -> None:
+        """
+        Pools a new connection to a peer
+        """
+        key = (hostname, port)
+
+        with self.lock:
+            if key in self.seen:
+                self.reconnects += 1
+            else:
+                self.connects += 1
+
+            self.seen.add(key)
+
+            self.peers[key] = connection
+            self.keys[connection] = key
+
+            if dialled:
+                self.dialled.add(key)
+            else:
+                self.dialled.discard(key)
+
+    def discard(self, connection) -> tuple[str, int] | None:
+        """
+        Stops pooling a connection once it has closed
+
+        Returns the peer it was to, or None if it wasn't pooled
+        """
+        with self.lock:
+            return self.forget(connection)
+
+    def forget(self, connection) -> tuple[str, int] | None:
+        """
+        discard, with the lock already held
+        """
+        key = self.keys.pop(connection, None)
+
+        if key is not None and self.peers.get(key) is connection:
+            del self.peers[key]
+            self.dialled.discard(key)
+
+        return key
+
+    def unhealthy(self) -> list:
+        """
+        Returns every pooled connection that is no longer healthy
+        """
+        with self.lock:
+            return [
+                connection for connection in self.keys
+                if not self.healthy(connection)
+            ]
+
+    def stats(self) -> dict[str, int]:
+        """
+        Size of the pool and how often its connections were reused
+        """
+        return {
+            "size": len(self.peers),
+            "dialled": len(self.dialled),
+            "reuses": self.reuses,
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "failures": self.failures
+        }
+
+
+def keep_alive(sock: socket.socket | None) -> None:
+    """
+    Has the OS probe an idle connection so a peer that vanished without
+    closing it is noticed
+    """
+    if sock is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
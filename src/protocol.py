@@ -6,19 +6,41 @@
 # False-positive import error
 # pylint: disable=import-error
 
+import logging
 import socket
-from src.message import Message
+import threading
+import time
+from collections import deque
+from src.message import Message, HEADER_SIZE
+from src.constants import (
+    SLOW_CONSUMER_DROP,
+    SLOW_CONSUMER_DISCONNECT,
+    SLOW_CONSUMER_COALESCE,
+    DEFAULT_SLOW_CONSUMER_POLICY,
+    DEFAULT_HIGH_WATER_MARK,
+    RELAY_BATCH_BYTES
+)
 
 
-DO_LOG = False
+logger = logging.getLogger("dechat.protocol")
 
+RECV_CHUNK_SIZE = 65536
 
-def log(*args, **kwargs):
-    """
-    Just a wrapper for print so I can easily enable or disable it
-    """
-    if DO_LOG:
-        print(*args, **kwargs)
+# Most buffers handed to a single sendmsg call when flushing. Windows has no
+# sendmsg so buffers are sent one at a time there
+MAX_FLUSH_BUFFERS = 64
+HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+
+# Connections that have an outbound buffer. Anything sent to these through
+# message_send or send_bytes is queued instead of blocking the caller
+outbound_buffers = {}
+
+# Receive chunk for each thread (see get_recv_chunk)
+recv_chunks = threading.local()
+
+# Called with the size of every write made through message_send or
+# send_bytes when the server collects metrics (see set_send_observer)
+send_observer = None
 
 
 def message_send(message_obj: Message, connection: socket.socket) -> bytes:
@@ -29,60 +51,359 @@ def message_send(message_obj: Message, connection: socket.socket) -> bytes:
     """
     encoding = message_obj.to_bytes()
 
+    send_bytes(encoding, connection)
+
+    return encoding
+
+
+def send_bytes(encoding: bytes, connection: socket.socket,
+               batch: bool = False) -> None:
+    """
+    send_bytes
+    Sends an already encoded message. Lets the same encoding be sent to many
+    connections without encoding it again for each one
+    :: encoding : bytes :: Encoded message(s) to send
+    :: connection : socket :: The connection to send to
+    :: batch : bool :: Whether the message can be held back briefly to be
+                       sent in one write with others (see OutboundBuffer),
+                       default False
+    """
+    if send_observer is not None:
+        send_observer(len(encoding))
+
+    outbound = outbound_buffers.get(connection)
+
+    if outbound is not None:
+        outbound.write(encoding, batch)
+        return
+
+    if batch and hasattr(connection, "send_batched"):  # asyncio connection
+        connection.send_batched(encoding)
+        return
+
     try:
         connection.sendall(encoding)
     except BrokenPipeError:
         pass
 
-    return encoding
+
+def set_send_observer(observer: callable) -> None:
+    """
+    Makes every write through message_send or send_bytes call observer with
+    its size. None stops observing
+    """
+    global send_observer  # pylint: disable=global-statement
+    send_observer = observer
+
+
+def register_outbound(outbound: "OutboundBuffer") -> None:
+    """
+    Makes everything sent to the buffer's connection go through the buffer
+    """
+    outbound_buffers[outbound.connection] = outbound
 
 
-def message_recv(connection: socket.socket) -> Message:
+def unregister_outbound(connection: socket.socket) -> None:
+    """
+    Stops queueing messages sent to a connection. Unsent messages are lost
     """
-    message_recv
-    Waits for a message on the connection and attempts to decode it
-    :: connection : socket :: The connection to wait on
+    outbound_buffers.pop(connection, None)
+
+
+class OutboundBuffer:
     """
-    header = connection.recv(38)
-    type_and_length_bytes = connection.recv(2)
+    Per-connection queue of encoded messages waiting to be written to a
+    non-blocking socket, so one slow reader never blocks the thread that is
+    sending to it
+
+    Writes go straight to the socket when nothing is queued. Whatever the
+    socket doesn't take is queued and should be flushed once the socket is
+    writable. Once more than high_water_mark bytes are queued, the slow
+    consumer policy decides what happens to new messages
+
+    Batched writes (e.g. relays to a linked server) are queued without being
+    sent, and held until batch_window seconds have passed (see hold_until) or
+    RELAY_BATCH_BYTES are queued, so everything written in the meantime goes
+    out together. Anything written behind them keeps its order
+    """
+
+    def __init__(self, connection: socket.socket,
+                 high_water_mark: int = DEFAULT_HIGH_WATER_MARK,
+                 policy: str = DEFAULT_SLOW_CONSUMER_POLICY,
+                 on_pending: callable = None,
+                 batch_window: float = 0.0) -> None:
+        """
+        on_pending is called with the buffer whenever it goes from empty to
+        holding unsent data, or when it overflows under the disconnect
+        policy
+        """
+        self.connection = connection
+        self.high_water_mark = high_water_mark
+        self.policy = policy
+        self.on_pending = on_pending
+
+        self.batch_window = batch_window
+        self.hold_until = 0.0  # Monotonic time a batch is held until
+
+        self.buffers = deque()
+        self.offset = 0  # Bytes of the first buffer that are already sent
+        self.pending = 0  # Unsent bytes across every buffer
+
+        self.dropped = 0
+        self.overflowed = False
+        self.broken = False
+
+        # Threads other than the server loop (e.g. linking) can send too
+        self.lock = threading.Lock()
+
+    def write(self, data: bytes, batch: bool = False) -> None:
+        """
+        Sends data if possible, otherwise queues it. Batched data is always
+        queued, to be sent with whatever else is written before the batch
+        window ends
+        """
+        notify = False
+
+        with self.lock:
+            if self.overflowed or self.broken:
+                return
+
+            if not batch:  # Anything held goes out with it straight away
+                self.hold_until = 0.0
+
+            if not self.buffers:
+                if batch:
+                    sent = 0
+                    self.hold_until = time.monotonic() + self.batch_window
+                else:
+                    sent = self.try_send(data)
+
+                    if sent == len(data):
+                        return
+
+                self.buffers.append(data)
+                self.offset = sent
+                self.pending = len(data) - sent
+                notify = True
+
+            elif self.pending + len(data) > self.high_water_mark:
+                notify = self.handle_slow_consumer(data)
+
+            else:
+                self.buffers.append(data)
+                self.pending += len(data)
 
-    message_length = Message.decode_type_and_length(type_and_length_bytes)[1]
+            if self.pending >= RELAY_BATCH_BYTES:
+                self.hold_until = 0.0
 
-    message_bytes = connection.recv(message_length)
+        if notify and self.on_pending is not None:
+            self.on_pending(self)
 
-    all_bytes = header + type_and_length_bytes + message_bytes
+    def try_send(self, data: bytes) -> int:
+        """
+        Sends as much of data as the socket takes without blocking
 
-    message_obj = Message.from_bytes(all_bytes)
+        Returns the number of bytes sent
+        """
+        try:
+            return self.connection.send(data)
+        except BlockingIOError:
+            return 0
+        except OSError:  # Broken pipe, reset, etc. Reader will clean up
+            self.broken = True
+            return len(data)
 
-    return message_obj
+    def handle_slow_consumer(self, data: bytes) -> bool:
+        """
+        Applies the slow consumer policy to data that doesn't fit under the
+        high-water mark. Must be called with the lock held
+
+        Returns whether on_pending should be called
+        """
+        if self.policy == SLOW_CONSUMER_DISCONNECT:
+            self.overflowed = True
+            self.buffers.clear()
+            self.pending = 0
+            return True
+
+        if self.policy == SLOW_CONSUMER_COALESCE:
+            # The first buffer may be partially sent so it has to stay
+            # or the stream would be corrupted
+            while (len(self.buffers) > 1 and
+                   self.pending + len(data) > self.high_water_mark):
+                self.pending -= len(self.buffers[1])
+                del self.buffers[1]
+                self.dropped += 1
+
+            if self.pending + len(data) <= self.high_water_mark:
+                self.buffers.append(data)
+                self.pending += len(data)
+                return False
+
+        # SLOW_CONSUMER_DROP, or too big to fit even after coalescing
+        self.dropped += 1
+        return False
+
+    def flush(self) -> bool:
+        """
+        Writes as much of the queue as the socket takes without blocking
+
+        Returns whether the queue has been fully flushed
+        """
+        with self.lock:
+            while self.buffers and not self.broken:
+                views = [memoryview(self.buffers[0])[self.offset:]]
+                views.extend(
+                    self.buffers[i]
+                    for i in range(1, min(len(self.buffers),
+                                          MAX_FLUSH_BUFFERS))
+                )
+
+                try:
+                    if HAS_SENDMSG:
+                        sent = self.connection.sendmsg(views)
+                    else:
+                        sent = self.connection.send(views[0])
+                except BlockingIOError:
+                    break
+                except OSError:
+                    self.broken = True
+                    break
+
+                self.pending -= sent
+                sent += self.offset
+
+                while self.buffers and sent >= len(self.buffers[0]):
+                    sent -= len(self.buffers.popleft())
+
+                self.offset = sent
+
+                if self.buffers:  # Socket didn't take everything
+                    break
+
+            if self.broken:
+                self.buffers.clear()
+                self.pending = 0
+                self.offset = 0
+
+            return not self.buffers
+
+
+def get_recv_chunk(size: int) -> memoryview:
+    """
+    Returns a view of a chunk of at least size bytes to read into
+
+    Reused for every read so no new bytes object is made per recv. Every
+    reader on the same thread shares one chunk, since what is read is
+    copied into the reader's own buffer straight away, so idle connections
+    don't each hold on to a chunk
+    """
+    chunk_view = getattr(recv_chunks, "view", None)
+
+    if chunk_view is None or len(chunk_view) < size:
+        chunk_view = memoryview(bytearray(size))
+        recv_chunks.view = chunk_view
+
+    return chunk_view
+
+
+class MessageReader:
+    """
+    Incremental frame parser for a single connection. Reads whatever is
+    available in large chunks and decodes every complete message in the
+    buffer, keeping partial messages around until the rest arrives
+    """
+
+    def __init__(self, chunk_size: int = RECV_CHUNK_SIZE) -> None:
+        self.buffer = bytearray()
+        self.chunk_size = chunk_size
+        self.last_read = 0  # Bytes read by the last recv
+
+    def recv(self, connection: socket.socket) -> list[Message] | None:
+        """
+        Reads once from the connection and returns every message that has
+        been completed
+
+        Returns None if the connection has been closed
+        """
+        chunk_view = get_recv_chunk(self.chunk_size)
+
+        num_bytes = connection.recv_into(chunk_view, self.chunk_size)
+
+        if num_bytes == 0:
+            return None
+
+        self.last_read = num_bytes
+
+        return self.feed(chunk_view[:num_bytes])
+
+    def feed(self, data: bytes) -> list[Message]:
+        """
+        Adds received bytes to the buffer and returns every complete message
+        """
+        self.buffer += data
+
+        return self.pop_messages()
+
+    def pop_messages(self) -> list[Message]:
+        """
+        Decodes and removes every complete message in the buffer
+        """
+        buffer = self.buffer
+        buffer_length = len(buffer)
+
+        messages = []
+        offset = 0
+
+        # Messages are decoded straight out of the buffer. The view has to be
+        # released before the buffer can be resized
+        with memoryview(buffer) as view:
+            while buffer_length - offset >= HEADER_SIZE:
+                end = offset + Message.frame_length(view, offset)
+
+                if end > buffer_length:  # Rest of the message hasn't arrived
+                    break
+
+                messages.append(Message.from_buffer(view, offset))
+                offset = end
+
+        if offset:
+            del buffer[:offset]
+
+        return messages
 
 
 # You should probably not have to touch these functions
-def bind_socket_setup(hostname: str, port: int,
-                      timeout=0.5) -> tuple[bool, socket.socket | None]:
+def bind_socket_setup(hostname: str, port: int, timeout=0.5,
+                      reuse_port: bool = False
+                      ) -> tuple[bool, socket.socket | None]:
     """
     Sets up the socket
     :: hostname : str :: hostname to bind to
     :: port : int :: port to bind to
+    :: reuse_port : bool :: Lets other processes bind to the same port so
+                            the kernel spreads connections across them.
+                            Needs SO_REUSEPORT (Linux, BSD, macOS)
 
     Returns (successful, connection)
     """
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.settimeout(timeout)
 
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
     successful = False
 
     try:
-        log(f"Trying to bind to {hostname}:{port}")
+        logger.debug("Trying to bind to %s:%s", hostname, port)
         sock.bind((hostname, port))
         successful = True
     except OSError:
-        log("Address already in use")
-        log("Please start the client on a different port, or wait for the "
-            "address to unbind")
+        logger.debug("Address %s:%s already in use", hostname, port)
 
     if successful:
-        log(f"Hosting on {sock.getsockname()[0]}:{sock.getsockname()[1]}")
+        logger.debug("Bound to %s:%s", *sock.getsockname()[:2])
 
         sock.listen()
         return True, sock
@@ -98,26 +419,23 @@ def conn_socket_setup(hostname: str, port: int, timeout=0.01):
 
     Returns (successful, connection)
     """
-    log(f"Setting up socket at {hostname}:{port}")
     connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     connection.settimeout(1)
     successful = False
     try:
-        log(f"Connecting to {hostname}:{port}")
+        logger.debug("Connecting to %s:%s", hostname, port)
         connection.connect((hostname, port))
         successful = True
     except ConnectionRefusedError:
-        log("Connection Refused")
-        log(f"It is possible that no server is running at {hostname}:{port}")
+        logger.debug("Connection to %s:%s refused", hostname, port)
         connection = None
     except OSError as err:
-        log(str(err))
+        logger.debug("Connecting to %s:%s failed: %s", hostname, port, err)
 
     if successful:
         connection.settimeout(timeout)
 
     if successful:
-        log("Successfully set up socket")
         return True, connection
 
     return False, None
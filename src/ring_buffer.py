@@ -0,0 +1,96 @@
+"""
+Fixed-capacity ring buffer used for message histories on both the server
+and the client
+"""
+
+
+class RingBuffer:
+    """
+    Stores up to capacity items, evicting the oldest item when a new one is
+    appended to a full buffer. Appending and evicting are O(1), and the
+    newest k items can be iterated in O(k)
+
+    Storage grows as items are appended rather than being allocated up
+    front, so a large capacity costs nothing until it is used
+
+    Iterates from oldest to newest
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = max(capacity, 0)
+
+        # Until the buffer is first full the oldest item is always at index
+        # 0 and items only holds what has been appended
+        self.items = []
+        self.start = 0  # Index of the oldest item
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self):
+        return self.newest(self.size)
+
+    def __getitem__(self, index: int):
+        """
+        0 is the oldest item, -1 the newest
+        """
+        if index < 0:
+            index += self.size
+
+        if not 0 <= index < self.size:
+            raise IndexError("RingBuffer index out of range")
+
+        return self.items[(self.start + index) % self.capacity]
+
+    def append(self, item) -> None:
+        """
+        Adds an item as the newest, evicting the oldest if full
+        """
+        if self.capacity == 0:
+            return
+
+        if self.size < self.capacity:
+            self.items.append(item)
+            self.size += 1
+        else:
+            # Full, so the newest item takes the oldest item's place
+            self.items[self.start] = item
+            self.start = (self.start + 1) % self.capacity
+
+    def newest(self, count: int, skip: int = 0):
+        """
+        Iterates from oldest to newest over the count newest items, leaving
+        out the skip most recent ones
+        """
+        skip = max(min(skip, self.size), 0)
+        count = max(min(count, self.size - skip), 0)
+
+        items = self.items
+        capacity = self.capacity
+        first = self.start + self.size - skip - count
+
+        for i in range(first, first + count):
+            yield items[i % capacity]
+
+    def resize(self, capacity: int) -> None:
+        """
+        Changes the capacity, keeping as many of the newest items as fit
+        """
+        capacity = max(capacity, 0)
+
+        if capacity == self.capacity:
+            return
+
+        self.items = list(self.newest(capacity))
+        self.capacity = capacity
+        self.start = 0
+        self.size = len(self.items)
+
+    def clear(self) -> None:
+        """
+        Removes every item
+        """
+        self.items = []
+        self.start = 0
+        self.size = 0
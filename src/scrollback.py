@@ -0,0 +1,93 @@
+"""
+Scrollback over the messages a client has stored for a connection. Drawing
+the view only formats the messages that fit on the terminal, however many
+are stored, and the view can be paged back through the whole history
+"""
+
+import shutil
+
+from src.message import Message
+from src.ring_buffer import RingBuffer
+
+# Rows left free under the history for the input prompt
+PROMPT_ROWS = 1
+
+
+def terminal_height() -> int:
+    """
+    Rows of history that fit on the terminal above the prompt
+    """
+    return max(shutil.get_terminal_size().lines - PROMPT_ROWS, 1)
+
+
+class Scrollback:
+    """
+    A view over a connection's stored messages, scrolled back offset
+    messages from the newest. At offset 0 the view follows new messages
+    """
+
+    def __init__(self, messages: RingBuffer) -> None:
+        """
+        :: messages : RingBuffer :: The connection's stored messages
+        """
+        self.messages = messages
+        self.offset = 0
+
+    def append(self, message_obj: Message) -> None:
+        """
+        Stores a message. A view scrolled back stays where it is
+        """
+        self.messages.append(message_obj)
+
+        if self.offset:
+            self.offset = min(self.offset + 1, len(self.messages) - 1)
+
+    def is_scrolled(self) -> bool:
+        """
+        Whether the view is scrolled back from the newest messages
+        """
+        return self.offset > 0
+
+    def rows(self, height: int) -> list[str]:
+        """
+        The rows a view height rows tall shows, oldest first. Only the
+        messages that can be seen are formatted
+        """
+        rows = []
+
+        for message_obj in self.messages.newest(height, self.offset):
+            rows.extend(message_obj.format().split("\n"))
+
+        return rows[-height:]
+
+    def render(self, height: int) -> str:
+        """
+        The rows a view height rows tall shows, as one string
+        """
+        return "\n".join(self.rows(height))
+
+    def page_up(self, height: int, pages: int = 1) -> None:
+        """
+        Scrolls back pages pages of a view height rows tall, stopping once
+        the oldest message is at the bottom
+        """
+        page = max(height - 1, 1)
+
+        self.offset = max(
+            min(self.offset + page * pages, len(self.messages) - 1), 0
+        )
+
+    def page_down(self, height: int, pages: int = 1) -> None:
+        """
+        Scrolls forward pages pages of a view height rows tall, stopping at
+        the newest message
+        """
+        page = max(height - 1, 1)
+
+        self.offset = max(self.offset - page * pages, 0)
+
+    def to_bottom(self) -> None:
+        """
+        Scrolls to the newest messages
+        """
+        self.offset = 0
@@ -0,0 +1,89 @@
+"""
+Hashed timer wheel for cheaply expiring things after a delay without a
+thread per timer. Swept from the server loop
+"""
+
+import time
+
+
+class TimerWheel:
+    """
+    Timers are hashed into a fixed ring of slots by the tick they are due on.
+    Advancing the wheel only looks at the slots for the ticks that have
+    passed, so scheduling and expiring are O(1) however many timers are live
+
+    Not thread-safe. Timers should only be scheduled and advanced from the
+    server loop
+    """
+
+    def __init__(self, tick: float = 0.25, num_slots: int = 256) -> None:
+        """
+        :: tick : float :: Resolution of the wheel in seconds
+        :: num_slots : int :: Number of slots. Delays longer than
+                              tick * num_slots go around the wheel more than
+                              once
+        """
+        self.tick = tick
+        self.slots = [[] for _ in range(num_slots)]
+        self.current_tick = int(time.monotonic() / tick)
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def schedule(self, delay: float, callback: callable, *args) -> None:
+        """
+        Calls callback(*args) once at least delay seconds have passed
+        """
+        due_tick = int((time.monotonic() + delay) / self.tick) + 1
+
+        # Never due on a tick that has already been swept
+        due_tick = max(due_tick, self.current_tick + 1)
+
+        self.slots[due_tick % len(self.slots)].append(
+            (due_tick, callback, args)
+        )
+        self.size += 1
+
+    def advance(self, now: float = None) -> int:
+        """
+        Fires every timer that is due
+
+        Returns the number of timers fired
+        """
+        if now is None:
+            now = time.monotonic()
+
+        now_tick = int(now / self.tick)
+
+        if now_tick <= self.current_tick:
+            return 0
+
+        num_slots = len(self.slots)
+
+        # After a long stall every slot only needs to be swept once
+        steps = min(now_tick - self.current_tick, num_slots)
+
+        due = []
+
+        for i in range(self.current_tick + 1, self.current_tick + steps + 1):
+            slot = self.slots[i % num_slots]
+
+            if not slot:
+                continue
+
+            # Timers more than one lap away stay for a later lap
+            remaining = [timer for timer in slot if timer[0] > now_tick]
+
+            if len(remaining) != len(slot):
+                due.extend(timer for timer in slot if timer[0] <= now_tick)
+                slot[:] = remaining
+
+        self.current_tick = now_tick
+        self.size -= len(due)
+
+        # Fired after sweeping so callbacks can safely schedule new timers
+        for _, callback, args in due:
+            callback(*args)
+
+        return len(due)
@@ -5,9 +5,13 @@ Useful utility functions that may be used across multiple files
 # False-positive import error
 # pylint: disable=import-error
 
+import functools
 import time
 from src.constants import MAX_PORT_VALUE
 
+# Timestamps remembered already converted to strings, one per second
+TIMESTAMP_CACHE_SIZE = 4096
+
 
 def is_integer(string: str) -> bool:
     """
@@ -51,9 +55,13 @@ def format_time_period(seconds: float):
     return res
 
 
+@functools.lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
 def unix_to_str(unix_time: int) -> str:
     """
     Converts unix time to '[HH:MM:SS]' format
+
+    Cached by second (messages carry whole seconds), as histories are
+    mostly messages sent within seconds of each other
     """
     return f"[{time.strftime('%H:%M:%S', time.localtime(unix_time))}]"
 
@@ -86,6 +94,21 @@ def split_hostname_port(string: str) -> tuple[str | None, int | None]:
     return hostname, port
 
 
+def get_flag_value(argv: list[str], flag: str,
+                   default: str = None) -> str | None:
+    """
+    Returns the value of a '--flag=value' style argument, or default if the
+    flag isn't given
+    """
+    prefix = f"{flag}="
+
+    for arg in argv:
+        if arg.startswith(prefix):
+            return arg[len(prefix):]
+
+    return default
+
+
 def flush_print(*args, **kwargs):
     """
     Flushes by default
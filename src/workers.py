@@ -0,0 +1,218 @@
+"""
+Running one server as several worker processes that share its port. Every
+worker accepts connections on its own SO_REUSEPORT listener, and channels
+are replicated across workers, staying in sync through 0b11 relays over
+local sockets between every pair of workers. Changes to a channel (its
+password and message limit, or it being destroyed or migrated) are
+replicated the same way
+"""
+
+# False-positive import error
+# pylint: disable=import-error
+
+import os
+import socket
+import time
+import zlib
+from src.channel import Channel
+from src.message import Message
+from src.protocol import message_send
+from src.constants import (
+    SERVER_CHANNEL_ID,
+    WORKER_FLAG,
+    REPLICATE_FLAG,
+    SYNC_FLAG,
+    DESTROY_FLAG,
+    LINK_FLAG,
+    SEP
+)
+
+HAS_REUSE_PORT = hasattr(socket, "SO_REUSEPORT")
+
+
+def channel_owner(channel_name: str, num_workers: int) -> int:
+    """
+    Returns the index of the worker that owns a channel. The owner is the
+    only worker that keeps the channel's history on disk
+    """
+    return zlib.crc32(channel_name.encode()) % num_workers
+
+
+def channel_state(flag: str, channel: Channel) -> str:
+    """
+    The message creating a channel on another worker (REPLICATE_FLAG), or
+    bringing its replica there up to date (SYNC_FLAG)
+    """
+    # Standard is:
+    # '<flag>|<channel_name>|<password>|<messages to store>|<created on>'
+    return SEP.join((
+        flag,
+        channel.name,
+        channel.password or "",
+        str(channel.messages_to_store),
+        str(channel.created_on)
+    ))
+
+
+class WorkerGroup:
+    """
+    A worker's view of the other workers it shares a port with
+
+    Workers find each other through internal listeners the parent process
+    binds on the loopback interface before forking, so every worker knows
+    every other worker's address from the start
+    """
+
+    def __init__(self, index: int, addresses: list[tuple[str, int]],
+                 listener: socket.socket, parent_pipe: int = None) -> None:
+        """
+        :: index : int :: This worker's index
+        :: addresses : list :: Internal address of every worker, by index
+        :: listener : socket :: This worker's internal listener
+        :: parent_pipe : int :: Read end of a pipe the parent process holds
+                                open for as long as it is running, so
+                                workers can stop if it is killed
+        """
+        self.index = index
+        self.addresses = addresses
+        self.listener = listener
+        self.parent_pipe = parent_pipe
+
+        # Worker index -> connection to that worker, and the other way round
+        self.connections = {}
+        self.peer_indexes = {}
+
+    def __len__(self) -> int:
+        return len(self.addresses)
+
+    @property
+    def address(self) -> tuple[str, int]:
+        """
+        This worker's internal address. Identifies it in channel links
+        """
+        return self.addresses[self.index]
+
+    def owns(self, channel_name: str) -> bool:
+        """
+        Returns whether this worker owns a channel
+        """
+        return channel_owner(channel_name, len(self)) == self.index
+
+    def is_peer(self, connection: socket.socket) -> bool:
+        """
+        Returns whether a connection is to another worker
+        """
+        return connection in self.peer_indexes
+
+    def connect_peers(self) -> list[socket.socket]:
+        """
+        Connects to every worker with a lower index. Workers with a higher
+        index connect to this one instead, so each pair shares a single
+        connection
+
+        Returns the new connections, which still need to be added to the
+        server
+        """
+        connections = []
+
+        for index in range(self.index):
+            connection = socket.create_connection(self.addresses[index])
+
+            self.add_peer(index, connection)
+
+            hello = Message(
+                SERVER_CHANNEL_ID,
+                "",
+                time.time(),
+                0b10,
+                SEP.join((WORKER_FLAG, str(self.index)))
+            )
+
+            message_send(hello, connection)
+
+            connections.append(connection)
+
+        return connections
+
+    def add_peer(self, index: int, connection: socket.socket) -> None:
+        """
+        Records the connection to another worker
+        """
+        self.connections[index] = connection
+        self.peer_indexes[connection] = index
+
+    def remove_peer(self, connection: socket.socket) -> None:
+        """
+        Forgets the connection to a worker that went away
+        """
+        index = self.peer_indexes.pop(connection, None)
+
+        if index is not None:
+            del self.connections[index]
+
+    def replicate_channel(self, channel: Channel,
+                          connections: list[socket.socket] = None) -> None:
+        """
+        Creates a channel on other workers (every worker by default) and
+        links it with them, reusing the regular link request so relays
+        between workers work exactly like relays between servers
+        """
+        hostname, port = self.address
+
+        link = SEP.join((
+            LINK_FLAG,
+            channel.name,
+            hostname,
+            str(port),
+            *channel.s_mems.link_capabilities()
+        ))
+
+        self.send(channel.id, (channel_state(REPLICATE_FLAG, channel), link),
+                  connections)
+
+    def sync_channel(self, channel: Channel) -> None:
+        """
+        Replicates a channel's password and message limit to every other
+        worker once they have changed
+        """
+        self.send(channel.id, (channel_state(SYNC_FLAG, channel),))
+
+    def destroy_channel(self, channel: Channel,
+                        migrate_to: tuple[str, int] = None) -> None:
+        """
+        Destroys a channel on every other worker, telling its members there
+        to migrate to migrate_to (hostname, port) first if given
+        """
+        # Standard is:
+        # '--destroy|<channel_name>|[<hostname>|<port>]'
+        fields = [DESTROY_FLAG, channel.name]
+
+        if migrate_to is not None:
+            fields.extend((migrate_to[0], str(migrate_to[1])))
+
+        self.send(channel.id, (SEP.join(fields),))
+
+    def send(self, channel_id: int, messages: tuple[str, ...],
+             connections: list[socket.socket] = None) -> None:
+        """
+        Sends server messages about a channel to other workers (every
+        worker by default)
+        """
+        if connections is None:
+            connections = self.connections.values()
+
+        for connection in connections:
+            for msg in messages:
+                message_send(
+                    Message(channel_id, "", time.time(), 0b10, msg),
+                    connection
+                )
+
+    def close(self) -> None:
+        """
+        Closes the internal listener and the pipe to the parent process
+        """
+        self.listener.close()
+
+        if self.parent_pipe is not None:
+            os.close(self.parent_pipe)
@@ -0,0 +1,19 @@
+"""
+Runs the base testcases against the asyncio server
+"""
+
+# pylint: disable=import-error, wrong-import-order, wrong-import-position
+# pylint: disable=unused-import
+
+import unittest
+import test_utils
+from rick_utils import set_output_file
+
+test_utils.SERVER_START_CMD = "python3 async_server.py {hostname} {port}"
+
+from base_tests import BaseDechatTest
+
+
+if __name__ == "__main__":
+    set_output_file("test/logs/async_logs.txt")
+    unittest.main() # run all tests
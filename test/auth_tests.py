@@ -0,0 +1,257 @@
+"""
+Testcases for servers started with --auth. Connections that haven't signed
+in, or that signed in as a client, can't send relays or other server
+messages, on either server
+"""
+
+# pylint: disable=import-error, wrong-import-order, wrong-import-position
+
+import socket
+import subprocess
+import time
+import unittest
+
+import sys
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+from Crypto.PublicKey import RSA
+from src.auth import solve_challenge, export_public_key
+from src.message import Message
+from src.protocol import MessageReader, message_send
+from src.constants import (
+    SERVER_CHANNEL_ID,
+    CHALLENGE_FLAG,
+    AUTH_FLAG,
+    LINK_FLAG,
+    SEP
+)
+
+START_TIMEOUT = 5
+READ_TIMEOUT = 5
+
+SPOOFED = "spoofed relay"
+
+
+class AuthTest(unittest.TestCase):
+    """
+    Sign in test cases against the selector server
+    """
+
+    server_script = "server.py"
+    address = ("localhost", 9995)
+
+    server = None
+    key = None
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        print("Starting server")
+        cls.server = subprocess.Popen(
+            [
+                "python3", cls.server_script,
+                cls.address[0], str(cls.address[1]), "--auth"
+            ],
+            stdout=subprocess.DEVNULL
+        )
+
+        cls.key = RSA.generate(2048)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        print("Killing server")
+        cls.server.terminate()
+        cls.server.wait()
+
+    def setUp(self) -> None:
+        self.connections = []
+
+    def tearDown(self) -> None:
+        for connection, _ in self.connections:
+            connection.close()
+
+    def connect(self) -> tuple[socket.socket, MessageReader, bytes]:
+        """
+        Connects to the server and waits for the challenge to sign
+
+        Returns the connection, its reader and the challenge
+        """
+        deadline = time.monotonic() + START_TIMEOUT
+
+        while True:
+            try:
+                connection = socket.create_connection(self.address)
+                break
+            except ConnectionRefusedError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+        connection.settimeout(READ_TIMEOUT)
+        reader = MessageReader()
+
+        self.connections.append((connection, reader))
+
+        challenge = self.read_until(
+            connection, reader,
+            lambda message_obj: message_obj.message.startswith(CHALLENGE_FLAG)
+        )[-1].message.split(SEP)[1]
+
+        return connection, reader, bytes.fromhex(challenge)
+
+    def sign_in(self, nickname: str) -> tuple[socket.socket, MessageReader]:
+        """
+        Connects and signs in as nickname
+
+        Returns the connection and its reader
+        """
+        connection, reader, challenge = self.connect()
+
+        message_send(
+            Message(SERVER_CHANNEL_ID, nickname, time.time(), 0b10,
+                    SEP.join((AUTH_FLAG, export_public_key(self.key),
+                              solve_challenge(challenge, self.key).hex()))),
+            connection
+        )
+
+        self.read_until(
+            connection, reader,
+            lambda message_obj: message_obj.message.startswith(
+                "Authenticated as"
+            )
+        )
+
+        return connection, reader
+
+    @staticmethod
+    def read_until(connection: socket.socket, reader: MessageReader,
+                   done: callable) -> list[Message] | None:
+        """
+        Reads messages until done is true for one of them
+
+        Returns every message read, or None if the connection was closed
+        first
+        """
+        received = []
+
+        while not received or not done(received[-1]):
+            messages = reader.recv(connection)
+
+            if messages is None:
+                return None
+
+            for message_obj in messages:
+                received.append(message_obj)
+
+                if done(message_obj):
+                    break
+
+        return received
+
+    @staticmethod
+    def send(connection: socket.socket, message_type: int, msg: str,
+             channel_id: int = SERVER_CHANNEL_ID,
+             nickname: str = "alice") -> None:
+        """
+        Sends one message
+        """
+        message_send(
+            Message(channel_id, nickname, time.time(), message_type, msg),
+            connection
+        )
+
+    def create_channel(self, name: str) -> tuple[socket.socket,
+                                                   MessageReader, int]:
+        """
+        Signs in as alice and creates a channel
+
+        Returns alice's connection, its reader and the channel's id
+        """
+        alice, reader = self.sign_in("alice")
+
+        self.send(alice, 0b00, f"/create {name}")
+
+        joined = self.read_until(
+            alice, reader,
+            lambda message_obj: message_obj.channel_id != SERVER_CHANNEL_ID
+        )
+
+        return alice, reader, joined[-1].channel_id
+
+    def assert_not_relayed(self, alice: socket.socket,
+                           reader: MessageReader) -> None:
+        """
+        Has alice post to her channel and checks nothing spoofed reached
+        her before her own post did
+        """
+        self.send(alice, 0b00, "after the relay")
+
+        received = self.read_until(
+            alice, reader,
+            lambda message_obj: "after the relay" in message_obj.message
+        )
+
+        assert received is not None
+        assert not any(SPOOFED in message_obj.message
+                       for message_obj in received)
+
+    def test_relay_before_sign_in(self) -> None:
+        """
+        A relay from a connection that hasn't signed in shouldn't reach the
+        channel, and should get the connection closed
+        """
+        alice, reader, channel_id = self.create_channel("relayed")
+
+        mallory, mallory_reader, _ = self.connect()
+
+        self.send(mallory, 0b11, SPOOFED, channel_id=channel_id)
+
+        assert self.read_until(mallory, mallory_reader,
+                               lambda _: False) is None
+
+        self.assert_not_relayed(alice, reader)
+
+    def test_server_message_before_sign_in(self) -> None:
+        """
+        A connection that hasn't signed in shouldn't be treated as another
+        server (which would never be timed out) for sending a server
+        message. It should be closed instead
+        """
+        mallory, reader, _ = self.connect()
+
+        self.send(mallory, 0b10,
+                  SEP.join((LINK_FLAG, "linked", "localhost", "1")))
+
+        assert self.read_until(mallory, reader, lambda _: False) is None
+
+    def test_relay_after_sign_in(self) -> None:
+        """
+        A relay from a connection signed in as a client should be ignored
+        """
+        alice, reader, channel_id = self.create_channel("signed")
+
+        bob, bob_reader = self.sign_in("bob")
+
+        self.send(bob, 0b11, SPOOFED, channel_id=channel_id)
+        self.send(bob, 0b00, "/info")
+
+        # Still connected
+        assert self.read_until(
+            bob, bob_reader,
+            lambda message_obj: "Server: " in message_obj.message
+        ) is not None
+
+        self.assert_not_relayed(alice, reader)
+
+
+class AsyncAuthTest(AuthTest):
+    """
+    Sign in test cases against the asyncio server
+    """
+
+    server_script = "async_server.py"
+    address = ("localhost", 9996)
+
+
+if __name__ == "__main__":
+    unittest.main() # run all tests
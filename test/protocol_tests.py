@@ -0,0 +1,527 @@
+"""
+Testcases for the message protocol and its framing
+"""
+
+# pylint: disable=import-error, wrong-import-order, wrong-import-position
+
+import unittest
+import socket
+import tempfile
+import threading
+import time
+
+import sys
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+from src.message import Message
+from src.protocol import MessageReader, OutboundBuffer, set_send_observer
+from src.commons import ClientConnectionWrapper, ServerMembers
+from src.channel import Channel
+from src.commands.server_commands import c_join
+from src.client_receiver import ClientReceiver
+from src.constants import (
+    SLOW_CONSUMER_DROP,
+    SLOW_CONSUMER_DISCONNECT,
+    SLOW_CONSUMER_COALESCE
+)
+
+
+def make_messages(num: int) -> list[Message]:
+    """
+    Creates a list of distinct messages to encode and decode
+    """
+    return [
+        Message(i, f"nick_{i}", time.time(), i % 4, "message " * i)
+        for i in range(num)
+    ]
+
+
+class ProtocolTest(unittest.TestCase):
+    """
+    Protocol test cases - no servers or clients required
+    """
+
+    def test_wire_format(self) -> None:
+        """
+        Encoding should match the protocol byte for byte
+        """
+        message = Message(3, "nick", 1700000000, 0b01, "hello")
+
+        expected = (
+            (3).to_bytes(2, "little") +
+            b"\x00" * 28 + b"nick" +
+            (1700000000).to_bytes(4, "little") +
+            (0b01 | (5 << 2)).to_bytes(2, "little") +
+            b"hello"
+        )
+
+        assert message.to_bytes() == expected
+        assert Message.from_bytes(expected) == message
+
+    def test_format_cached(self) -> None:
+        """
+        Formatting should be reused until the message changes, and look
+        the same as formatting from scratch
+        """
+        message = Message(3, "nick", 1700000000, 0b00, "one\ntwo")
+
+        formatted = message.format()
+
+        assert message.format() is formatted
+        assert formatted.endswith("nick| one\n" + " " * 42 + "| two")
+
+        message.set_nickname("a->b")
+        assert "a->b: one" in message.format()
+
+        message.set_message_type(0b01)
+        assert message.format().split(": one")[0].endswith(" *")
+
+        message.set_message("three")
+        assert message.format().endswith("*: three")
+
+        decoded = Message.from_bytes(message.to_bytes())
+        assert decoded.format() == message.copy().format()
+
+    def test_decode_from_offset(self) -> None:
+        """
+        Messages should decode straight out of a larger buffer
+        """
+        messages = make_messages(10)
+        view = memoryview(b"".join(m.to_bytes() for m in messages))
+
+        offset = 0
+        for message in messages:
+            assert Message.from_buffer(view, offset) == message
+            offset += Message.frame_length(view, offset)
+
+        assert offset == len(view)
+
+    def test_coalesced_frames(self) -> None:
+        """
+        Many messages arriving in one read should all be decoded
+        """
+        messages = make_messages(20)
+
+        reader = MessageReader()
+        decoded = reader.feed(b"".join(m.to_bytes() for m in messages))
+
+        assert decoded == messages
+        assert len(reader.buffer) == 0
+
+    def test_split_frames(self) -> None:
+        """
+        Reads stopping in the middle of a message should not corrupt it
+        """
+        messages = make_messages(20)
+        encoding = b"".join(m.to_bytes() for m in messages)
+
+        reader = MessageReader()
+        decoded = []
+
+        # Feeds a few bytes at a time so reads end mid header and mid message
+        for i in range(0, len(encoding), 7):
+            decoded += reader.feed(encoding[i:i + 7])
+
+        assert decoded == messages
+        assert len(reader.buffer) == 0
+
+    def test_reader_recv(self) -> None:
+        """
+        One recv should return every message sent so far and None once the
+        other end has closed
+        """
+        messages = make_messages(5)
+        sender, receiver = socket.socketpair()
+
+        sender.sendall(b"".join(m.to_bytes() for m in messages))
+
+        reader = MessageReader()
+        assert reader.recv(receiver) == messages
+
+        sender.close()
+        assert reader.recv(receiver) is None
+
+        receiver.close()
+
+    def test_readers_share_chunk(self) -> None:
+        """
+        Readers on the same thread share a receive chunk, which shouldn't
+        mix up the messages they are each partway through
+        """
+        messages = make_messages(6)
+        pairs = [socket.socketpair() for _ in range(2)]
+        readers = [MessageReader(), MessageReader()]
+
+        encodings = [
+            b"".join(m.to_bytes() for m in messages[:3]),
+            b"".join(m.to_bytes() for m in messages[3:])
+        ]
+
+        decoded = [[], []]
+
+        # Interleaves reads so each reader is left holding a partial message
+        for half in (slice(None, 50), slice(50, None)):
+            for i, (sender, receiver) in enumerate(pairs):
+                sender.sendall(encodings[i][half])
+                decoded[i] += readers[i].recv(receiver)
+
+        assert decoded == [messages[:3], messages[3:]]
+
+        for sender, receiver in pairs:
+            sender.close()
+            receiver.close()
+
+    @staticmethod
+    def fill_outbound(policy: str, high_water_mark: int,
+                      frames: int = 1000) -> tuple:
+        """
+        Writes frames to an outbound buffer whose reader never reads
+
+        Returns the buffer, the receiving socket and the frames written
+        """
+        sender, receiver = socket.socketpair()
+        sender.setblocking(False)
+
+        outbound = OutboundBuffer(sender, high_water_mark, policy)
+
+        written = [bytes([i % 256]) * 4096 for i in range(frames)]
+
+        for data in written:
+            outbound.write(data)
+
+        return outbound, receiver, written
+
+    @staticmethod
+    def drain(outbound: OutboundBuffer, receiver: socket.socket) -> bytes:
+        """
+        Reads everything an outbound buffer has queued
+        """
+        receiver.settimeout(0.1)
+        received = bytearray()
+
+        while True:
+            outbound.flush()
+            try:
+                chunk = receiver.recv(1 << 20)
+            except socket.timeout:
+                break
+            received += chunk
+
+        return bytes(received)
+
+    def test_outbound_queues_in_order(self) -> None:
+        """
+        Writes the socket can't take should be queued then flushed in order
+        """
+        outbound, receiver, written = self.fill_outbound(
+            SLOW_CONSUMER_DROP, high_water_mark=1 << 30
+        )
+
+        assert outbound.pending > 0
+        assert self.drain(outbound, receiver) == b"".join(written)
+        assert outbound.pending == 0
+
+    def test_slow_consumer_drop(self) -> None:
+        """
+        New messages should be dropped once over the high-water mark
+        """
+        outbound, receiver, written = self.fill_outbound(
+            SLOW_CONSUMER_DROP, high_water_mark=16 * 4096
+        )
+
+        assert outbound.dropped > 0
+        assert outbound.pending <= 16 * 4096
+
+        received = self.drain(outbound, receiver)
+        kept = len(written) - outbound.dropped
+
+        assert received == b"".join(written[:kept])
+
+    def test_slow_consumer_disconnect(self) -> None:
+        """
+        The buffer should overflow and stop queueing once over the
+        high-water mark
+        """
+        outbound, _receiver, _written = self.fill_outbound(
+            SLOW_CONSUMER_DISCONNECT, high_water_mark=16 * 4096
+        )
+
+        assert outbound.overflowed
+        assert outbound.pending == 0
+
+    def test_slow_consumer_coalesce(self) -> None:
+        """
+        The oldest queued messages should make way for the newest ones
+        """
+        outbound, receiver, written = self.fill_outbound(
+            SLOW_CONSUMER_COALESCE, high_water_mark=16 * 4096
+        )
+
+        assert outbound.dropped > 0
+
+        received = self.drain(outbound, receiver)
+
+        # Whole messages only, ending with the newest
+        assert len(received) % 4096 == 0
+        assert received.endswith(b"".join(written[-15:]))
+
+    def test_batched_writes_held(self) -> None:
+        """
+        Batched writes should be held until the batch window ends, then
+        flushed in order together with anything written after them
+        """
+        sender, receiver = socket.socketpair()
+        sender.setblocking(False)
+        receiver.settimeout(0.05)
+
+        notified = []
+        outbound = OutboundBuffer(sender, on_pending=notified.append,
+                                  batch_window=10)
+
+        messages = make_messages(5)
+        encodings = [m.to_bytes() for m in messages]
+
+        for encoding in encodings[:4]:
+            outbound.write(encoding, batch=True)
+
+        # Held, and the server loop only told once
+        assert outbound.hold_until > time.monotonic()
+        assert notified == [outbound]
+
+        with self.assertRaises(socket.timeout):
+            receiver.recv(1 << 16)
+
+        # An unbatched write releases the batch ahead of it
+        outbound.write(encodings[4])
+        assert outbound.hold_until == 0
+
+        assert self.drain(outbound, receiver) == b"".join(encodings)
+        assert MessageReader().feed(b"".join(encodings)) == messages
+
+        sender.close()
+        receiver.close()
+
+
+class ClientReceiverTest(unittest.TestCase):
+    """
+    Client receive loop test cases
+    """
+
+    def setUp(self) -> None:
+        self.received = []
+        self.closed = []
+        self.failing = set()
+        self.event = threading.Event()
+
+        def on_message(message_obj: Message,
+                       wrapper: ClientConnectionWrapper) -> None:
+            if wrapper in self.failing:
+                raise ValueError("Bad message")
+
+            self.received.append((message_obj, wrapper))
+            self.event.set()
+
+        def on_closed(wrapper: ClientConnectionWrapper) -> None:
+            self.closed.append(wrapper)
+            self.event.set()
+
+        self.receiver = ClientReceiver(on_message, on_closed)
+        self.receiver.start()
+
+    def tearDown(self) -> None:
+        self.receiver.stop()
+
+    def await_event(self) -> None:
+        """
+        Waits for the receiver to call back
+        """
+        assert self.event.wait(timeout=1)
+        self.event.clear()
+
+    def test_receives_from_every_connection(self) -> None:
+        """
+        Messages from every registered connection should be handed over as
+        they arrive, by the one receive thread
+        """
+        pairs = [socket.socketpair() for _ in range(3)]
+        wrappers = [ClientConnectionWrapper(receiver) for _, receiver in pairs]
+
+        for wrapper in wrappers:
+            self.receiver.register(wrapper)
+
+        messages = make_messages(3)
+
+        for i, (sender, _) in enumerate(pairs):
+            sender.sendall(messages[i].to_bytes())
+            self.await_event()
+
+            assert self.received[-1] == (messages[i], wrappers[i])
+
+        for sender, receiver in pairs:
+            sender.close()
+            receiver.close()
+
+    def test_closed_connection(self) -> None:
+        """
+        The server closing the connection should be reported once and the
+        connection no longer received from
+        """
+        sender, receiver = socket.socketpair()
+        wrapper = ClientConnectionWrapper(receiver)
+
+        self.receiver.register(wrapper)
+
+        sender.close()
+        self.await_event()
+
+        assert self.closed == [wrapper]
+        assert not self.event.wait(timeout=0.1)
+
+        receiver.close()
+
+    def test_error_drops_only_its_connection(self) -> None:
+        """
+        An error handling a message should only drop the connection it came
+        from, and the others should keep being received from
+        """
+        pairs = [socket.socketpair() for _ in range(2)]
+        wrappers = [ClientConnectionWrapper(receiver) for _, receiver in pairs]
+
+        for wrapper in wrappers:
+            self.receiver.register(wrapper)
+
+        self.failing.add(wrappers[0])
+        messages = make_messages(2)
+
+        with self.assertLogs("dechat.client", "ERROR"):
+            pairs[0][0].sendall(messages[0].to_bytes())
+            self.await_event()
+
+        assert self.closed == [wrappers[0]]
+
+        pairs[1][0].sendall(messages[1].to_bytes())
+        self.await_event()
+
+        assert self.received == [(messages[1], wrappers[1])]
+
+        for sender, receiver in pairs:
+            sender.close()
+            receiver.close()
+
+
+class HistoryReplayTest(unittest.TestCase):
+    """
+    Channel history replay test cases, for history kept in memory and on
+    disk
+    """
+
+    # More than the channel's default message limit of 50
+    NUM_MESSAGES = 60
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        set_send_observer(None)
+        self.directory.cleanup()
+
+    def create_channel(self, log_directory: str | None) -> ServerMembers:
+        """
+        Creates a channel and stores NUM_MESSAGES messages in it, with no
+        one there to receive them
+        """
+        s_mems = ServerMembers("localhost", 0, log_directory=log_directory)
+        self.addCleanup(s_mems.selector.close)
+
+        channel = Channel(s_mems, None, "general")
+        s_mems.channels[channel.id] = channel
+        s_mems.channels.add_alias(channel.id, "general")
+
+        for i in range(self.NUM_MESSAGES):
+            channel.broadcast_message(
+                Message(0, "nick", time.time(), 0b00, f"message {i}")
+            )
+
+        return s_mems
+
+    def observe_writes(self, send: callable) -> list[list[str]]:
+        """
+        Calls send(connection) and returns the text of the messages in each
+        write it made, in order
+        """
+        connection, peer = socket.socketpair()
+        self.addCleanup(connection.close)
+        self.addCleanup(peer.close)
+
+        sizes = []
+        set_send_observer(sizes.append)
+
+        try:
+            send(connection)
+        finally:
+            set_send_observer(None)
+
+        data = b""
+        peer.settimeout(1)
+
+        while len(data) < sum(sizes):
+            data += peer.recv(1 << 16)
+
+        writes = []
+        offset = 0
+
+        for size in sizes:
+            writes.append([
+                message_obj.message for message_obj in
+                MessageReader().feed(data[offset:offset + size])
+            ])
+            offset += size
+
+        return writes
+
+    def test_join_replays_in_one_write(self) -> None:
+        """
+        Joining a channel should send its newest stored messages, oldest
+        first, in a single write ahead of the welcome
+        """
+        for log_directory in (None, self.directory.name):
+            with self.subTest(log_directory=log_directory):
+                s_mems = self.create_channel(log_directory)
+
+                writes = self.observe_writes(lambda connection: c_join(
+                    Message(0, "joiner", time.time(), 0b01, "/join general"),
+                    connection, s_mems
+                ))
+
+                # The history, then the welcome announcement
+                assert writes == [
+                    [f"message {i}" for i in range(10, self.NUM_MESSAGES)],
+                    ["joiner joined the channel!"]
+                ]
+
+    def test_ignore_recent(self) -> None:
+        """
+        The newest ignore_recent messages should be left out of a replay,
+        which is still a single write
+        """
+        for log_directory in (None, self.directory.name):
+            with self.subTest(log_directory=log_directory):
+                channel = self.create_channel(
+                    log_directory
+                ).resolve_channel("general")
+
+                writes = self.observe_writes(
+                    lambda connection: channel.send_message_history(
+                        connection, ignore_recent=5
+                    )
+                )
+
+                # The rest of the channel's 50 newest messages
+                assert writes == [
+                    [f"message {i}" for i in range(10, self.NUM_MESSAGES - 5)]
+                ]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -78,6 +78,14 @@ class ClientWrapper:
         """
         self._buffer_lines.clear()
 
+    def take_buffer(self) -> list[str]:
+        """
+        Returns the buffered lines and clears the buffer in one step so lines
+        logged in between are never lost
+        """
+        buffer, self._buffer_lines = self._buffer_lines, []
+        return buffer
+
     def on_log(self, *args, **kwargs) -> None:
         """
         Hook function to redirect client logs into this wrapper
@@ -294,7 +302,7 @@ def await_response(client_wrapper: ClientWrapper,
 
     while not state[0][0]:
 
-        buffer = client_wrapper.get_buffer()
+        buffer = client_wrapper.take_buffer()
 
         if len(buffer) > 0:  # First contact
 
@@ -315,18 +323,15 @@ def await_response(client_wrapper: ClientWrapper,
             n_thread = threading.Thread(target=n_timeout_timer)
             n_thread.start()
 
-            client_wrapper.clear_buffer()
-
             while not n_state[0][0]:
 
-                buffer = client_wrapper.get_buffer()
+                buffer = client_wrapper.take_buffer()
 
                 if len(buffer) > 0:
 
                     log("Additional contact")
 
                     logs += buffer
-                    client_wrapper.clear_buffer()
                     n_state[1][0] = time.time()
 
     log(f"Total wait: {time.time() - start}")
@@ -0,0 +1,1106 @@
+"""
+Testcases for the data structures the server and client are built on
+"""
+
+# pylint: disable=import-error, wrong-import-order, wrong-import-position
+
+import asyncio
+import json
+import logging
+import socket
+import unittest
+import tempfile
+import threading
+import time
+
+import sys
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+from src.timer_wheel import TimerWheel
+from src.ring_buffer import RingBuffer
+from src.scrollback import Scrollback
+from src.channel_log import ChannelLog, channel_log_directory
+from src.blocking_queue import BlockingQueue
+from src.alias_dictionary import AliasDictionary
+from src.config_cache import ConfigCache
+from src.metrics import Metrics, Histogram
+from src.logger import RateLimitFilter, JsonFormatter
+from src.message import Message
+from src.commons import ServerMembers, ChannelLinkInfo
+from src.channel import Channel
+from src.authenticator import Authenticator, HAS_CRYPTO
+from src.constants import NICK_MSG_SEPARATOR
+
+if HAS_CRYPTO:
+    from Crypto.PublicKey import RSA
+    from src.auth import solve_challenge, export_public_key
+
+
+class TimerWheelTest(unittest.TestCase):
+    """
+    Timer wheel test cases
+    """
+
+    def test_fires_when_due(self) -> None:
+        """
+        Timers should fire once their delay has passed and not before
+        """
+        wheel = TimerWheel(tick=0.1, num_slots=8)
+        fired = []
+
+        wheel.schedule(0.5, fired.append, "a")
+        wheel.schedule(2, fired.append, "b")
+
+        now = time.monotonic()
+
+        wheel.advance(now + 0.3)
+        assert not fired
+
+        wheel.advance(now + 0.7)
+        assert fired == ["a"]
+
+        # More than a full lap of the wheel away
+        wheel.advance(now + 1.5)
+        assert fired == ["a"]
+
+        wheel.advance(now + 2.5)
+        assert fired == ["a", "b"]
+        assert len(wheel) == 0
+
+    def test_long_stall(self) -> None:
+        """
+        Every due timer should fire even if the wheel isn't advanced for
+        many laps
+        """
+        wheel = TimerWheel(tick=0.1, num_slots=8)
+        fired = []
+
+        for i in range(100):
+            wheel.schedule(i / 10, fired.append, i)
+
+        assert wheel.advance(time.monotonic() + 60) == 100
+        assert sorted(fired) == list(range(100))
+
+    def test_schedule_from_callback(self) -> None:
+        """
+        Callbacks should be able to schedule new timers
+        """
+        wheel = TimerWheel(tick=0.1, num_slots=8)
+        fired = []
+
+        def reschedule() -> None:
+            fired.append(len(fired))
+            wheel.schedule(0.2, fired.append, "again")
+
+        wheel.schedule(0, reschedule)
+
+        now = time.monotonic()
+        wheel.advance(now + 0.15)
+        assert fired == [0]
+
+        wheel.advance(now + 1)
+        assert fired == [0, "again"]
+
+
+class RingBufferTest(unittest.TestCase):
+    """
+    Ring buffer test cases
+    """
+
+    def test_evicts_oldest(self) -> None:
+        """
+        Only the newest capacity items should be kept, oldest first
+        """
+        ring = RingBuffer(5)
+
+        for i in range(12):
+            ring.append(i)
+
+        assert list(ring) == [7, 8, 9, 10, 11]
+        assert len(ring) == 5
+        assert ring[0] == 7 and ring[-1] == 11
+
+    def test_newest(self) -> None:
+        """
+        Should iterate over the newest items in order, optionally leaving
+        out the most recent ones
+        """
+        ring = RingBuffer(5)
+
+        for i in range(7):
+            ring.append(i)
+
+        assert list(ring.newest(2)) == [5, 6]
+        assert list(ring.newest(2, skip=1)) == [4, 5]
+        assert list(ring.newest(100)) == [2, 3, 4, 5, 6]
+        assert list(ring.newest(100, skip=100)) == []
+
+    def test_resize(self) -> None:
+        """
+        Shrinking should keep the newest items and growing should keep
+        everything
+        """
+        ring = RingBuffer(5)
+
+        for i in range(8):
+            ring.append(i)
+
+        ring.resize(3)
+        assert list(ring) == [5, 6, 7]
+
+        ring.resize(6)
+        for i in range(8, 11):
+            ring.append(i)
+
+        assert list(ring) == [5, 6, 7, 8, 9, 10]
+
+        ring.resize(-1)
+        ring.append(11)
+        assert list(ring) == []
+
+    def test_grows_lazily(self) -> None:
+        """
+        A huge capacity shouldn't be allocated up front, and the buffer
+        should still wrap around once it fills up
+        """
+        ring = RingBuffer(1_000_000_000)
+
+        for i in range(3):
+            ring.append(i)
+
+        assert len(ring.items) == 3
+        assert list(ring) == [0, 1, 2]
+
+        ring.resize(4)
+
+        for i in range(3, 7):
+            ring.append(i)
+
+        assert len(ring.items) == 4
+        assert list(ring) == [3, 4, 5, 6]
+        assert ring[0] == 3 and list(ring.newest(2, skip=1)) == [4, 5]
+
+
+class ScrollbackTest(unittest.TestCase):
+    """
+    Scrollback test cases
+    """
+
+    def setUp(self) -> None:
+        self.scrollback = Scrollback(RingBuffer(100))
+
+        for i in range(100):
+            text = f"message {i}"
+
+            if i % 10 == 0:
+                text += "\nsecond line"
+
+            self.scrollback.append(Message(0, "nick", 0, 0b00, text))
+
+    def visible(self, height: int) -> list[str]:
+        """
+        The message text on each row of a view height rows tall
+        """
+        return [row.split(NICK_MSG_SEPARATOR, 1)[-1].strip()
+                for row in self.scrollback.rows(height)]
+
+    def test_only_visible_rows(self) -> None:
+        """
+        Should only show the newest rows that fit, splitting messages over
+        several lines into rows
+        """
+        assert self.visible(3) == ["message 97", "message 98", "message 99"]
+
+        self.scrollback.offset = 8
+        assert self.visible(3) == ["message 90", "second line", "message 91"]
+
+    def test_paging(self) -> None:
+        """
+        Paging up should stop at the oldest message, paging down at the
+        newest
+        """
+        self.scrollback.page_up(5)
+        assert self.visible(5)[-1] == "message 95"
+
+        self.scrollback.page_up(5, pages=1000)
+        assert self.visible(5) == ["message 0", "second line"]
+
+        self.scrollback.page_down(5, pages=2)
+        assert self.visible(5)[-1] == "message 8"
+
+        self.scrollback.page_down(5, pages=1000)
+        assert not self.scrollback.is_scrolled()
+        assert self.visible(1) == ["message 99"]
+
+    def test_stays_scrolled(self) -> None:
+        """
+        New messages shouldn't move a view that is scrolled back, but
+        should move one that isn't
+        """
+        self.scrollback.page_up(5)
+        before = self.visible(5)
+
+        self.scrollback.append(Message(0, "nick", 0, 0b00, "new"))
+        assert self.visible(5) == before
+
+        self.scrollback.to_bottom()
+        assert self.visible(1) == ["new"]
+
+
+class ChannelLogTest(unittest.TestCase):
+    """
+    Persistent channel log test cases
+    """
+
+    def setUp(self) -> None:
+        # Cleaned up in tearDown
+        # pylint: disable=consider-using-with
+        self.directory = tempfile.TemporaryDirectory()
+
+        # Small segments so every test spans a few of them
+        self.log = ChannelLog(self.directory.name, segment_size=4096,
+                              index_interval=4)
+
+        self.messages = [
+            Message(7, f"nick_{i}", 1_000 + i, 0b00, f"message {i}" * 10)
+            for i in range(200)
+        ]
+
+        for message in self.messages:
+            self.log.append(message.to_bytes(), message.timestamp)
+
+    def tearDown(self) -> None:
+        self.log.close()
+        self.directory.cleanup()
+
+    def decode(self, backlog: bytearray) -> list[Message]:
+        """
+        Decodes a buffer of encoded messages
+        """
+        messages = []
+        offset = 0
+
+        while offset < len(backlog):
+            messages.append(Message.from_buffer(backlog, offset))
+            offset += Message.frame_length(backlog, offset)
+
+        return messages
+
+    def test_read_newest(self) -> None:
+        """
+        Should replay the newest messages across segments
+        """
+        assert len(self.log.segments) > 1
+        assert len(self.log) == 200
+
+        assert self.decode(self.log.read_newest(50)) == self.messages[-50:]
+        assert self.decode(
+            self.log.read_newest(50, skip=10)
+        ) == self.messages[-60:-10]
+        assert self.decode(self.log.read_newest(1000)) == self.messages
+
+    def test_read_since(self) -> None:
+        """
+        Should replay every message since a timestamp
+        """
+        assert self.decode(self.log.read_since(1_123)) == self.messages[123:]
+        assert self.decode(self.log.read_since(0)) == self.messages
+        assert not self.log.read_since(5_000)
+
+    def test_read_since_out_of_order(self) -> None:
+        """
+        Messages relayed with older timestamps than the ones before them
+        shouldn't throw off finding where to replay from
+        """
+        log = ChannelLog(path.join(self.directory.name, "relayed"),
+                         segment_size=4096, index_interval=4)
+
+        # Every tenth message was relayed from long before, and one is far
+        # ahead of the rest
+        messages = [
+            Message(7, f"nick_{i}", 100 if i % 10 == 0 else 1_000 + i,
+                    0b00, f"message {i}" * 10)
+            for i in range(200)
+        ]
+        messages[150].timestamp = 9_999
+
+        for message in messages:
+            log.append(message.to_bytes(), message.timestamp)
+
+        assert self.decode(log.read_since(1_123)) == messages[123:]
+        assert self.decode(log.read_since(1_175)) == messages[150:]
+        assert self.decode(log.read_since(5_000)) == messages[150:]
+        assert not log.read_since(10_000)
+
+        log.close()
+
+    def test_keeps_segments_mapped(self) -> None:
+        """
+        Replays should reuse a segment's map until the segment grows
+        """
+        self.log.read_newest(1000)
+        sealed = self.log.segments[0].buffer
+        active = self.log.segments[-1].buffer
+
+        self.log.read_since(0)
+        assert self.log.segments[0].buffer is sealed
+        assert self.log.segments[-1].buffer is active
+
+        self.log.append(self.messages[0].to_bytes(), 2_000)
+        assert self.decode(self.log.read_newest(1)) == [self.messages[0]]
+        assert self.log.segments[0].buffer is sealed
+        assert self.log.segments[-1].buffer is not active
+
+    def test_log_directories(self) -> None:
+        """
+        Every channel name should get its own directory, including names
+        that look like an encoded one
+        """
+        names = ["ab", "ab ", "x-616220", "%616220", "../ab"]
+        directories = {
+            channel_log_directory("logs", name) for name in names
+        }
+
+        assert len(directories) == len(names)
+        assert all(
+            path.dirname(directory) == "logs" for directory in directories
+        )
+
+    def test_replays_capped(self) -> None:
+        """
+        Replays should only copy the newest messages out of the log, however
+        many are asked for
+        """
+        self.log.max_replay = 30
+
+        assert self.decode(self.log.read_newest(1000)) == self.messages[-30:]
+        assert self.decode(self.log.read_since(0)) == self.messages[-30:]
+        assert self.decode(
+            self.log.read_since(0, limit=10)
+        ) == self.messages[-10:]
+        assert self.decode(
+            self.log.read_since(1_195, limit=10)
+        ) == self.messages[-5:]
+
+    def test_channel_id_rewrite(self) -> None:
+        """
+        Replayed messages should take on the channel id asked for
+        """
+        for message in self.decode(self.log.read_newest(20, channel_id=3)):
+            assert message.channel_id == 3
+
+    def test_reopen_after_crash(self) -> None:
+        """
+        A reopened log should have every message, minus one cut off part
+        way through being written
+        """
+        self.log.segments[-1].log_file.write(self.messages[0].to_bytes()[:30])
+        self.log.close()
+
+        self.log = ChannelLog(self.directory.name, segment_size=4096,
+                              index_interval=4)
+
+        assert len(self.log) == 200
+        assert self.decode(self.log.read_newest(1000)) == self.messages
+
+        self.log.append(self.messages[0].to_bytes(), 2_000)
+        assert self.decode(self.log.read_newest(1)) == [self.messages[0]]
+
+
+class BlockingQueueTest(unittest.TestCase):
+    """
+    BlockingQueue test cases
+    """
+
+    def test_takes_everything_queued(self) -> None:
+        """
+        Every queued item should be taken at once, front items first
+        """
+        queue = BlockingQueue()
+
+        queue.append("b")
+        queue.append("c")
+        queue.appendleft("a")
+
+        assert queue.take_all() == ["a", "b", "c"]
+        assert len(queue) == 0
+        assert queue.take_all(timeout=0.01) == []
+
+    def test_wakes_consumer(self) -> None:
+        """
+        A waiting consumer should wake up for a new item, then stop once the
+        queue is closed and empty
+        """
+        queue = BlockingQueue()
+        taken = []
+
+        def consume() -> None:
+            while (items := queue.take_all()) is not None:
+                taken.extend(items)
+
+        thread = threading.Thread(target=consume)
+        thread.start()
+
+        queue.append(1)
+        time.sleep(0.05)
+        queue.append(2)
+        queue.close()
+
+        thread.join(timeout=1)
+
+        assert not thread.is_alive()
+        assert taken == [1, 2]
+
+
+class MetricsTest(unittest.TestCase):
+    """
+    Metrics registry test cases
+    """
+
+    def test_histogram_percentiles(self) -> None:
+        """
+        Percentiles should land within a factor of two of the truth
+        """
+        histogram = Histogram()
+
+        for i in range(1, 1001):
+            histogram.observe(i * 1e-6)
+
+        assert histogram.count == 1000
+        assert 500e-6 <= histogram.percentile(0.5) < 1000e-6
+        assert 990e-6 <= histogram.percentile(0.99) < 1980e-6
+
+    def test_render(self) -> None:
+        """
+        Counters, gauges and histograms should all be exposed, each metric
+        described once however many labels it has
+        """
+        metrics = Metrics()
+        queue = [1, 2, 3]
+
+        metrics.gauge("queued", "Queued items", lambda: len(queue))
+        metrics.broadcast("a", 5, 3e-6)
+        metrics.broadcast("b", 2, 1e-3)
+        metrics.broadcast("b", 2, 1e-3)
+        metrics.sent(40)
+
+        lines = metrics.render().splitlines()
+
+        assert "queued 3" in lines
+        assert 'channel_messages_total{channel="a"} 1' in lines
+        assert 'channel_messages_total{channel="b"} 2' in lines
+        assert "broadcast_recipients_total 9" in lines
+        assert "broadcast_seconds_count 3" in lines
+        assert 'broadcast_seconds_bucket{le="+Inf"} 3' in lines
+        assert "bytes_out_total 40" in lines
+        assert lines.count("# TYPE channel_messages_total counter") == 1
+
+    def test_label_escaping(self) -> None:
+        """
+        Quotes, backslashes and newlines in label values should be escaped
+        rather than breaking the exposition format
+        """
+        metrics = Metrics()
+
+        metrics.broadcast('a"b\\c\nd', 1, 1e-6)
+
+        assert (
+            'channel_messages_total{channel="a\\"b\\\\c\\nd"} 1'
+            in metrics.render().splitlines()
+        )
+
+    def test_forget_channel(self) -> None:
+        """
+        A destroyed channel's counter shouldn't be kept or exposed
+        """
+        metrics = Metrics()
+
+        metrics.broadcast("a", 1, 1e-6)
+        metrics.broadcast("b", 1, 1e-6)
+        metrics.forget_channel("a")
+
+        assert list(metrics.channel_rates()) == ["b"]
+        assert 'channel="a"' not in metrics.render()
+
+    def test_encodes_saved(self) -> None:
+        """
+        A broadcast to members and links should encode the message once,
+        saving an encode for every recipient but one, and count them
+        """
+        s_mems = ServerMembers("localhost", 0)
+        s_mems.metrics = Metrics()
+
+        members = [socket.socketpair() for _ in range(3)]
+        links = [socket.socketpair() for _ in range(2)]
+
+        channel = Channel(s_mems, None, "general")
+
+        for i, (connection, _) in enumerate(members):
+            channel.add_connection(connection, f"member{i}")
+
+        for i, (connection, _) in enumerate(links):
+            channel.link_channel(ChannelLinkInfo("general", "localhost",
+                                                 i + 1, connection, 7))
+
+        saved = channel.broadcast_message(
+            Message(0, "member0", time.time(), 0b00, "hello")
+        )
+
+        assert saved == len(members) + len(links) - 1
+        assert (
+            f"broadcast_encodes_saved_total {saved}"
+            in s_mems.metrics.render().splitlines()
+        )
+
+        # Links get the same message as a relay, with their channel id
+        relay = Message.from_bytes(links[0][1].recv(4096))
+
+        assert relay.channel_id == 7
+        assert relay.message_type == 0b11
+        assert relay.message == "hello"
+
+        for pair in members + links:
+            for connection in pair:
+                connection.close()
+
+        s_mems.selector.close()
+
+
+class LoggerTest(unittest.TestCase):
+    """
+    Log filtering and formatting test cases
+    """
+
+    @staticmethod
+    def make_record(conn: tuple = None) -> logging.LogRecord:
+        """
+        Creates a log record, for a connection if given
+        """
+        record = logging.makeLogRecord({
+            "msg": "Message received from %s", "args": (conn,)
+        })
+
+        if conn is not None:
+            record.conn = conn
+
+        return record
+
+    def test_rate_limit_per_connection(self) -> None:
+        """
+        Each connection should be limited separately, and told how many of
+        its messages were suppressed once its window ends
+        """
+        rate_filter = RateLimitFilter(max_messages=3, period=0.05)
+
+        passed = [rate_filter.filter(self.make_record(("a", 1)))
+                  for _ in range(10)]
+
+        assert passed == [True] * 3 + [False] * 7
+        assert rate_filter.filter(self.make_record(("b", 2)))
+        assert all(rate_filter.filter(self.make_record()) for _ in range(10))
+
+        time.sleep(0.06)
+
+        record = self.make_record(("a", 1))
+
+        assert rate_filter.filter(record)
+        assert "7 similar messages suppressed" in record.getMessage()
+
+    def test_json_format(self) -> None:
+        """
+        Extras should become fields of their own
+        """
+        record = self.make_record(("a", 1))
+        record.levelname = "DEBUG"
+
+        entry = json.loads(JsonFormatter().format(record))
+
+        assert entry["level"] == "debug"
+        assert entry["message"] == "Message received from ('a', 1)"
+        assert entry["conn"] == "('a', 1)"
+
+
+class AliasDictionaryTest(unittest.TestCase):
+    """
+    Alias dictionary test cases
+    """
+
+    @staticmethod
+    def make_dictionary() -> AliasDictionary:
+        """
+        Creates a dictionary of channels keyed by id with names as aliases
+        """
+        dictionary = AliasDictionary()
+
+        for i in range(5):
+            dictionary[i] = f"channel {i}"
+            dictionary.add_alias(i, f"name_{i}")
+
+        return dictionary
+
+    def test_delete_removes_aliases(self) -> None:
+        """
+        Deleting by key or by alias should remove the key and every alias
+        pointing to it, and nothing else
+        """
+        dictionary = self.make_dictionary()
+        dictionary.add_alias(1, "other_name_1")
+
+        del dictionary[1]
+        del dictionary["name_3"]
+
+        assert 1 not in dictionary and "other_name_1" not in dictionary
+        assert 3 not in dictionary and "name_3" not in dictionary
+
+        assert sorted(dictionary.values()) == [
+            "channel 0", "channel 2", "channel 4"
+        ]
+        assert list(dictionary) == [0, 2, 4, "name_0", "name_2", "name_4"]
+
+    def test_rebound_alias(self) -> None:
+        """
+        An alias moved to another key shouldn't be deleted with its old one
+        """
+        dictionary = self.make_dictionary()
+        dictionary.add_alias(2, "name_0")
+
+        del dictionary[0]
+
+        assert dictionary["name_0"] == "channel 2"
+
+    def test_iteration_is_a_view(self) -> None:
+        """
+        Iterating shouldn't copy, so changes while iterating are caught
+        like they are for a dict
+        """
+        dictionary = self.make_dictionary()
+
+        with self.assertRaises(RuntimeError):
+            for key in dictionary:
+                del dictionary[key]
+
+
+class ChannelResolverTest(unittest.TestCase):
+    """
+    Channel and link lookup test cases
+    """
+
+    def setUp(self) -> None:
+        self.s_mems = ServerMembers("localhost", 0)
+        self.connections = [socket.socketpair() for _ in range(2)]
+
+        for name in ("general", "random"):
+            channel = Channel(self.s_mems, None, name)
+            self.s_mems.channels[channel.id] = channel
+            self.s_mems.channels.add_alias(channel.id, name)
+
+    def tearDown(self) -> None:
+        for pair in self.connections:
+            for connection in pair:
+                connection.close()
+
+        self.s_mems.selector.close()
+
+    def link(self, channel_name: str, port: int,
+             connection: socket.socket) -> ChannelLinkInfo:
+        """
+        Links a channel to the channel of the same name on another server
+        """
+        link_info = ChannelLinkInfo(channel_name, "localhost", port,
+                                    connection, 0)
+
+        self.s_mems.resolve_channel(channel_name).link_channel(link_info)
+
+        return link_info
+
+    def test_resolve_by_name_and_id(self) -> None:
+        """
+        Channels should be found by name or id, and nothing else
+        """
+        general = self.s_mems.resolve_channel("general")
+
+        assert general.name == "general"
+        assert self.s_mems.resolve_channel(general.id) is general
+        assert self.s_mems.resolve_channel("missing") is None
+
+    def test_resolve_link(self) -> None:
+        """
+        Links should be found by channel name and server, and forgotten
+        once unlinked or their channel is destroyed
+        """
+        connection = self.connections[0][0]
+
+        link_info = self.link("general", 1, connection)
+        self.link("random", 1, connection)
+
+        assert self.s_mems.resolve_link("general", "localhost", 1) is link_info
+        assert self.s_mems.resolve_link("general", "localhost", 2) is None
+
+        self.s_mems.resolve_channel("general").unlink_channel(
+            "general", "localhost", 1
+        )
+        assert self.s_mems.resolve_link("general", "localhost", 1) is None
+
+        self.s_mems.resolve_channel("random").destroy()
+        assert self.s_mems.resolve_link("random", "localhost", 1) is None
+        assert not self.s_mems.connection_links
+
+    def test_drop_links(self) -> None:
+        """
+        Dropping a connection's links should leave links over other
+        connections, including a link that was moved off it
+        """
+        old, new = self.connections[0][0], self.connections[1][0]
+
+        self.link("general", 1, old)
+        self.link("random", 1, old)
+        self.link("random", 1, new)  # Relinked over another connection
+
+        dropped = self.s_mems.drop_links(old)
+
+        assert [link_info.channel_name for link_info in dropped] == [
+            "general"
+        ]
+        assert self.s_mems.resolve_link("random", "localhost", 1)
+
+
+class ConfigCacheTest(unittest.TestCase):
+    """
+    Config file cache test cases
+    """
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = path.join(self.directory.name, "MOTD.txt")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def write(self, text: str) -> None:
+        """
+        Writes the config file
+        """
+        with open(self.path, "w", encoding="ascii") as file:
+            file.write(text)
+
+    def test_cached_until_changed(self) -> None:
+        """
+        The encoded message should be reused until the file changes, and
+        the new text sent once it is polled again
+        """
+        cache = ConfigCache(self.directory.name, poll_interval=0)
+        self.write("Welcome!")
+
+        encoding = cache.get_encoding("MOTD.txt", "No MOTD")
+
+        assert Message.from_bytes(encoding).message == "Welcome!"
+
+        # Only rebuilt when its timestamp goes out of date
+        again = cache.get_encoding("MOTD.txt", "No MOTD")
+        assert again is encoding or again[38:] == encoding[38:]
+
+        self.write("Welcome back!")
+
+        encoding = cache.get_encoding("MOTD.txt", "No MOTD")
+        assert Message.from_bytes(encoding).message == "Welcome back!"
+
+    def test_not_polled_within_interval(self) -> None:
+        """
+        Changes shouldn't be looked for more often than the poll interval
+        """
+        cache = ConfigCache(self.directory.name, poll_interval=60)
+        self.write("Welcome!")
+
+        cache.get_encoding("MOTD.txt", "No MOTD")
+        self.write("Changed")
+
+        encoding = cache.get_encoding("MOTD.txt", "No MOTD")
+        assert Message.from_bytes(encoding).message == "Welcome!"
+
+    def test_missing_file(self) -> None:
+        """
+        A missing file should send the fallback text until it is created
+        """
+        cache = ConfigCache(self.directory.name, poll_interval=0)
+
+        encoding = cache.get_encoding("MOTD.txt", "No MOTD")
+        assert Message.from_bytes(encoding).message == "No MOTD"
+
+        self.write("Welcome!")
+
+        encoding = cache.get_encoding("MOTD.txt", "No MOTD")
+        assert Message.from_bytes(encoding).message == "Welcome!"
+
+
+class PeerPoolTest(unittest.TestCase):
+    """
+    Server-to-server connection pool test cases
+    """
+
+    def setUp(self) -> None:
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(("localhost", 0))
+        self.listener.listen()
+
+        self.peer = self.listener.getsockname()[:2]
+        self.s_mems = ServerMembers("localhost", 0)
+
+    def tearDown(self) -> None:
+        for connection in list(self.s_mems.conns):
+            connection.close()
+
+        self.s_mems.selector.close()
+        self.listener.close()
+
+    def get(self) -> socket.socket | None:
+        """
+        Gets the connection to the peer on another thread, as the server
+        does, while this one takes it over like the server loop would
+        """
+        result = []
+
+        thread = threading.Thread(
+            target=lambda: result.append(self.s_mems.peers.get(*self.peer))
+        )
+        thread.start()
+
+        while thread.is_alive():
+            self.s_mems.take_server_connections()
+            thread.join(0.01)
+
+        return result[0]
+
+    def test_reuses_connection(self) -> None:
+        """
+        Every request for the same peer should share one connection, which
+        is registered by the thread taking it over
+        """
+        pool = self.s_mems.peers
+
+        connection = self.get()
+
+        assert connection is not None
+        assert connection in self.s_mems.conns
+        assert self.s_mems.selector.get_key(connection).data is (
+            self.s_mems.conns[connection]
+        )
+        assert all(pool.get(*self.peer) is connection for _ in range(5))
+
+        assert len(pool) == 1
+        assert pool.stats()["connects"] == 1
+        assert pool.stats()["reuses"] == 5
+
+        # Nothing is left behind for peers no longer being connected to
+        assert not pool.connecting
+
+    def test_reconnects_when_unhealthy(self) -> None:
+        """
+        A connection that has closed or broken should be replaced by a new
+        one rather than handed out
+        """
+        pool = self.s_mems.peers
+
+        connection = self.get()
+        self.s_mems.conns[connection].outbound.broken = True
+
+        assert pool.unhealthy() == [connection]
+
+        replacement = self.get()
+
+        assert replacement is not connection
+        assert pool.stats()["reconnects"] == 1
+
+        # Closed connections are forgotten
+        self.s_mems.remove_connection(self.s_mems.conns[replacement])
+        pool.discard(replacement)
+
+        assert len(pool) == 0
+
+    def test_unreachable_peer(self) -> None:
+        """
+        Failing to connect should be counted and nothing pooled
+        """
+        self.listener.close()
+
+        assert self.get() is None
+        assert self.s_mems.peers.stats()["failures"] == 1
+        assert len(self.s_mems.peers) == 0
+        assert not self.s_mems.peers.connecting
+
+    def test_cancelled_connect(self) -> None:
+        """
+        Coroutines waiting on a connection another one is making should get
+        None, rather than wait forever, if that one is cancelled
+        """
+        pool = self.s_mems.peers
+
+        async def connector(_hostname: str, _port: int) -> None:
+            await asyncio.Event().wait()  # Never connects
+
+        async def cancel_connect() -> socket.socket | None:
+            connecting = asyncio.ensure_future(pool.get_async(*self.peer))
+            await asyncio.sleep(0)
+
+            waiting = asyncio.ensure_future(pool.get_async(*self.peer))
+            await asyncio.sleep(0)
+
+            connecting.cancel()
+
+            return await asyncio.wait_for(waiting, 1)
+
+        self.s_mems.connector = connector
+
+        assert asyncio.run(cancel_connect()) is None
+        assert not pool.connecting
+
+
+@unittest.skipUnless(HAS_CRYPTO, "pycryptodome isn't installed")
+class AuthenticatorTest(unittest.TestCase):
+    """
+    Challenge-response sign in test cases
+    """
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.keys = [RSA.generate(2048) for _ in range(2)]
+
+    def setUp(self) -> None:
+        self.authenticator = Authenticator(workers=2, pool_size=8)
+
+    def tearDown(self) -> None:
+        self.authenticator.close()
+
+    def sign_in(self, conn_info: object, nickname: str, key,
+                challenge: bytes = None, printable_key: str = None) -> list:
+        """
+        Signs a new challenge (or the one given) and waits for the result.
+        The key's public key is sent unless another printable key is given
+        """
+        authenticator = self.authenticator
+        signed = authenticator.take_challenge()
+
+        if not authenticator.verify(conn_info, challenge or signed, nickname,
+                                    printable_key or export_public_key(key),
+                                    solve_challenge(signed, key)):
+            return [(conn_info, nickname, False)]
+
+        deadline = time.monotonic() + 5
+
+        while time.monotonic() < deadline:
+            finished = authenticator.finished()
+
+            if finished:
+                return finished
+
+            time.sleep(0.01)
+
+        raise AssertionError("Signature was never verified")
+
+    def test_loads_when_needed(self) -> None:
+        """
+        pycryptodome and the thread pool should only be loaded once the
+        first challenge is needed
+        """
+        assert self.authenticator.auth is None
+        assert self.authenticator.executor is None
+
+        self.authenticator.take_challenge()
+
+        assert self.authenticator.auth is not None
+        assert self.authenticator.executor is not None
+
+    def test_signs_in(self) -> None:
+        """
+        A correctly signed challenge should sign in, importing the key once
+        """
+        assert self.sign_in("a", "alice", self.keys[0]) == [
+            ("a", "alice", True)
+        ]
+        assert self.sign_in("b", "alice", self.keys[0]) == [
+            ("b", "alice", True)
+        ]
+
+        stats = self.authenticator.stats()
+
+        assert stats["verified"] == 2
+        assert stats["key_cache_misses"] == 1
+        assert stats["key_cache_hits"] == 1
+
+    def test_wrong_signature(self) -> None:
+        """
+        Signing a different challenge shouldn't sign in or claim the
+        nickname
+        """
+        other = self.authenticator.take_challenge()
+
+        assert self.sign_in("a", "alice", self.keys[0], other) == [
+            ("a", "alice", False)
+        ]
+        assert self.sign_in("b", "alice", self.keys[1]) == [
+            ("b", "alice", True)
+        ]
+
+    def test_unacceptable_keys(self) -> None:
+        """
+        Keys that are slow to verify with, or private keys, shouldn't sign
+        in. Ones too long to be acceptable shouldn't even be imported
+        """
+        small = RSA.generate(1024)
+        small_exponent = RSA.generate(2048, e=3)
+
+        assert not self.sign_in("a", "alice", small)[0][2]
+        assert not self.sign_in("b", "bob", small_exponent)[0][2]
+        assert not self.sign_in(
+            "c", "carol", self.keys[0],
+            printable_key=self.keys[0].export_key().decode()
+        )[0][2]
+
+        huge = RSA.construct(
+            ((1 << 16383) + 1, (1 << 16382) + 1), consistency_check=False
+        )
+        assert not self.sign_in(
+            "d", "dave", self.keys[0],
+            printable_key=huge.export_key().decode()
+        )[0][2]
+
+        stats = self.authenticator.stats()
+
+        # The private key and the huge key are too long to be imported
+        assert stats["rejected"] == 4
+        assert stats["key_cache_misses"] == 2
+        assert not self.authenticator.keys
+
+    def test_nickname_bound_to_key(self) -> None:
+        """
+        Once signed in with, a nickname should only sign in with the same
+        key
+        """
+        assert self.sign_in("a", "alice", self.keys[0])[0][2]
+        assert not self.sign_in("b", "alice", self.keys[1])[0][2]
+        assert self.sign_in("c", "bob", self.keys[1])[0][2]
+
+        assert self.authenticator.stats()["rejected"] == 1
+
+    def test_challenge_pool(self) -> None:
+        """
+        Challenges should never repeat, and the pool should be topped up
+        in the background once it runs low
+        """
+        challenges = {
+            self.authenticator.take_challenge() for _ in range(32)
+        }
+
+        assert len(challenges) == 32
+
+        deadline = time.monotonic() + 5
+
+        while (len(self.authenticator.challenges) < 8 and
+               time.monotonic() < deadline):
+            time.sleep(0.01)
+
+        assert len(self.authenticator.challenges) == 8
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,247 @@
+"""
+Testcases for running a server as several worker processes
+"""
+
+# pylint: disable=import-error, wrong-import-order, wrong-import-position
+
+import os
+import socket
+import subprocess
+import time
+import unittest
+import rick_utils
+from rick_utils import (
+    execute_await,
+    execute_sequence_await,
+    await_response,
+    set_output_file,
+    DechatTestcase
+)
+
+import sys
+from os import path
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+from server import apply_replica
+from src.channel import Channel
+from src.commons import ServerMembers
+from src.workers import WorkerGroup
+from src.message import Message
+from src.protocol import message_send
+from src.constants import SERVER_CHANNEL_ID, WORKER_FLAG, REPLICATE_FLAG, SEP
+
+WORKERS_SERVER = ("localhost", 9995)
+NUM_WORKERS = 4
+
+# Enough clients that some are almost certainly on different workers
+NUM_CLIENTS = 8
+
+server_instance = []
+
+
+class WorkersTest(DechatTestcase):
+    """
+    Worker test cases
+    """
+
+    @staticmethod
+    def setUpClass() -> None:
+        os.makedirs(os.path.dirname(rick_utils.OUTPUT_FILE), exist_ok=True)
+
+        # Clears log file
+        open(rick_utils.OUTPUT_FILE, "w", encoding="ascii").close()
+        print("Starting server")
+        server_instance.append(subprocess.Popen(
+            [
+                "python3", "server.py",
+                WORKERS_SERVER[0], str(WORKERS_SERVER[1]),
+                f"--workers={NUM_WORKERS}"
+            ],
+            stdout=subprocess.DEVNULL
+        ))
+
+        time.sleep(1)  # Gives time for every worker to start
+
+        if server_instance[0].poll() is not None:
+            raise RuntimeError("Failure to start server")
+
+    @staticmethod
+    def tearDownClass() -> None:
+        print("Killing server")
+        server_instance[0].terminate()
+        server_instance[0].wait()
+
+    def test_message_across_workers(self) -> None:
+        """
+        Every member of a channel should receive every message, whichever
+        worker they ended up on
+        """
+        clients = DechatTestcase.create_clients(NUM_CLIENTS)
+
+        self.clients = clients
+
+        for i, client in enumerate(clients):
+            execute_await(f"/nick client_{i}", client)
+            DechatTestcase.connect(client, WORKERS_SERVER)
+
+        execute_await("/create shared", clients[0])
+
+        for client in clients[1:]:
+            execute_await("/join shared", client)
+
+        for i, client in enumerate(clients):
+            execute_await(f"Hello from client {i}", client)
+
+        await_response(clients[-1], buffer_cleared=False)
+
+        for client in clients:
+            lines = "\n".join(client.get_all_lines())
+
+            for i in range(NUM_CLIENTS):
+                assert f"Hello from client {i}" in lines
+
+    def test_list_across_workers(self) -> None:
+        """
+        A channel created on one worker should be listed and joinable on
+        every worker
+        """
+        clients = DechatTestcase.create_clients(NUM_CLIENTS)
+
+        self.clients = clients
+
+        for client in clients:
+            DechatTestcase.connect(client, WORKERS_SERVER)
+
+        execute_await("/create listed secret", clients[0])
+
+        time.sleep(0.5)
+
+        for client in clients[1:]:
+            response = execute_await("/list", client)
+            assert "listed" in response[-1]
+
+            response = execute_await("/join listed", client)
+            assert "wrong password" in response[-1]
+
+    def test_password_across_workers(self) -> None:
+        """
+        A password set after a channel was created should apply on every
+        worker
+        """
+        clients = DechatTestcase.create_clients(NUM_CLIENTS)
+
+        self.clients = clients
+
+        for client in clients:
+            DechatTestcase.connect(client, WORKERS_SERVER)
+
+        execute_await("/create guarded", clients[0])
+
+        # /pass doesn't answer, so /list is sent after it to wait on
+        execute_sequence_await(["/pass changed", "/list"], clients[0])
+
+        time.sleep(0.5)
+
+        for client in clients[1:]:
+            response = execute_await("/join guarded", client)
+            assert "wrong password" in response[-1]
+
+            response = execute_await("/join guarded changed", client)
+            assert "wrong password" not in "\n".join(response)
+
+    def test_worker_messages_from_clients(self) -> None:
+        """
+        Worker messages sent to the public port shouldn't be taken as coming
+        from a worker: no channel should be replicated and the server should
+        keep running
+        """
+        with socket.create_connection(WORKERS_SERVER) as connection:
+            for msg in (SEP.join((WORKER_FLAG, "0")),
+                        SEP.join((REPLICATE_FLAG, "forged", "")),
+                        SEP.join((WORKER_FLAG, "not a worker"))):
+                message_send(
+                    Message(SERVER_CHANNEL_ID, "", time.time(), 0b10, msg),
+                    connection
+                )
+
+            time.sleep(0.5)
+
+        clients = DechatTestcase.create_clients(NUM_CLIENTS)
+
+        self.clients = clients
+
+        for client in clients:
+            DechatTestcase.connect(client, WORKERS_SERVER)
+
+            response = execute_await("/list", client)
+            assert "forged" not in "\n".join(response)
+
+        assert server_instance[0].poll() is None
+
+
+class ConcurrentCreationTest(unittest.TestCase):
+    """
+    A channel created on two workers at once, as seen by one of them
+    """
+
+    def setUp(self) -> None:
+        self.s_mems = ServerMembers("localhost", 0)
+        self.creator, self.creator_end = socket.socketpair()
+
+        self.channel = Channel(self.s_mems, self.creator, "race", "mine")
+        self.channel.add_connection(self.creator, "creator", "mine")
+
+        self.s_mems.channels[self.channel.id] = self.channel
+        self.s_mems.channels.add_alias(self.channel.id, "race")
+
+    def tearDown(self) -> None:
+        self.creator.close()
+        self.creator_end.close()
+        self.s_mems.selector.close()
+
+    def receive_replica(self, index: int, created_on: int) -> None:
+        """
+        Has worker index receive the other worker's replica of the channel
+        """
+        self.s_mems.workers = WorkerGroup(
+            index, [("localhost", 0)] * NUM_WORKERS, None
+        )
+        self.channel.created_on = index
+
+        apply_replica(
+            SEP.join((REPLICATE_FLAG, "race", "theirs", "10",
+                      str(created_on))),
+            None,
+            self.s_mems
+        )
+
+    def test_lower_index_wins(self) -> None:
+        """
+        The copy created on a lower worker index should replace this
+        worker's, which loses its admin
+        """
+        self.receive_replica(2, 1)
+
+        assert self.channel.password == "theirs"
+        assert self.channel.messages_to_store == 10
+        assert self.channel.created_on == 1
+        assert self.channel.creator is None
+
+        self.creator_end.settimeout(1)
+        assert b"no longer its admin" in self.creator_end.recv(4096)
+
+    def test_higher_index_loses(self) -> None:
+        """
+        The copy created on a higher worker index should change nothing
+        """
+        self.receive_replica(1, 2)
+
+        assert self.channel.password == "mine"
+        assert self.channel.messages_to_store == 50
+        assert self.channel.created_on == 1
+        assert self.channel.creator is self.creator
+
+
+if __name__ == "__main__":
+    set_output_file("test/logs/workers_logs.txt")
+    unittest.main() # run all tests